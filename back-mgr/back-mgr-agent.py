@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+back-mgr-agent - 远程文件索引代理
+
+由 back-mgr 经 SSH 部署到远程主机（~/.cache/back-mgr/agent-<内容哈希>.py），只依赖 Python 标准库。
+为每个 (目录, 排除规则) 在 ~/.cache/back-mgr 下维护持久索引: 每个文件的 (大小, mtime, 哈希, 最后变化的代数)
+和每个目录的 mtime。每次运行时只重新列出 mtime 变化过的目录（新增、删除、重命名都会改变所在目录的
+mtime），其余目录沿用上次的文件列表、只 lstat 其中已知的文件，然后输出自指定代数以来的变化。
+
+--quick 时连已知文件也不 stat，只看目录的 mtime。就地修改文件内容不会改变目录的 mtime，
+这类修改要到下一次完整扫描（--full，或距上次完整扫描超过 --full-after 秒）时才会被发现。
+
+输出（zlib 压缩后写到 stdout）:
+    b'BMGA' 版本(u8) 标志(u8, bit0=完整清单) 状态ID(16 字节) 代数(u64) 统计长度(u32) 统计(JSON)
+    之后是记录，直到结束:
+    b'+' 路径长度(u32) 路径 大小(u64) mtime(i64) 哈希长度(u8) 哈希   新增或变化的文件/符号链接
+    b'-' 路径长度(u32) 路径                                          已删除
+    b'/' 路径长度(u32) 路径                                          目录（每次输出全部子目录）
+"""
+
+import os
+import sys
+import stat
+import json
+import time
+import zlib
+import fcntl
+import pickle
+import struct
+import fnmatch
+import hashlib
+import argparse
+
+AGENT_MAGIC = b'BMGA'
+FORMAT_VERSION = 1
+
+# 索引文件所在目录
+STATE_DIR = os.path.expanduser('~/.cache/back-mgr')
+
+# 删除记录保留的代数，请求更早的代数时输出完整清单
+TOMBSTONE_GENERATIONS = 256
+
+# 读取文件计算哈希的块大小
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def is_excluded(path, exclude):
+    """按 tar --exclude 的语义判断文件是否被排除（与 back-mgr 的同名函数一致）"""
+    parts = path.split('/')
+    candidates = ['/'.join(parts[:i]) for i in range(1, len(parts) + 1)] + parts
+    for pattern in exclude:
+        tar_pattern = pattern.replace("/**", "").rstrip("/")
+        if any(fnmatch.fnmatch(c, tar_pattern) for c in candidates):
+            return True
+    return False
+
+
+def file_sha256(path):
+    """文件的 SHA-256（原始字节），读取失败时返回 None"""
+    digest = hashlib.sha256()
+    try:
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(HASH_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+    except OSError:
+        return None
+    return digest.digest()
+
+
+class FileIndex:
+    """一个目录的持久文件索引
+
+    state:
+        id          索引的随机 ID，索引重建后变化，请求方据此判断代数是否还有意义
+        generation  当前代数，每次刷新加 1
+        floor       更早的删除记录已清理，请求的代数小于它时只能输出完整清单
+        lastFull    上次完整扫描的时间
+        dirs        {目录相对路径: [mtime_ns, [文件名], [子目录相对路径]]}
+        files       {文件相对路径: (大小, mtime, 哈希或 None, 最后变化的代数)}
+        deleted     {已删除文件的相对路径: 删除时的代数}
+    """
+
+    def __init__(self, root, exclude):
+        self.root = root
+        self.exclude = exclude
+        key = hashlib.sha256('\0'.join([root] + sorted(exclude)).encode('utf-8', 'surrogateescape')).hexdigest()
+        self.path = os.path.join(STATE_DIR, 'index-{}.state'.format(key[:16]))
+        self.state = None
+
+    def load(self):
+        """读取索引，不存在或无法读取时新建一个空索引"""
+        try:
+            with open(self.path, 'rb') as f:
+                state = pickle.loads(zlib.decompress(f.read()))
+            if state.get('version') == FORMAT_VERSION and state.get('root') == self.root:
+                self.state = state
+                return
+        except (OSError, EOFError, ValueError, zlib.error, pickle.UnpicklingError, AttributeError):
+            pass
+        self.state = {
+            'version': FORMAT_VERSION, 'root': self.root, 'id': os.urandom(16),
+            'generation': 0, 'floor': 0, 'lastFull': 0.0,
+            'dirs': {}, 'files': {}, 'deleted': {},
+        }
+
+    def save(self):
+        """原子写入索引（先写临时文件再重命名）"""
+        temp = '{}.{}'.format(self.path, os.getpid())
+        with open(temp, 'wb') as f:
+            f.write(zlib.compress(pickle.dumps(self.state, protocol=4), 1))
+        os.replace(temp, self.path)
+
+    def refresh(self, full=False, quick=False, do_hash=False):
+        """刷新索引，返回统计信息
+
+        full 为 True（或索引为空）时重新列出所有目录；否则 mtime 未变化的目录沿用上次的文件列表，
+        只 lstat 其中的文件（quick 时也不 stat），然后进入其子目录。
+        """
+        state = self.state
+        gen = state['generation'] + 1
+        dirs = state['dirs']
+        full = full or not dirs
+        stats = {'dirs': 0, 'rescanned': 0, 'checked': 0, 'changed': 0, 'deleted': 0, 'errors': 0, 'full': full}
+        start = time.time()
+
+        seen = set()
+        stack = ['']
+        while stack:
+            rel = stack.pop()
+            path = os.path.join(self.root, rel) if rel else self.root
+            try:
+                mtime_ns = os.lstat(path).st_mtime_ns
+            except OSError:
+                continue
+            seen.add(rel)
+            stats['dirs'] += 1
+            old = dirs.get(rel)
+            if old is not None and not full and old[0] == mtime_ns:
+                if not quick:
+                    self._check_files(rel, path, old[1], gen, do_hash, stats)
+                stack.extend(old[2])
+                continue
+
+            listing = self._scan_dir(rel, path, gen, do_hash, old, stats)
+            if listing is None:
+                # 无法读取的目录保留上次的内容，下次重试
+                stats['errors'] += 1
+                if old is not None:
+                    stack.extend(old[2])
+                continue
+            stats['rescanned'] += 1
+            dirs[rel] = [mtime_ns, listing[0], listing[1]]
+            stack.extend(listing[1])
+
+        # 已不存在（或被重命名）的目录: 其中的文件记为删除
+        for rel in [d for d in dirs if d not in seen]:
+            for name in dirs.pop(rel)[1]:
+                self._delete(rel + '/' + name if rel else name, gen, stats)
+
+        floor = gen - TOMBSTONE_GENERATIONS
+        if floor > state['floor']:
+            state['deleted'] = {path: g for path, g in state['deleted'].items() if g > floor}
+            state['floor'] = floor
+        state['generation'] = gen
+        if full:
+            state['lastFull'] = time.time()
+        stats['files'] = len(state['files'])
+        stats['seconds'] = round(time.time() - start, 3)
+        return stats
+
+    def _scan_dir(self, rel, path, gen, do_hash, old, stats):
+        """重新列出一个目录，更新其中文件的记录，返回 ([文件名], [子目录]) 或 None（无法读取）"""
+        try:
+            with os.scandir(path) as it:
+                entries = list(it)
+        except OSError:
+            return None
+
+        names, subdirs = [], []
+        for entry in entries:
+            child = rel + '/' + entry.name if rel else entry.name
+            if is_excluded(child, self.exclude):
+                continue
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(child)
+                    continue
+                regular = entry.is_file(follow_symlinks=False)
+                if not regular and not entry.is_symlink():
+                    continue
+                st = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            names.append(entry.name)
+            self._update(child, entry.path, st, regular, gen, do_hash, stats)
+
+        if old is not None:
+            for name in set(old[1]) - set(names):
+                self._delete(rel + '/' + name if rel else name, gen, stats)
+        return names, subdirs
+
+    def _check_files(self, rel, path, names, gen, do_hash, stats):
+        """lstat 未重新列出的目录中已知的文件，发现就地修改"""
+        for name in names:
+            child = rel + '/' + name if rel else name
+            file_path = os.path.join(path, name)
+            try:
+                st = os.lstat(file_path)
+            except OSError:
+                # 目录 mtime 未变但文件已不在（mtime 精度不足时可能发生），下次重新列出该目录
+                self._delete(child, gen, stats)
+                self.state['dirs'][rel][0] = None
+                continue
+            stats['checked'] += 1
+            self._update(child, file_path, st, stat.S_ISREG(st.st_mode), gen, do_hash, stats)
+
+    def _update(self, child, file_path, st, regular, gen, do_hash, stats):
+        """大小或 mtime 变化时更新文件记录"""
+        files = self.state['files']
+        size, mtime = st.st_size, int(st.st_mtime)
+        known = files.get(child)
+        if known is not None and known[0] == size and known[1] == mtime:
+            return
+        digest = file_sha256(file_path) if do_hash and regular else None
+        files[child] = (size, mtime, digest, gen)
+        self.state['deleted'].pop(child, None)
+        stats['changed'] += 1
+
+    def _delete(self, path, gen, stats):
+        if self.state['files'].pop(path, None) is not None:
+            self.state['deleted'][path] = gen
+            stats['deleted'] += 1
+
+    def write_changes(self, out, since, state_id, stats):
+        """输出自 since 代以来的变化；索引 ID 不符或删除记录已清理时输出完整清单"""
+        state = self.state
+        full = (since <= 0 or state_id != state['id'].hex()
+                or since < state['floor'] or since > state['generation'])
+        stats_data = json.dumps(stats).encode('utf-8')
+        compressor = zlib.compressobj(6)
+        buf = bytearray(AGENT_MAGIC)
+        buf += struct.pack('>BB', FORMAT_VERSION, 1 if full else 0)
+        buf += state['id']
+        buf += struct.pack('>QI', state['generation'], len(stats_data))
+        buf += stats_data
+
+        for path, (size, mtime, digest, gen) in state['files'].items():
+            if full or gen > since:
+                name = os.fsencode(path)
+                digest = digest or b''
+                buf += struct.pack('>cI', b'+', len(name)) + name
+                buf += struct.pack('>QqB', size, mtime, len(digest)) + digest
+                if len(buf) >= HASH_CHUNK_SIZE:
+                    out.write(compressor.compress(bytes(buf)))
+                    buf.clear()
+        if not full:
+            for path, gen in state['deleted'].items():
+                if gen > since:
+                    name = os.fsencode(path)
+                    buf += struct.pack('>cI', b'-', len(name)) + name
+        for path in state['dirs']:
+            if path:
+                name = os.fsencode(path)
+                buf += struct.pack('>cI', b'/', len(name)) + name
+                if len(buf) >= HASH_CHUNK_SIZE:
+                    out.write(compressor.compress(bytes(buf)))
+                    buf.clear()
+        out.write(compressor.compress(bytes(buf)))
+        out.write(compressor.flush())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='back-mgr 远程文件索引代理')
+    parser.add_argument('command', choices=['changes'], help='changes: 刷新索引并输出自 --since 代以来的变化')
+    parser.add_argument('--root', required=True, help='要索引的目录')
+    parser.add_argument('--since', type=int, default=0, help='请求方已知的代数，0 表示输出完整清单')
+    parser.add_argument('--state-id', default='', help='请求方已知的索引 ID（十六进制）')
+    parser.add_argument('--exclude', action='append', default=[], help='排除的文件模式（tar --exclude 语义）')
+    parser.add_argument('--hash', action='store_true', help='为新增或变化的文件计算 SHA-256')
+    parser.add_argument('--full', action='store_true', help='完整扫描: 重新列出所有目录')
+    parser.add_argument('--quick', action='store_true',
+                        help='只根据目录 mtime 判断变化，不 stat 未变化目录中的文件（就地修改要到完整扫描时才发现）')
+    parser.add_argument('--full-after', type=float, default=0,
+                        help='距上次完整扫描超过该秒数时进行完整扫描（0 表示不自动进行）')
+    args = parser.parse_args()
+
+    root = args.root.rstrip('/') or '/'
+    if not os.path.isdir(root):
+        sys.stderr.write('目录不存在: {}\n'.format(root))
+        sys.exit(2)
+
+    os.makedirs(STATE_DIR, exist_ok=True)
+    index = FileIndex(root, args.exclude)
+    # 同一目录的多个备份同时运行时依次刷新
+    with open(index.path + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        index.load()
+        full = args.full or (args.full_after > 0 and time.time() - index.state['lastFull'] > args.full_after)
+        stats = index.refresh(full=full, quick=args.quick, do_hash=args.hash)
+        index.save()
+        index.write_changes(sys.stdout.buffer, args.since, args.state_id, stats)
+        sys.stdout.buffer.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -6,19 +6,274 @@ back-mgr - 远程项目备份与还原工具
 
 import os
 import sys
+import io
+import random
+import signal
+import socket
+import asyncio
 import json
+import gzip
+import zlib
+import hashlib
+import base64
+import hmac
 import subprocess
 import datetime
 import argparse
 import shutil
+import shlex
+import struct
+import re
+import fnmatch
+import tempfile
+import time
+import threading
+import bisect
+import contextlib
+import mmap
+import tarfile
+import http.client
+import urllib.parse
+from xml.etree import ElementTree
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple
 
+# 可选依赖: 项目配置 sshTransport 为 paramiko 时使用进程内 SSH 连接
+try:
+    import paramiko
+except ImportError:
+    paramiko = None
+
+# 可选依赖: 项目配置 encryptSensitive 为 true 时用 AES-256-GCM 加密压缩包、数据库导出和去重数据块
+try:
+    from cryptography.exceptions import InvalidTag
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+except ImportError:
+    AESGCM = None
+
 # 配置目录和文件
 CONFIG_DIR = Path.home() / ".back-mgr"
 PROJECTS_FILE = CONFIG_DIR / "projects.json"
 LOG_DIR = CONFIG_DIR / "logs"
 
+# 流式传输的块大小（内存占用与数据量无关）
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+# 压缩格式: 文件扩展名、压缩命令（{threads} 为线程参数）、解压命令、远程缺少工具时的回退格式
+COMPRESSORS = {
+    'none': {'ext': '', 'compress': None, 'decompress': None, 'fallback': None},
+    'gzip': {'ext': '.gz', 'compress': 'gzip -c', 'decompress': 'gzip -dc', 'fallback': None},
+    'pigz': {'ext': '.gz', 'compress': 'pigz -c{threads}', 'decompress': 'pigz -dc', 'fallback': 'gzip'},
+    'zstd': {'ext': '.zst', 'compress': 'zstd -c -q{threads}', 'decompress': 'zstd -dc -q', 'fallback': 'pigz'},
+    'lz4': {'ext': '.lz4', 'compress': 'lz4 -c -q', 'decompress': 'lz4 -dc -q', 'fallback': 'gzip'},
+}
+
+# 增量链中每个版本的文件索引（路径、大小、mtime、可选哈希）
+FILE_INDEX_NAME = 'file-index.json.gz'
+
+# 管道中 tar/导出命令的退出码会被压缩程序掩盖，失败时向 stderr 输出该标记
+PIPE_FAILED_MARKER = 'BACKMGR_PIPE_FAILED'
+
+# 增量打包（tar -T -）前过滤文件列表: 列出之后被删除的文件不交给 tar，以该标记输出到 stderr
+VANISHED_MARKER = 'BACKMGR_VANISHED'
+VANISHED_FILTER = ('while IFS= read -r f; do if [ -e "$f" ] || [ -L "$f" ]; then printf \'%s\\n\' "$f"; '
+                   f'else printf \'{VANISHED_MARKER} %s\\n\' "$f" >&2; fi; done')
+
+# 带成员索引的压缩包: 按块独立压缩（多成员 gzip），索引记录块与成员的偏移
+ARCHIVE_INDEX_NAME = 'archive-index.json.gz'
+INDEX_BLOCK_SIZE = 1024 * 1024
+
+# 项目备份目录索引（位于 localPath 下，记录每个版本的统计信息）
+CATALOG_NAME = 'catalog.json'
+
+# 调度进程的本地控制套接字
+DAEMON_SOCKET = CONFIG_DIR / "daemon.sock"
+
+# 每次备份运行的结构化日志（LOG_DIR 下，每行一条 JSON）
+RUN_LOG_NAME = 'runs.jsonl'
+
+# S3 API 响应的 XML 命名空间
+S3_XMLNS = 'http://s3.amazonaws.com/doc/2006-03-01/'
+
+# 加密文件: 文件头（标识、密钥 ID、块大小、nonce 前缀）之后是逐块 AES-256-GCM 加密的数据，
+# 每块带 16 字节认证标签；密钥取自环境变量或密钥文件（默认 KEY_DIR/<项目名>.key）
+ENCRYPTION_MAGIC = b'BKMGENC1'
+ENCRYPTION_CHUNK_SIZE = 1024 * 1024
+ENCRYPTION_KEY_ENV = 'BACKMGR_ENCRYPTION_KEY'
+# 加密的去重数据块: 标识、12 字节随机 nonce，之后是 zlib 压缩数据的 AES-256-GCM 密文
+CHUNK_ENCRYPTION_MAGIC = b'BKMGCHK1'
+# 新项目和未设置 encryptSensitive 的项目默认加密
+DEFAULT_ENCRYPT_SENSITIVE = True
+KEY_DIR = CONFIG_DIR / "keys"
+
+# 远程文件索引代理（项目配置 remoteAgent）: 随 back-mgr 分发，按内容哈希部署到远程 ~/.cache/back-mgr，
+# 输出格式见 back-mgr-agent.py
+AGENT_SCRIPT = Path(__file__).resolve().with_name('back-mgr-agent.py')
+AGENT_MAGIC = b'BMGA'
+
+
+def copy_stream(src, dst, transform=None) -> int:
+    """按固定大小的块复制数据流，返回读取的字节数"""
+    total = 0
+    while True:
+        chunk = src.read(STREAM_CHUNK_SIZE)
+        if not chunk:
+            break
+        total += len(chunk)
+        dst.write(transform(chunk) if transform else chunk)
+    return total
+
+
+def compress_command(name: str, threads: int = 0) -> Optional[str]:
+    """生成压缩命令，threads 为 0 时使用全部核心"""
+    template = COMPRESSORS[name]['compress']
+    if not template:
+        return None
+    if name == 'zstd':
+        flag = f' -T{threads}'
+    elif name == 'pigz' and threads:
+        flag = f' -p {threads}'
+    else:
+        flag = ''
+    return template.format(threads=flag)
+
+
+def detect_compression(path: Path) -> str:
+    """根据扩展名判断压缩格式"""
+    for name, codec in COMPRESSORS.items():
+        if codec['ext'] and path.name.endswith(codec['ext']):
+            return name
+    return 'none'
+
+
+def match_path(rel: str, patterns: List[str]) -> bool:
+    """相对路径或它的任一上级目录匹配某个模式时返回 True（匹配目录即选中整个子树）"""
+    parts = rel.strip('/').split('/')
+    for i in range(1, len(parts) + 1):
+        prefix = '/'.join(parts[:i])
+        if any(fnmatch.fnmatchcase(prefix, pattern) for pattern in patterns):
+            return True
+    return False
+
+
+def is_excluded(path: str, exclude: List[str]) -> bool:
+    """按 tar --exclude 的语义判断文件是否被排除（匹配路径本身或任一上级目录）"""
+    parts = path.split('/')
+    candidates = ['/'.join(parts[:i]) for i in range(1, len(parts) + 1)] + parts
+    for pattern in exclude:
+        tar_pattern = pattern.replace("/**", "").rstrip("/")
+        if any(fnmatch.fnmatch(c, tar_pattern) for c in candidates):
+            return True
+    return False
+
+
+def parse_size(text: str) -> int:
+    """解析 500M / 20G / 1T 形式的大小"""
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    text = text.strip().upper().rstrip('B')
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def glob_escape(path: str) -> str:
+    """转义路径中的通配符，使其只匹配自身"""
+    return ''.join(f'[{c}]' if c in '*?[' else c for c in path)
+
+
+def scan_backup_dir(path: Path) -> Dict:
+    """统计备份版本目录: 总大小、文件数和独占字节数
+
+    独占字节数只计算所有硬链接都位于该目录内的 inode，
+    与其他版本共享（rsync --link-dest）的文件不计入。
+    """
+    total = files = unique = 0
+    links: Dict[Tuple[int, int], List[int]] = {}
+    stack = [str(path)]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                        continue
+                    if not entry.is_file(follow_symlinks=False):
+                        continue
+                    st = entry.stat(follow_symlinks=False)
+                    total += st.st_size
+                    files += 1
+                    seen = links.setdefault((st.st_dev, st.st_ino), [0, st.st_nlink, st.st_size])
+                    seen[0] += 1
+        except OSError:
+            continue
+    for count, nlink, size in links.values():
+        if count >= nlink:
+            unique += size
+    return {'size': total, 'files': files, 'uniqueBytes': unique}
+
+
+def version_time(backup_dir: Path, timestamp: Optional[str] = None) -> float:
+    """版本时间: 优先使用清单或索引中的时间，其次是目录名（YYYY-mm-dd_HHMMSS），最后是目录 mtime"""
+    for value, fmt in ((timestamp, None), (backup_dir.name, "%Y-%m-%d_%H%M%S")):
+        if not value:
+            continue
+        try:
+            if fmt:
+                return datetime.datetime.strptime(value, fmt).timestamp()
+            return datetime.datetime.fromisoformat(value).timestamp()
+        except ValueError:
+            continue
+    return backup_dir.stat().st_mtime
+
+
+def versions_by_time(backup_base: Path) -> List[Tuple[Path, Optional[Dict]]]:
+    """列出版本目录及其清单（缺失或无法解析时为 None），按清单时间从新到旧排序"""
+    if not backup_base.exists():
+        return []
+    versions = []
+    for backup_dir in backup_base.iterdir():
+        if not backup_dir.is_dir():
+            continue
+        try:
+            with open(backup_dir / 'manifest.json', 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = None
+        versions.append((version_time(backup_dir, (manifest or {}).get('timestamp')), backup_dir, manifest))
+    versions.sort(key=lambda v: v[0], reverse=True)
+    return [(backup_dir, manifest) for _, backup_dir, manifest in versions]
+
+
+class HashingWriter:
+    """写入时同时计算 SHA-256（target 为 None 时只计算哈希）"""
+
+    def __init__(self, target=None, digest=None):
+        self.target = target
+        self.digest = digest or hashlib.sha256()
+
+    def write(self, data: bytes):
+        self.digest.update(data)
+        if self.target is not None:
+            self.target.write(data)
+
+    def hexdigest(self) -> str:
+        return self.digest.hexdigest()
+
+
+def file_sha256(path: Path) -> str:
+    """用 mmap 计算文件的 SHA-256（hashlib 在计算时释放 GIL，可多线程并行）"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                view = memoryview(data)
+                for offset in range(0, size, 64 * STREAM_CHUNK_SIZE):
+                    digest.update(view[offset:offset + 64 * STREAM_CHUNK_SIZE])
+                view.release()
+    return digest.hexdigest()
+
 
 class Colors:
     """终端颜色输出"""
@@ -29,21 +284,25 @@ class Colors:
     RESET = '\033[0m'
     BOLD = '\033[1m'
 
+    # 并发备份时避免多行输出互相穿插
+    _lock = threading.Lock()
+
     @staticmethod
     def _print(prefix: str, color: str, msg: str):
         """安全打印（处理 Windows 编码问题）"""
-        try:
-            print(f"{color}{prefix} {msg}{Colors.RESET}")
-        except UnicodeEncodeError:
-            # Windows 回退到 ASCII
-            prefix_alt = {
-                '✓': '[OK]',
-                '⚠': '[WARN]',
-                '✗': '[ERROR]',
-                'ℹ': '[INFO]',
-            }
-            safe_prefix = prefix_alt.get(prefix, prefix)
-            print(f"{color}{safe_prefix} {msg}{Colors.RESET}")
+        with Colors._lock:
+            try:
+                print(f"{color}{prefix} {msg}{Colors.RESET}")
+            except UnicodeEncodeError:
+                # Windows 回退到 ASCII
+                prefix_alt = {
+                    '✓': '[OK]',
+                    '⚠': '[WARN]',
+                    '✗': '[ERROR]',
+                    'ℹ': '[INFO]',
+                }
+                safe_prefix = prefix_alt.get(prefix, prefix)
+                print(f"{color}{safe_prefix} {msg}{Colors.RESET}")
 
     @staticmethod
     def success(msg):
@@ -55,11 +314,12 @@ class Colors:
 
     @staticmethod
     def error(msg):
-        try:
-            print(f"{Colors.RED}✗ {msg}{Colors.RESET}", file=sys.stderr)
-        except UnicodeEncodeError:
-            print(f"{Colors.RED}[ERROR] {msg}{Colors.RESET}", file=sys.stderr)
-        sys.stderr.flush()
+        with Colors._lock:
+            try:
+                print(f"{Colors.RED}✗ {msg}{Colors.RESET}", file=sys.stderr)
+            except UnicodeEncodeError:
+                print(f"{Colors.RED}[ERROR] {msg}{Colors.RESET}", file=sys.stderr)
+            sys.stderr.flush()
 
     @staticmethod
     def info(msg):
@@ -119,7 +379,7 @@ class ProjectConfig:
 
         project['exclude'] = project.get('exclude', [])
         project['databases'] = project.get('databases', [])
-        project['encryptSensitive'] = project.get('encryptSensitive', True)
+        project['encryptSensitive'] = project.get('encryptSensitive', DEFAULT_ENCRYPT_SENSITIVE)
 
         self.projects.append(project)
         self._save_projects()
@@ -137,6 +397,12 @@ class ProjectConfig:
         """列出所有项目"""
         return self.projects
 
+    def filter_projects(self, tags: List[str] = None) -> List[Dict]:
+        """按标签筛选项目（匹配任意一个标签即可）"""
+        if not tags:
+            return list(self.projects)
+        return [p for p in self.projects if set(tags) & set(p.get('tags', []))]
+
     def delete_project(self, name: str) -> bool:
         """删除项目"""
         project = self.get_project(name)
@@ -150,6 +416,1996 @@ class ProjectConfig:
         return True
 
 
+class SSHConnection:
+    """SSH 连接管理
+
+    一次备份/还原期间建立一个 ControlMaster 主连接，之后所有远程命令、
+    文件传输和数据库导出都复用该连接，每个主机只需一次握手。
+    """
+
+    def __init__(self, project: Dict, multiplex: Optional[bool] = None):
+        self.host = project['host']
+        self.user = project['user']
+        self.port = project.get('port', 22)
+        if multiplex is None:
+            multiplex = project.get('sshMultiplex', True)
+        # Windows 自带的 OpenSSH 不支持 ControlMaster
+        self.multiplex = multiplex and os.name != 'nt'
+        self.control_dir = None
+        self.control_path = None
+        self.connect_time = 0.0
+        self.calls = 0
+        # 绕过主连接的独立 TCP 连接数（并行分段传输）
+        self.dedicated = 0
+        self._commands = {}
+
+    @property
+    def target(self) -> str:
+        return f"{self.user}@{self.host}"
+
+    def _options(self) -> List[str]:
+        """复用主连接的 ssh/scp 选项"""
+        if self.control_path:
+            return ['-o', f'ControlPath={self.control_path}']
+        return []
+
+    def open(self):
+        """建立主连接（失败时回退为每次调用单独连接）"""
+        if not self.multiplex or self.control_path:
+            return
+
+        self.control_dir = tempfile.mkdtemp(prefix='back-mgr-ssh-')
+        control_path = os.path.join(self.control_dir, 'master')
+        cmd = ['ssh', '-p', str(self.port),
+               '-o', 'ControlMaster=yes',
+               '-o', f'ControlPath={control_path}',
+               '-o', 'ControlPersist=600',
+               '-N', '-f', self.target]
+
+        start = time.monotonic()
+        result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        self.connect_time = time.monotonic() - start
+
+        if result.returncode == 0:
+            self.control_path = control_path
+        else:
+            Colors.warning(f"SSH 连接复用不可用，回退为独立连接: {result.stderr.strip()}")
+            shutil.rmtree(self.control_dir, ignore_errors=True)
+            self.control_dir = None
+
+    def close(self):
+        """关闭主连接"""
+        if self.control_path:
+            subprocess.run(['ssh', '-p', str(self.port), *self._options(), '-O', 'exit', self.target],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            self.control_path = None
+        if self.control_dir:
+            shutil.rmtree(self.control_dir, ignore_errors=True)
+            self.control_dir = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def ssh_args(self, remote_cmd: str, dedicated: bool = False) -> List[str]:
+        """构建 ssh 命令参数列表
+
+        dedicated 时不复用主连接，单独建立 TCP 连接：复用的通道共享同一个 TCP 窗口，
+        高延迟链路上需要多个独立连接才能跑满带宽。
+        """
+        options = ['-o', 'ControlPath=none'] if dedicated else self._options()
+        return ['ssh', '-p', str(self.port), *options, self.target, remote_cmd]
+
+    def rsync_shell(self) -> str:
+        """rsync -e 使用的远程 shell"""
+        return shlex.join(['ssh', '-p', str(self.port), *self._options()])
+
+    def run(self, remote_cmd: str, stdin=None, stdout=None, timeout: Optional[int] = None,
+            text: bool = True) -> subprocess.CompletedProcess:
+        """执行远程命令；未指定 stdout 时捕获输出"""
+        self.calls += 1
+        return subprocess.run(self.ssh_args(remote_cmd), stdin=stdin,
+                              stdout=stdout if stdout is not None else subprocess.PIPE,
+                              stderr=subprocess.PIPE, timeout=timeout,
+                              text=text if stdout is None else False)
+
+    def popen(self, remote_cmd: str, stdin=None, stdout=None, stderr=None,
+              dedicated: bool = False) -> subprocess.Popen:
+        """以流的方式执行远程命令"""
+        self.calls += 1
+        if dedicated:
+            self.dedicated += 1
+        return subprocess.Popen(self.ssh_args(remote_cmd, dedicated), stdin=stdin, stdout=stdout, stderr=stderr)
+
+    def has_command(self, name: str) -> bool:
+        """检查远程主机上是否有某个命令（结果缓存）"""
+        if name not in self._commands:
+            self._commands[name] = self.run(f'command -v {name}').returncode == 0
+        return self._commands[name]
+
+    def list_files(self, remote_dir: str, exclude: List[str]) -> Optional[Dict[str, List]]:
+        """列出远程目录下的文件和符号链接: {相对路径: [大小, mtime, 哈希]}"""
+        cmd = f"cd {shlex.quote(remote_dir)} && find . \\( -type f -o -type l \\) -exec stat -c '%s %Y %n' {{}} +"
+        result = self.run(cmd)
+        if result.returncode != 0:
+            Colors.error(f"列出远程文件失败: {result.stderr.strip()}")
+            return None
+
+        files = {}
+        for line in result.stdout.splitlines():
+            parts = line.split(' ', 2)
+            if len(parts) != 3 or not parts[2].startswith('./'):
+                continue
+            path = parts[2][2:]
+            if not is_excluded(path, exclude):
+                files[path] = [int(parts[0]), int(parts[1]), None]
+        return files
+
+    def list_dirs(self, remote_dir: str, exclude: List[str]) -> Optional[set]:
+        """列出远程目录下的子目录（相对路径）"""
+        result = self.run(f"cd {shlex.quote(remote_dir)} && find . -mindepth 1 -type d")
+        if result.returncode != 0:
+            Colors.error(f"列出远程目录失败: {result.stderr.strip()}")
+            return None
+        return {line[2:] for line in result.stdout.splitlines()
+                if line.startswith('./') and not is_excluded(line[2:], exclude)}
+
+    def hash_files(self, remote_dir: str, paths: List[str]) -> Optional[Dict[str, str]]:
+        """在远程计算文件的 SHA-256"""
+        with tempfile.TemporaryFile() as file_list:
+            file_list.write('\0'.join(paths).encode('utf-8'))
+            file_list.seek(0)
+            result = self.run(f'cd {shlex.quote(remote_dir)} && xargs -0 sha256sum', stdin=file_list)
+        if result.returncode != 0:
+            Colors.error(f"计算远程文件哈希失败: {result.stderr.strip()}")
+            return None
+
+        hashes = {}
+        for line in result.stdout.splitlines():
+            digest, _, path = line.partition('  ')
+            hashes[path] = digest
+        return hashes
+
+    def agent_changes(self, remote_dir: str, exclude: List[str], since: int = 0, state_id: str = '',
+                      hash_files: bool = False, full: bool = False, quick: bool = False,
+                      full_after: float = 0, python: str = 'python3') -> Optional[Dict]:
+        """通过远程文件索引代理列出自 since 代以来的变化
+
+        代理脚本不存在时在同一次调用中上传（文件名含内容哈希，升级后自动重新部署）。
+        返回 {'full': 是否为完整清单, 'state': 索引 ID, 'generation': 代数, 'stats': 扫描统计,
+        'files': {相对路径: [大小, mtime, 哈希]}, 'deleted': [相对路径], 'dirs': {全部子目录}}；
+        失败时返回 None。
+        """
+        try:
+            script = AGENT_SCRIPT.read_bytes()
+        except OSError as e:
+            Colors.warning(f"找不到远程索引代理脚本: {e}")
+            return None
+        name = f"agent-{hashlib.sha256(script).hexdigest()[:12]}.py"
+        args = ['changes', f'--root={remote_dir}', f'--since={since}', f'--state-id={state_id}',
+                f'--full-after={full_after}']
+        args += [f'--exclude={pattern}' for pattern in exclude]
+        if hash_files:
+            args.append('--hash')
+        if full:
+            args.append('--full')
+        if quick:
+            args.append('--quick')
+        cmd = (f'd="$HOME/.cache/back-mgr"; f="$d/{name}"; '
+               f'[ -f "$f" ] || {{ mkdir -p "$d" && cat > "$f.$$" && mv "$f.$$" "$f"; }} && '
+               f'{shlex.quote(python)} "$f" {shlex.join(args)}')
+        with tempfile.TemporaryFile() as upload:
+            upload.write(script)
+            upload.seek(0)
+            result = self.run(cmd, stdin=upload, text=False)
+        if result.returncode != 0:
+            Colors.warning(f"远程索引代理失败: {result.stderr.decode('utf-8', errors='replace').strip()}")
+            return None
+
+        try:
+            return self.parse_agent_output(result.stdout)
+        except ValueError as e:
+            Colors.warning(f"无法解析远程索引代理的输出: {e}")
+            return None
+
+    @staticmethod
+    def parse_agent_output(output: bytes) -> Dict:
+        """解析索引代理的输出（zlib 压缩的二进制记录，格式见 back-mgr-agent.py），格式错误时抛出 ValueError"""
+        try:
+            data = zlib.decompress(output)
+            if data[:4] != AGENT_MAGIC:
+                raise ValueError("输出格式不正确")
+            flags = data[5]
+            state = data[6:22].hex()
+            generation, stats_len = struct.unpack_from('>QI', data, 22)
+            pos = 34 + stats_len
+            stats = json.loads(data[34:pos])
+            files, deleted, dirs = {}, [], set()
+            while pos < len(data):
+                kind = data[pos:pos + 1]
+                (length,) = struct.unpack_from('>I', data, pos + 1)
+                path = data[pos + 5:pos + 5 + length].decode('utf-8', 'surrogateescape')
+                pos += 5 + length
+                if kind == b'+':
+                    size, mtime, hash_len = struct.unpack_from('>QqB', data, pos)
+                    pos += 17
+                    files[path] = [size, mtime, data[pos:pos + hash_len].hex() or None]
+                    pos += hash_len
+                elif kind == b'-':
+                    deleted.append(path)
+                elif kind == b'/':
+                    dirs.add(path)
+                else:
+                    raise ValueError(f"未知记录类型 {kind!r}")
+        except (zlib.error, struct.error, IndexError) as e:
+            raise ValueError(str(e)) from e
+        return {'full': bool(flags & 1), 'state': state, 'generation': generation, 'stats': stats,
+                'files': files, 'deleted': deleted, 'dirs': dirs, 'bytes': len(output)}
+
+    def summary(self) -> str:
+        """连接统计（用于对比复用前后的握手开销）"""
+        extra = f"，其中 {self.dedicated} 次为独立传输连接" if self.dedicated else ""
+        if self.control_path or self.connect_time:
+            return f"SSH: {self.calls} 次远程调用复用 1 个连接（握手 {self.connect_time:.2f}s）{extra}"
+        return f"SSH: {self.calls} 次远程调用，每次独立握手"
+
+
+class ChannelProcess:
+    """paramiko 通道上的远程命令，提供与 subprocess.Popen 相同的接口
+
+    stdin/stdout 为 PIPE 时返回真实的管道文件（可直接交给本地解压进程），
+    由后台线程在管道与通道之间搬运数据；也可以传入文件对象，
+    None 和 DEVNULL 的输出被丢弃。
+    """
+
+    def __init__(self, channel, command: str, stdin=None, stdout=None, stderr=None, client=None):
+        self.channel = channel
+        self.args = command
+        # 独立传输连接（dedicated），命令结束时关闭
+        self.client = client
+        self.returncode = None
+        self.stdin = self.stdout = self.stderr = None
+        self._readers = []
+
+        channel.exec_command(command)
+
+        if stdin == subprocess.PIPE:
+            read_fd, write_fd = os.pipe()
+            self.stdin = os.fdopen(write_fd, 'wb')
+            self._start(self._send, os.fdopen(read_fd, 'rb'), True)
+        elif stdin is not None and stdin != subprocess.DEVNULL:
+            self._start(self._send, stdin, False)
+        else:
+            channel.shutdown_write()
+
+        for recv, target, name in ((channel.recv, stdout, 'stdout'), (channel.recv_stderr, stderr, 'stderr')):
+            close = target == subprocess.PIPE
+            if close:
+                read_fd, write_fd = os.pipe()
+                setattr(self, name, os.fdopen(read_fd, 'rb'))
+                target = os.fdopen(write_fd, 'wb')
+            elif target is None or target == subprocess.DEVNULL:
+                target = None
+            self._readers.append(self._start(self._receive, recv, target, close))
+
+    @staticmethod
+    def _start(func, *args) -> threading.Thread:
+        thread = threading.Thread(target=func, args=args, daemon=True)
+        thread.start()
+        return thread
+
+    def _send(self, source, close: bool):
+        """把 source 的数据写入通道，读完后发送 EOF"""
+        try:
+            while True:
+                data = source.read(STREAM_CHUNK_SIZE)
+                if not data:
+                    break
+                self.channel.sendall(data)
+            self.channel.shutdown_write()
+        except (OSError, EOFError):
+            # 远程命令已退出；关闭管道让写入方得到 BrokenPipeError
+            pass
+        finally:
+            if close:
+                source.close()
+
+    def _receive(self, recv, target, close: bool):
+        """把通道的 stdout/stderr 写入 target，读取方提前关闭管道时关闭通道（相当于 SIGPIPE）"""
+        try:
+            while True:
+                data = recv(STREAM_CHUNK_SIZE)
+                if not data:
+                    break
+                if target is not None:
+                    target.write(data)
+        except BrokenPipeError:
+            self.channel.close()
+        except (OSError, EOFError):
+            pass
+        finally:
+            if close:
+                try:
+                    target.close()
+                except BrokenPipeError:
+                    pass
+
+    def poll(self) -> Optional[int]:
+        if self.returncode is None and (self.channel.exit_status_ready() or self.channel.closed):
+            return self.wait()
+        return self.returncode
+
+    def wait(self, timeout: Optional[float] = None) -> int:
+        """等待远程命令结束；没有退出状态（连接断开或被 kill）时返回 255，与 ssh 一致"""
+        if self.returncode is not None:
+            return self.returncode
+        if not self.channel.status_event.wait(timeout) and not self.channel.closed:
+            raise subprocess.TimeoutExpired(self.args, timeout)
+        status = self.channel.exit_status if self.channel.exit_status_ready() else -1
+        for reader in self._readers:
+            reader.join()
+        self.channel.close()
+        if self.client:
+            self.client.close()
+        self.returncode = status if status >= 0 else 255
+        return self.returncode
+
+    def kill(self):
+        self.channel.close()
+
+    terminate = kill
+
+
+class ParamikoConnection(SSHConnection):
+    """进程内 SSH 连接（可选依赖 paramiko）
+
+    所有远程命令在同一个 SSH 传输上各开一个通道执行，不再为每一步启动本地 ssh 进程；
+    端口和用户取项目配置（与 ssh 命令的 -p 和 user@host 一致），HostName、IdentityFile、
+    ProxyCommand 和 ProxyJump 按 ~/.ssh/config 解析，主机密钥必须已在 known_hosts 中。
+    连接失败时回退为 ssh 命令；rsync 仍然通过 ssh 命令传输。
+    """
+
+    # 单个通道的接收窗口，流式传输时减少等待窗口调整的往返
+    WINDOW_SIZE = 16 * 1024 * 1024
+
+    def __init__(self, project: Dict):
+        super().__init__(project)
+        self.client = None
+
+    def _connect(self) -> 'paramiko.SSHClient':
+        options = {}
+        config_file = Path.home() / '.ssh' / 'config'
+        if config_file.exists():
+            options = paramiko.SSHConfig.from_path(str(config_file)).lookup(self.host)
+
+        hostname = options.get('hostname', self.host)
+        sock = None
+        if options.get('proxycommand', 'none').lower() != 'none':
+            sock = paramiko.ProxyCommand(options['proxycommand'])
+        elif options.get('proxyjump', 'none').lower() != 'none':
+            # 多级跳板 a,b: 经 a 连接 b，再由 b 转发到目标
+            hops = options['proxyjump'].split(',')
+            jump = ['-J', ','.join(hops[:-1])] if len(hops) > 1 else []
+            sock = paramiko.ProxyCommand(shlex.join(['ssh', *jump, '-W', f'{hostname}:{self.port}', hops[-1]]))
+
+        client = paramiko.SSHClient()
+        client.load_system_host_keys()
+        client.connect(hostname, port=self.port, username=self.user,
+                       key_filename=options.get('identityfile'), sock=sock, timeout=30)
+        client.get_transport().set_keepalive(30)
+        return client
+
+    def open(self):
+        """建立 SSH 传输（失败时回退为 ssh 命令）"""
+        if self.client or self.control_path:
+            return
+        start = time.monotonic()
+        try:
+            self.client = self._connect()
+        except (paramiko.SSHException, OSError) as e:
+            Colors.warning(f"paramiko 连接失败，回退为 ssh 命令: {e}")
+            super().open()
+            return
+        self.connect_time = time.monotonic() - start
+
+    def close(self):
+        if self.client:
+            self.client.close()
+            self.client = None
+        super().close()
+
+    def run(self, remote_cmd: str, stdin=None, stdout=None, timeout: Optional[int] = None,
+            text: bool = True) -> subprocess.CompletedProcess:
+        """执行远程命令；未指定 stdout 时捕获输出"""
+        if not self.client:
+            return super().run(remote_cmd, stdin, stdout, timeout, text)
+        out = io.BytesIO() if stdout is None else stdout
+        err = io.BytesIO()
+        proc = self.popen(remote_cmd, stdin=stdin, stdout=out, stderr=err)
+        try:
+            returncode = proc.wait(timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            raise
+
+        def decode(data: bytes):
+            return data.decode('utf-8', errors='replace') if text and stdout is None else data
+
+        return subprocess.CompletedProcess(remote_cmd, returncode,
+                                           decode(out.getvalue()) if stdout is None else None,
+                                           decode(err.getvalue()))
+
+    def popen(self, remote_cmd: str, stdin=None, stdout=None, stderr=None,
+              dedicated: bool = False):
+        """在新通道上执行远程命令；dedicated 时单独建立一条 SSH 传输"""
+        if not self.client:
+            return super().popen(remote_cmd, stdin, stdout, stderr, dedicated)
+        self.calls += 1
+        client = None
+        transport = self.client.get_transport()
+        if dedicated:
+            self.dedicated += 1
+            client = self._connect()
+            transport = client.get_transport()
+        channel = transport.open_session(window_size=self.WINDOW_SIZE)
+        return ChannelProcess(channel, remote_cmd, stdin, stdout, stderr, client)
+
+    def summary(self) -> str:
+        if not self.client:
+            return super().summary()
+        extra = f"，其中 {self.dedicated} 次为独立传输连接" if self.dedicated else ""
+        return f"SSH (paramiko): {self.calls} 次远程调用复用 1 个连接（握手 {self.connect_time:.2f}s）{extra}"
+
+
+def create_connection(project: Dict) -> SSHConnection:
+    """按项目配置 sshTransport 创建连接: subprocess（默认，ssh 命令）或 paramiko（进程内）"""
+    if project.get('sshTransport', 'subprocess') == 'paramiko':
+        if paramiko is not None:
+            return ParamikoConnection(project)
+        Colors.warning("未安装 paramiko（pip install paramiko），使用 ssh 命令")
+    return SSHConnection(project)
+
+
+class BackupCatalog:
+    """项目备份目录索引
+
+    每个版本的大小、文件数、独占字节数在备份完成时计算一次并写入
+    <localPath>/catalog.json，列出版本时只读取索引，不再遍历备份文件。
+    """
+
+    def __init__(self, local_path: Path):
+        self.path = local_path / CATALOG_NAME
+
+    def load(self) -> Dict[str, Dict]:
+        """读取索引，文件不存在或损坏时返回空索引"""
+        if not self.path.exists():
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f).get('versions', {})
+        except (OSError, ValueError):
+            return {}
+
+    def update(self, name: str, entry: Dict):
+        """添加或更新一个版本"""
+        versions = self.load()
+        versions[name] = entry
+        self.save(versions)
+
+    def save(self, versions: Dict[str, Dict]):
+        """原子写入索引（先写临时文件再替换）"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'versions': versions}, f, indent=2, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+
+class RunLog:
+    """备份运行日志: LOG_DIR/runs.jsonl，每次备份追加一行（各阶段耗时、字节数、吞吐量）"""
+
+    def __init__(self, path: Optional[Path] = None):
+        self.path = path or LOG_DIR / RUN_LOG_NAME
+
+    def append(self, record: Dict):
+        """追加一条记录（单次 write，多个进程同时追加不会交错）"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(line)
+
+    def read(self, project: Optional[str] = None, last: Optional[int] = None) -> List[Dict]:
+        """读取记录（跳过损坏的行），可按项目筛选并只取最近 last 条"""
+        if not self.path.exists():
+            return []
+        records = []
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if project is None or record.get('project') == project:
+                    records.append(record)
+        return records[-last:] if last else records
+
+    @staticmethod
+    def phase_trends(records: List[Dict]) -> List[Dict]:
+        """按阶段汇总: 次数、耗时与吞吐量的中位数和最近一次（只统计成功的阶段）"""
+        phases: Dict[str, List[Dict]] = {}
+        for record in records:
+            for phase in record.get('phases', []):
+                if phase.get('success'):
+                    phases.setdefault(phase['name'], []).append(phase)
+        trends = []
+        for name, items in phases.items():
+            durations = sorted(p['duration'] for p in items)
+            rates = sorted(p['mbps'] for p in items if p.get('bytes'))
+            trends.append({
+                'name': name,
+                'runs': len(items),
+                'medianDuration': durations[len(durations) // 2],
+                'lastDuration': items[-1]['duration'],
+                'medianMbps': rates[len(rates) // 2] if rates else None,
+                'lastMbps': items[-1]['mbps'] if items[-1].get('bytes') else None,
+            })
+        # 文件阶段在前，其次是数据库、清单和清理
+        order = {'files': 0, 'database': 1, 'manifest': 2, 'prune': 3}
+        return sorted(trends, key=lambda t: (order.get(t['name'].split(':')[0], 4), t['name']))
+
+
+class MetricsExporter:
+    """把运行日志汇总为 Prometheus 文本格式的指标
+
+    写入文件时先写同目录的临时文件再原子替换，node_exporter 的 textfile collector
+    不会读到写了一半的文件；调度进程也可以通过 HTTP 提供同样的内容。
+    各项目的汇总保存在内存中，每次生成指标时只读取运行日志中新追加的行
+    （调度进程长期运行时，抓取的开销不随日志变长而增加）。
+    """
+
+    METRICS = [
+        ('backmgr_last_run_timestamp_seconds', 'gauge', '最近一次备份结束的时间'),
+        ('backmgr_last_success_timestamp_seconds', 'gauge', '最近一次成功备份结束的时间'),
+        ('backmgr_last_run_success', 'gauge', '最近一次备份是否成功'),
+        ('backmgr_last_run_duration_seconds', 'gauge', '最近一次备份的总耗时'),
+        ('backmgr_last_run_bytes', 'gauge', '最近一次备份写入的字节数'),
+        ('backmgr_last_run_compression_ratio', 'gauge', '最近一次备份的压缩率（未压缩字节数/写入字节数）'),
+        ('backmgr_runs_total', 'counter', '运行日志中的备份次数'),
+        ('backmgr_failures_total', 'counter', '运行日志中失败的备份次数'),
+        ('backmgr_phase_duration_seconds', 'gauge', '最近一次备份中各阶段的耗时'),
+        ('backmgr_phase_bytes', 'gauge', '最近一次备份中各阶段写入的字节数'),
+        ('backmgr_phase_success', 'gauge', '最近一次备份中各阶段是否成功'),
+        ('backmgr_phase_failures_total', 'counter', '运行日志中各阶段失败的次数'),
+        ('backmgr_daemon_running', 'gauge', '调度进程中该项目是否正在备份（含排队）'),
+        ('backmgr_daemon_skipped_total', 'counter', '调度进程因上一次未结束而跳过的触发次数'),
+    ]
+
+    def __init__(self, run_log: Optional[RunLog] = None):
+        self.run_log = run_log or RunLog()
+        # {项目: {'last', 'lastSuccess', 'runs', 'failures', 'phaseFailures': {阶段: 次数}}}
+        self.projects: Dict[str, Dict] = {}
+        # 已读取到的位置 (日志文件 inode, 字节偏移)
+        self._position: Optional[Tuple[int, int]] = None
+
+    def refresh(self):
+        """读取运行日志中新追加的记录并更新各项目的汇总；日志被替换（轮转）或截断时重新读取"""
+        try:
+            st = self.run_log.path.stat()
+        except FileNotFoundError:
+            self.projects, self._position = {}, None
+            return
+        inode, offset = self._position or (st.st_ino, 0)
+        if inode != st.st_ino or st.st_size < offset:
+            self.projects, offset = {}, 0
+        with open(self.run_log.path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                # 最后一行可能正在写入，下次再读
+                if not line.endswith(b'\n'):
+                    break
+                offset += len(line)
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(record, dict) and 'project' in record:
+                    self._add(record)
+        self._position = (st.st_ino, offset)
+
+    def _add(self, record: Dict):
+        summary = self.projects.setdefault(record['project'], {
+            'last': None, 'lastSuccess': None, 'runs': 0, 'failures': 0, 'phaseFailures': {}})
+        summary['last'] = record
+        summary['runs'] += 1
+        if record['success']:
+            summary['lastSuccess'] = record
+        else:
+            summary['failures'] += 1
+        for phase in record.get('phases', []):
+            failures = summary['phaseFailures']
+            failures[phase['name']] = failures.get(phase['name'], 0) + (0 if phase.get('success') else 1)
+
+    def render(self, daemon_state: Optional[Dict[str, Dict]] = None) -> str:
+        """生成指标文本；daemon_state 为调度进程的项目状态"""
+        self.refresh()
+        samples: Dict[str, List[str]] = {name: [] for name, _, _ in self.METRICS}
+
+        def add(metric: str, labels: Dict[str, str], value):
+            label_text = ','.join(f'{k}="{self._escape(v)}"' for k, v in labels.items())
+            samples[metric].append(f'{metric}{{{label_text}}} {value}')
+
+        for project, summary in sorted(self.projects.items()):
+            record = summary['last']
+            labels = {'project': project}
+            add('backmgr_last_run_timestamp_seconds', labels, self._time(record))
+            add('backmgr_last_run_success', labels, int(record['success']))
+            add('backmgr_last_run_duration_seconds', labels, record['duration'])
+            add('backmgr_last_run_bytes', labels, record['bytes'])
+            raw = sum(p.get('rawBytes', 0) for p in record.get('phases', []))
+            written = sum(p['bytes'] for p in record.get('phases', []) if 'rawBytes' in p)
+            if raw and written:
+                add('backmgr_last_run_compression_ratio', labels, round(raw / written, 3))
+            add('backmgr_runs_total', labels, summary['runs'])
+            add('backmgr_failures_total', labels, summary['failures'])
+            if summary['lastSuccess']:
+                add('backmgr_last_success_timestamp_seconds', labels, self._time(summary['lastSuccess']))
+            for phase in record.get('phases', []):
+                phase_labels = {'project': project, 'phase': phase['name']}
+                add('backmgr_phase_duration_seconds', phase_labels, phase['duration'])
+                add('backmgr_phase_bytes', phase_labels, phase['bytes'])
+                add('backmgr_phase_success', phase_labels, int(bool(phase.get('success'))))
+        for project, summary in sorted(self.projects.items()):
+            for phase, count in sorted(summary['phaseFailures'].items()):
+                add('backmgr_phase_failures_total', {'project': project, 'phase': phase}, count)
+        for project, state in sorted((daemon_state or {}).items()):
+            add('backmgr_daemon_running', {'project': project}, int(state['state'] != 'idle'))
+            add('backmgr_daemon_skipped_total', {'project': project}, state['skipped'])
+
+        lines = []
+        for name, kind, help_text in self.METRICS:
+            if samples[name]:
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}'] + samples[name]
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path: Path, daemon_state: Optional[Dict[str, Dict]] = None):
+        """原子写入指标文件"""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f'.{path.name}.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(self.render(daemon_state))
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    @staticmethod
+    def _time(record: Dict) -> float:
+        if 'time' in record:
+            return record['time']
+        return datetime.datetime.fromisoformat(record['timestamp']).timestamp()
+
+    @staticmethod
+    def _escape(value: str) -> str:
+        return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class IndexedArchiveWriter:
+    """写入带成员索引的 tar.gz
+
+    tar 数据按 INDEX_BLOCK_SIZE 切块，每块压缩为独立的 gzip 成员（多线程），
+    文件仍是标准的 .tar.gz；同时解析 tar 头记录每个成员的偏移，
+    读取单个文件时只需解压它所在的块。写入过程中同时计算整个文件和
+    每个普通文件成员的 SHA-256，不额外读取数据。
+    """
+
+    def __init__(self, path: Path, workers: int = 0, level: int = 6, output=None):
+        self.path = path
+        self.level = level
+        self.workers = workers or os.cpu_count() or 1
+        # output: 已打开的输出（例如同时上传到对象存储的 StorageTee），默认直接写 path
+        self.file = output or open(path, 'wb')
+        self.pool = ThreadPoolExecutor(max_workers=self.workers)
+        self.pending = []
+        self.block = bytearray()
+        self.raw_offset = 0
+        self.comp_offset = 0
+        self.blocks: List[List[int]] = []
+        self.digest = hashlib.sha256()
+        self.received = 0
+        # 正在计算哈希的成员: [成员记录, 数据起点, 数据终点, 哈希对象]
+        self.hashing: List[List] = []
+        # tar 头解析状态
+        self.members: List[List] = []
+        self.buf = bytearray()
+        self.buf_start = 0
+        self.next_header = 0
+        self.member_start = None
+        self.long_name = None
+        self.pax = {}
+        self.done = False
+        self.valid = True
+
+    def write(self, data: bytes):
+        """写入 tar 数据"""
+        base = self.received
+        self.received += len(data)
+        self._parse(data)
+        self._hash_members(data, base)
+        self.block += data
+        while len(self.block) >= INDEX_BLOCK_SIZE:
+            self._submit(bytes(self.block[:INDEX_BLOCK_SIZE]))
+            del self.block[:INDEX_BLOCK_SIZE]
+
+    def close(self) -> Optional[Dict]:
+        """写完剩余数据，返回索引；tar 头无法解析时返回 None"""
+        if self.block:
+            self._submit(bytes(self.block))
+            self.block.clear()
+        self._drain(0)
+        self.pool.shutdown()
+        self.file.close()
+        if not self.valid:
+            return None
+        return {
+            'version': 2,
+            'archive': self.path.name,
+            'blockSize': INDEX_BLOCK_SIZE,
+            'size': self.raw_offset,
+            'blocks': self.blocks,
+            'members': self.members,
+        }
+
+    def abort(self):
+        """丢弃未完成的压缩包"""
+        for _, future in self.pending:
+            future.cancel()
+        self.pool.shutdown()
+        getattr(self.file, 'abort', self.file.close)()
+        if self.path.exists():
+            self.path.unlink()
+
+    def _submit(self, data: bytes):
+        """提交一个块压缩，按提交顺序写入文件，限制在途块数"""
+        self.pending.append((len(data), self.pool.submit(gzip.compress, data, self.level, mtime=0)))
+        self._drain(self.workers * 2)
+
+    def _drain(self, keep: int):
+        while len(self.pending) > keep:
+            raw_len, future = self.pending.pop(0)
+            compressed = future.result()
+            self.file.write(compressed)
+            self.digest.update(compressed)
+            self.blocks.append([self.raw_offset, self.comp_offset, len(compressed)])
+            self.raw_offset += raw_len
+            self.comp_offset += len(compressed)
+
+    def _parse(self, data: bytes):
+        """增量解析 tar 头，只缓存当前头（及长文件名、长链接目标和 PAX 数据）需要的字节"""
+        if self.done or not self.valid:
+            return
+        self.buf += data
+        while True:
+            skip = self.next_header - self.buf_start
+            if skip >= len(self.buf):
+                self.buf_start += len(self.buf)
+                self.buf.clear()
+                return
+            if skip > 0:
+                del self.buf[:skip]
+                self.buf_start = self.next_header
+            if len(self.buf) < tarfile.BLOCKSIZE:
+                return
+
+            header = bytes(self.buf[:tarfile.BLOCKSIZE])
+            if header == tarfile.NUL * tarfile.BLOCKSIZE:
+                self.done = True
+                self.buf.clear()
+                return
+            try:
+                info = tarfile.TarInfo.frombuf(header, 'utf-8', 'surrogateescape')
+            except tarfile.HeaderError:
+                self.valid = False
+                self.buf.clear()
+                return
+
+            padded = -(-info.size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+            if info.type in (tarfile.GNUTYPE_LONGNAME, tarfile.GNUTYPE_LONGLINK, tarfile.XHDTYPE, tarfile.XGLTYPE):
+                if len(self.buf) < tarfile.BLOCKSIZE + info.size:
+                    return
+                payload = bytes(self.buf[tarfile.BLOCKSIZE:tarfile.BLOCKSIZE + info.size])
+                if self.member_start is None and info.type != tarfile.XGLTYPE:
+                    self.member_start = self.next_header
+                if info.type == tarfile.GNUTYPE_LONGNAME:
+                    self.long_name = payload.rstrip(tarfile.NUL).decode('utf-8', 'surrogateescape')
+                # 长链接目标（GNU 'K'）只需保留在成员范围内，读取成员时由 tarfile 解析
+                elif info.type == tarfile.XHDTYPE:
+                    self.pax.update(self._parse_pax(payload))
+                self.next_header += tarfile.BLOCKSIZE + padded
+                continue
+
+            name = self.pax.get('path') or self.long_name or info.name
+            size = int(self.pax['size']) if 'size' in self.pax else info.size
+            start = self.member_start if self.member_start is not None else self.next_header
+            data_offset = self.next_header + tarfile.BLOCKSIZE
+            mtime = int(float(self.pax['mtime'])) if 'mtime' in self.pax else info.mtime
+            member = [name.rstrip('/'), info.type.decode('ascii', 'replace'), start, data_offset, size, None, mtime]
+            self.members.append(member)
+            if info.type in tarfile.REGULAR_TYPES:
+                if size:
+                    self.hashing.append([member, data_offset, data_offset + size, hashlib.sha256()])
+                else:
+                    member[5] = hashlib.sha256().hexdigest()
+            self.next_header = data_offset + -(-size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+            self.member_start = None
+            self.long_name = None
+            self.pax = {}
+
+    def _hash_members(self, data: bytes, base: int):
+        """把本次数据中落在成员数据区的部分送入对应成员的哈希"""
+        end = base + len(data)
+        for entry in list(self.hashing):
+            member, start, stop, digest = entry
+            lo, hi = max(start, base), min(stop, end)
+            if lo < hi:
+                digest.update(data[lo - base:hi - base])
+            if hi == stop:
+                member[5] = digest.hexdigest()
+                self.hashing.remove(entry)
+
+    @staticmethod
+    def _parse_pax(payload: bytes) -> Dict[str, str]:
+        """解析 PAX 扩展头记录（"长度 键=值\\n"）"""
+        fields = {}
+        pos = 0
+        while pos < len(payload):
+            space = payload.find(b' ', pos)
+            if space < 0:
+                break
+            length = int(payload[pos:space])
+            key, _, value = payload[space + 1:pos + length - 1].partition(b'=')
+            fields[key.decode('utf-8', 'replace')] = value.decode('utf-8', 'surrogateescape')
+            pos += length
+        return fields
+
+
+class IndexedArchive:
+    """按索引读取带成员索引的 tar.gz，只解压需要的块"""
+
+    def __init__(self, path: Path, index: Dict, opener=None):
+        self.path = path
+        self.index = index
+        # 打开压缩包的函数（还原时传入，加密的压缩包返回 DecryptingReader）
+        self.opener = opener or (lambda p: open(p, 'rb'))
+        self.starts = [block[0] for block in index['blocks']]
+        self._cache = (None, b'')
+
+    @classmethod
+    def open(cls, files_dir: Path, opener=None) -> Optional['IndexedArchive']:
+        """版本目录中有成员索引时打开，否则返回 None"""
+        index_file = files_dir / ARCHIVE_INDEX_NAME
+        if not index_file.exists():
+            return None
+        with gzip.open(index_file, 'rt', encoding='utf-8') as f:
+            index = json.load(f)
+        return cls(files_dir / index['archive'], index, opener)
+
+    def select(self, patterns: List[str], root: str, names: Optional[set] = None) -> List[List]:
+        """选出相对 root 的路径匹配模式的成员；names 不为 None 时只选出这些相对路径"""
+        prefix = f'{root}/'
+        if names is not None:
+            return [m for m in self.index['members']
+                    if m[0].startswith(prefix) and m[0][len(prefix):] in names]
+        return [m for m in self.index['members']
+                if m[0].startswith(prefix) and match_path(m[0][len(prefix):], patterns)]
+
+    def read(self, start: int, end: int, out):
+        """把 tar 数据中 [start, end) 的字节写入 out"""
+        with self.opener(self.path) as f:
+            i = bisect.bisect_right(self.starts, start) - 1
+            while start < end:
+                raw_start = self.starts[i]
+                data = self._block(f, i)
+                piece = data[start - raw_start:end - raw_start]
+                out.write(piece)
+                start += len(piece)
+                i += 1
+
+    def write_members(self, members: List[List], out):
+        """把选中成员的原始 tar 头和数据写成一个独立的 tar 流"""
+        ranges = []
+        for _, _, start, data_offset, size, *_ in members:
+            end = data_offset + -(-size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+            if ranges and ranges[-1][1] == start:
+                ranges[-1][1] = end
+            else:
+                ranges.append([start, end])
+        for start, end in ranges:
+            self.read(start, end, out)
+        out.write(tarfile.NUL * tarfile.BLOCKSIZE * 2)
+
+    def _block(self, f, i: int) -> bytes:
+        if self._cache[0] != i:
+            _, comp_offset, comp_len = self.index['blocks'][i]
+            f.seek(comp_offset)
+            self._cache = (i, gzip.decompress(f.read(comp_len)))
+        return self._cache[1]
+
+
+def encryption_key_id(key: bytes) -> bytes:
+    """密钥 ID（写入加密文件头，用于在解密前发现密钥不匹配）"""
+    return hashlib.sha256(b'back-mgr key id' + key).digest()[:8]
+
+
+def load_encryption_key(project: Dict, create: bool = False) -> bytes:
+    """读取项目的加密密钥（32 字节）
+
+    优先使用环境变量 BACKMGR_ENCRYPTION_KEY，其次是项目配置 encryptionKeyFile
+    或默认的 KEY_DIR/<项目名>.key，内容为 64 位十六进制或 base64。
+    create 为 True 且密钥文件不存在时生成新密钥（权限 600）。找不到或格式错误时抛出 IOError。
+    """
+    text = os.getenv(ENCRYPTION_KEY_ENV)
+    source = f'环境变量 {ENCRYPTION_KEY_ENV}'
+    if not text:
+        key_file = Path(project.get('encryptionKeyFile') or KEY_DIR / f"{project['name']}.key").expanduser()
+        source = str(key_file)
+        if not key_file.exists():
+            if not create:
+                raise IOError(f"找不到加密密钥: 设置环境变量 {ENCRYPTION_KEY_ENV} 或密钥文件 {key_file}")
+            key_file.parent.mkdir(parents=True, exist_ok=True)
+            with os.fdopen(os.open(key_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), 'w') as f:
+                f.write(os.urandom(32).hex() + '\n')
+            Colors.warning(f"已生成加密密钥 {key_file}，请另行妥善保存，丢失后无法还原加密的备份")
+        text = key_file.read_text()
+    text = text.strip()
+    try:
+        key = bytes.fromhex(text) if len(text) == 64 else base64.b64decode(text, validate=True)
+    except ValueError:
+        key = b''
+    if len(key) != 32:
+        raise IOError(f"加密密钥格式错误（需要 32 字节的十六进制或 base64）: {source}")
+    return key
+
+
+def is_encrypted(path: Path) -> bool:
+    """按文件头判断是否为加密文件（path 也可以是对象存储中的 StoredObject）"""
+    try:
+        if isinstance(path, StoredObject):
+            return path.pread(len(ENCRYPTION_MAGIC), 0) == ENCRYPTION_MAGIC
+        with open(path, 'rb') as f:
+            return f.read(len(ENCRYPTION_MAGIC)) == ENCRYPTION_MAGIC
+    except OSError:
+        return False
+
+
+class EncryptingWriter:
+    """分块认证加密的写入端: 按块在线程池中并行加密，按顺序写入 target
+
+    每块的 nonce 为文件的随机前缀加块序号，附加认证数据包含文件头、块序号和结束标记，
+    块被调换、截断或替换时解密失败。关闭时总是写出一个（可能为空的）结束块。
+    """
+
+    HEADER_SIZE = len(ENCRYPTION_MAGIC) + 8 + 4 + 8
+    TAG_SIZE = 16
+
+    def __init__(self, target, key: bytes, threads: int = 0):
+        self.target = target
+        self.aead = AESGCM(key)
+        self.header = (ENCRYPTION_MAGIC + encryption_key_id(key)
+                       + ENCRYPTION_CHUNK_SIZE.to_bytes(4, 'big') + os.urandom(8))
+        self.workers = threads or os.cpu_count() or 1
+        self.pool = ThreadPoolExecutor(max_workers=self.workers)
+        self.pending = []
+        self.buf = bytearray()
+        self.count = 0
+        self.target.write(self.header)
+
+    @staticmethod
+    def chunk_params(header: bytes, index: int, final: bool) -> Tuple[bytes, bytes]:
+        """第 index 块的 (nonce, 附加认证数据)"""
+        return header[-8:] + index.to_bytes(4, 'big'), header + index.to_bytes(8, 'big') + bytes([final])
+
+    def write(self, data: bytes):
+        self.buf += data
+        if len(self.buf) < ENCRYPTION_CHUNK_SIZE:
+            return
+        offset = 0
+        while len(self.buf) - offset >= ENCRYPTION_CHUNK_SIZE:
+            self._submit(bytes(self.buf[offset:offset + ENCRYPTION_CHUNK_SIZE]), False)
+            offset += ENCRYPTION_CHUNK_SIZE
+        del self.buf[:offset]
+
+    def _submit(self, data: bytes, final: bool):
+        """提交一个块加密，限制在途块数"""
+        nonce, aad = self.chunk_params(self.header, self.count, final)
+        self.pending.append(self.pool.submit(self.aead.encrypt, nonce, data, aad))
+        self.count += 1
+        self._drain(self.workers * 2)
+
+    def _drain(self, keep: int):
+        while len(self.pending) > keep:
+            self.target.write(self.pending.pop(0).result())
+
+    def close(self):
+        """写出剩余数据和结束块，然后关闭 target"""
+        self._submit(bytes(self.buf), True)
+        self.buf.clear()
+        self._drain(0)
+        self.pool.shutdown()
+        self.target.close()
+
+    def abort(self):
+        """丢弃在途块并中止 target（StorageTee 会同时中止上传）"""
+        for future in self.pending:
+            future.cancel()
+        self.pending.clear()
+        self.pool.shutdown()
+        getattr(self.target, 'abort', self.target.close)()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type:
+            self.abort()
+        else:
+            self.close()
+
+
+class DecryptingReader:
+    """加密文件的读取端: 按块解密并校验认证标签，支持 seek
+
+    顺序读取时在线程池中提前并行解密后续的块（os.pread 读取，互不影响文件位置）；
+    path 为 StoredObject 时按范围读取对象存储中的对象。
+    文件被篡改、截断或密钥不匹配时抛出 IOError。
+    """
+
+    def __init__(self, path: Path, key: bytes, threads: int = 0):
+        self.path = path
+        self.fd = None
+        if isinstance(path, StoredObject):
+            self.header = path.pread(EncryptingWriter.HEADER_SIZE, 0)
+            size = path.size
+            threads = threads or path.storage.threads
+        else:
+            with open(path, 'rb') as f:
+                self.header = f.read(EncryptingWriter.HEADER_SIZE)
+                size = os.fstat(f.fileno()).st_size
+        if len(self.header) < EncryptingWriter.HEADER_SIZE or not self.header.startswith(ENCRYPTION_MAGIC):
+            raise IOError(f"{path.name}: 不是加密文件")
+        if self.header[8:16] != encryption_key_id(key):
+            raise IOError(f"{path.name}: 密钥与加密时使用的不一致")
+
+        self.aead = AESGCM(key)
+        self.chunk_size = int.from_bytes(self.header[16:20], 'big')
+        stride = self.chunk_size + EncryptingWriter.TAG_SIZE
+        body = size - EncryptingWriter.HEADER_SIZE
+        self.chunks = body // stride + 1
+        if body % stride < EncryptingWriter.TAG_SIZE:
+            raise IOError(f"{path.name}: 加密文件不完整")
+        self.size = body - self.chunks * EncryptingWriter.TAG_SIZE
+        self.pos = 0
+        self.workers = threads or os.cpu_count() or 1
+        self.pool = ThreadPoolExecutor(max_workers=self.workers)
+        self.prefetch = {}
+        self._cache = (-1, b'')
+        if not isinstance(path, StoredObject):
+            self.fd = os.open(path, os.O_RDONLY)
+
+    def _decrypt(self, index: int) -> bytes:
+        stride = self.chunk_size + EncryptingWriter.TAG_SIZE
+        offset = EncryptingWriter.HEADER_SIZE + index * stride
+        data = self.path.pread(stride, offset) if self.fd is None else os.pread(self.fd, stride, offset)
+        nonce, aad = EncryptingWriter.chunk_params(self.header, index, index == self.chunks - 1)
+        try:
+            return self.aead.decrypt(nonce, data, aad)
+        except InvalidTag:
+            raise IOError(f"{self.path.name}: 第 {index} 块认证失败（文件损坏、被截断或被篡改）")
+
+    def _chunk(self, index: int) -> bytes:
+        if self._cache[0] == index:
+            return self._cache[1]
+        sequential = self._cache[0] == index - 1
+        future = self.prefetch.pop(index, None)
+        if not sequential:
+            for stale in self.prefetch.values():
+                stale.cancel()
+            self.prefetch.clear()
+        data = future.result() if future else self._decrypt(index)
+        if sequential:
+            for i in range(index + 1, min(index + 1 + self.workers * 2, self.chunks)):
+                if i not in self.prefetch:
+                    self.prefetch[i] = self.pool.submit(self._decrypt, i)
+        self._cache = (index, data)
+        return data
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = self.size - self.pos
+        parts = []
+        while size > 0 and self.pos < self.size:
+            index, offset = divmod(self.pos, self.chunk_size)
+            piece = self._chunk(index)[offset:offset + size]
+            if not piece:
+                break
+            parts.append(piece)
+            self.pos += len(piece)
+            size -= len(piece)
+        if self.pos >= self.size:
+            # 读到末尾时确认结束块，发现在块边界处被截断的文件
+            self._chunk(self.chunks - 1)
+        return b''.join(parts)
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        base = {0: 0, 1: self.pos, 2: self.size}[whence]
+        self.pos = max(base + offset, 0)
+        return self.pos
+
+    def tell(self) -> int:
+        return self.pos
+
+    def close(self):
+        if self.pool is None:
+            return
+        for future in self.prefetch.values():
+            future.cancel()
+        self.pool.shutdown()
+        self.pool = None
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class RangeTransfer:
+    """分段、可续传、带校验的远程文件下载
+
+    文件按固定大小分段（dd 读取）写入 <本地文件>.part，每完成一段就把段号和
+    SHA-256 追加到检查点文件 <本地文件>.part.ckpt。失败的段按指数退避重试，
+    再次下载同一远程文件（大小和 mtime 不变）时跳过检查点中已校验的段；
+    全部完成后与远程 sha256sum 比较整个文件，不一致时逐段比对并重新下载。
+
+    streams 大于 1 时，待下载的段分成 streams 组，每组通过一个独立的 SSH 连接
+    连续读取，各组并行写入 .part 的不同位置。
+    """
+
+    def __init__(self, ssh: 'SSHConnection', remote: str, local: Path,
+                 range_mb: int = 8, retries: int = 5, streams: int = 1):
+        self.ssh = ssh
+        self.streams = max(1, streams)
+        self.remote = remote
+        self.local = local
+        self.range_blocks = max(1, range_mb)
+        self.range_size = self.range_blocks * STREAM_CHUNK_SIZE
+        self.retries = retries
+        self.part = local.with_name(local.name + '.part')
+        self.checkpoint = local.with_name(local.name + '.part.ckpt')
+        self.size = 0
+        self.count = 0
+        # 整体校验通过后的 SHA-256
+        self.digest = None
+        self.lock = threading.Lock()
+
+    def download(self) -> bool:
+        """下载远程文件，成功后把 .part 改名为目标文件并删除检查点"""
+        result = self.ssh.run(f"stat -c '%s %Y' -- {shlex.quote(self.remote)}")
+        if result.returncode != 0:
+            Colors.error(f"读取远程文件信息失败: {result.stderr.strip()}")
+            return False
+        self.size, mtime = (int(v) for v in result.stdout.split())
+        self.count = max(1, -(-self.size // self.range_size))
+
+        done = self._load_checkpoint(mtime)
+        if done:
+            Colors.info(f"从检查点续传: 已完成 {len(done)}/{self.count} 段")
+        with open(self.part, 'r+b' if self.part.exists() else 'wb') as f:
+            f.truncate(self.size)
+        if not self._fetch_ranges([i for i in range(self.count) if i not in done]):
+            return False
+
+        if not self._verify():
+            return False
+        os.replace(self.part, self.local)
+        self.checkpoint.unlink()
+        return True
+
+    def discard(self):
+        """删除未完成的 .part 和检查点"""
+        for path in (self.part, self.checkpoint):
+            if path.exists():
+                path.unlink()
+
+    def _fetch_ranges(self, ranges: List[int]) -> bool:
+        """下载各段：按 streams 分成连续的组并行下载"""
+        if not ranges:
+            return True
+        groups = [ranges[i * len(ranges) // self.streams:(i + 1) * len(ranges) // self.streams]
+                  for i in range(self.streams)]
+        groups = [group for group in groups if group]
+        if len(groups) == 1:
+            return self._fetch_group(groups[0])
+        with ThreadPoolExecutor(max_workers=len(groups)) as pool:
+            return all(pool.map(self._fetch_group, groups))
+
+    def _load_checkpoint(self, mtime: int) -> Dict[int, str]:
+        """读取检查点，并重新校验本地已写入的段（远程文件变化时丢弃检查点）"""
+        header = {'remote': self.remote, 'size': self.size, 'mtime': mtime, 'rangeSize': self.range_size}
+        done = {}
+        if self.checkpoint.exists() and self.part.exists():
+            with open(self.checkpoint, 'r', encoding='utf-8') as f:
+                lines = f.read().splitlines()
+            if lines and json.loads(lines[0]) == header:
+                for line in lines[1:]:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if self._local_hash(entry['range']) == entry['sha256']:
+                        done[entry['range']] = entry['sha256']
+
+        with open(self.checkpoint, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(header) + '\n')
+            for index, digest in done.items():
+                f.write(json.dumps({'range': index, 'sha256': digest}) + '\n')
+        return done
+
+    def _fetch_group(self, ranges: List[int]) -> bool:
+        """下载一组段：每次连续读取尽可能多的段，失败时从第一个未完成的段按指数退避重试"""
+        pending = list(ranges)
+        attempt = 0
+        while pending:
+            run = 1
+            while run < len(pending) and pending[run] == pending[0] + run:
+                run += 1
+            completed, error = self._fetch_run(pending[0], run)
+            pending = pending[completed:]
+            if error is None:
+                continue
+            if completed:
+                attempt = 0
+            if attempt >= self.retries:
+                Colors.error(f"第 {pending[0] + 1}/{self.count} 段下载失败，已重试 {self.retries} 次")
+                return False
+            delay = min(2 ** attempt, 30)
+            Colors.warning(f"第 {pending[0] + 1}/{self.count} 段下载失败（{error}），{delay}s 后重试")
+            time.sleep(delay)
+            attempt += 1
+        return True
+
+    def _fetch_run(self, first: int, count: int) -> Tuple[int, Optional[str]]:
+        """连续下载 count 个段并逐段写入检查点，返回 (完成的段数, 错误信息)"""
+        cmd = (f'dd {shlex.quote("if=" + self.remote)} bs={STREAM_CHUNK_SIZE} skip={first * self.range_blocks}'
+               f' count={count * self.range_blocks} 2>/dev/null')
+        completed = 0
+        try:
+            proc = self.ssh.popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                  dedicated=self.streams > 1)
+            with open(self.part, 'r+b') as f:
+                while completed < count:
+                    index = first + completed
+                    start = index * self.range_size
+                    expected = min(self.range_size, self.size - start)
+                    digest = hashlib.sha256()
+                    f.seek(start)
+                    received = 0
+                    while received < expected:
+                        chunk = proc.stdout.read(min(STREAM_CHUNK_SIZE, expected - received))
+                        if not chunk:
+                            break
+                        received += len(chunk)
+                        digest.update(chunk)
+                        f.write(chunk)
+                    if received != expected:
+                        break
+                    f.flush()
+                    self._record(index, digest.hexdigest())
+                    completed += 1
+            proc.stdout.close()
+            returncode = proc.wait()
+        except OSError as e:
+            return completed, str(e)
+
+        if completed < count:
+            return completed, f"连接中断（退出码 {returncode}）"
+        return completed, None
+
+    def _record(self, index: int, digest: str):
+        """把完成的段追加到检查点"""
+        with self.lock:
+            with open(self.checkpoint, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({'range': index, 'sha256': digest}) + '\n')
+
+    def _local_hash(self, index: int) -> str:
+        with open(self.part, 'rb') as f:
+            f.seek(index * self.range_size)
+            return hashlib.sha256(f.read(min(self.range_size, self.size - index * self.range_size))).hexdigest()
+
+    def _verify(self) -> bool:
+        """比较整个文件的 SHA-256，不一致时按段比对并重新下载不一致的段"""
+        if not self.ssh.has_command('sha256sum'):
+            Colors.warning("远程没有 sha256sum，跳过整体校验")
+            return True
+
+        for attempt in range(2):
+            # 从标准输入读取，输出中不含文件名（特殊字符的文件名会被 sha256sum 转义）
+            result = self.ssh.run(f'sha256sum < {shlex.quote(self.remote)}')
+            if result.returncode != 0:
+                Colors.error(f"远程校验失败: {result.stderr.strip()}")
+                return False
+            digest = hashlib.sha256()
+            with open(self.part, 'rb') as f:
+                copy_stream(f, HashingWriter(None, digest))
+            if result.stdout.split()[0] == digest.hexdigest():
+                self.digest = digest.hexdigest()
+                return True
+            if attempt:
+                break
+
+            Colors.warning("整体校验不一致，逐段比对...")
+            result = self.ssh.run(
+                f'i=0; while [ $i -lt {self.count} ]; do '
+                f'dd {shlex.quote("if=" + self.remote)} bs={STREAM_CHUNK_SIZE} skip=$((i * {self.range_blocks}))'
+                f' count={self.range_blocks} 2>/dev/null | sha256sum; i=$((i + 1)); done')
+            remote_hashes = [line.split()[0] for line in result.stdout.splitlines() if line.strip()]
+            bad = [i for i, h in enumerate(remote_hashes) if h != self._local_hash(i)]
+            if result.returncode != 0 or len(remote_hashes) != self.count or not self._fetch_ranges(bad):
+                break
+
+        Colors.error("下载的文件与远程文件校验不一致")
+        return False
+
+
+class ChunkStore:
+    """内容寻址的分块存储（去重仓库）
+
+    数据流按内容定义的边界切块，每块以 SHA-256 命名、zlib 压缩后存放在
+    <localPath>/chunks/ 下，已存在的块直接跳过。每个备份版本只保存块引用列表。
+
+    切块边界只在 512 字节对齐处判断：tar 流中文件的增删改只会让后续数据
+    整体平移 512 字节的整数倍，因此按 tar 块计算的窗口哈希与逐字节滚动哈希
+    同样能在变化之后重新对齐，而计算量只有后者的 1/512。
+
+    指定 key 时块以 HMAC-SHA256(key, 数据) 命名（不暴露明文哈希），压缩后以 AES-256-GCM
+    加密存放；读取时按文件头识别加密块，加密块需要 key。
+    """
+
+    BLOCK_SIZE = 512
+    MIN_SIZE = 256 * 1024
+    MAX_SIZE = 4 * 1024 * 1024
+    # 超过最小长度后，平均每 2^11 个 tar 块（1MB）出现一个边界
+    BOUNDARY_MASK = (1 << 11) - 1
+
+    def __init__(self, root: Path, key: Optional[bytes] = None):
+        self.root = root
+        self.key = key
+        self.aead = AESGCM(key) if key else None
+        # 本次写入的新块（同步到对象存储时上传）
+        self.new_chunks: List[str] = []
+
+    def _digest(self, data: bytes, keyed: bool) -> str:
+        if keyed:
+            return hmac.new(self.key, data, hashlib.sha256).hexdigest()
+        return hashlib.sha256(data).hexdigest()
+
+    def chunk_path(self, digest: str) -> Path:
+        return self.root / digest[:2] / digest
+
+    def _find_boundary(self, buf: bytearray) -> Optional[int]:
+        """在缓冲区中查找切块边界，数据不足时返回 None"""
+        if len(buf) < self.MIN_SIZE:
+            return None
+
+        view = memoryview(buf)
+        end = min(len(buf), self.MAX_SIZE)
+        try:
+            for pos in range(self.MIN_SIZE, end + 1, self.BLOCK_SIZE):
+                if zlib.crc32(view[pos - self.BLOCK_SIZE:pos]) & self.BOUNDARY_MASK == 0:
+                    return pos
+        finally:
+            view.release()
+
+        return self.MAX_SIZE if len(buf) >= self.MAX_SIZE else None
+
+    def _store(self, data: bytes, stats: Dict) -> str:
+        """保存一个块，已存在时跳过"""
+        digest = self._digest(data, self.aead is not None)
+        path = self.chunk_path(digest)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            compressed = zlib.compress(data, 3)
+            if self.aead:
+                nonce = os.urandom(12)
+                compressed = (CHUNK_ENCRYPTION_MAGIC + nonce
+                              + self.aead.encrypt(nonce, compressed, digest.encode('ascii')))
+            tmp = path.with_name(f"{digest}.tmp.{os.getpid()}.{threading.get_ident()}")
+            with open(tmp, 'wb') as f:
+                f.write(compressed)
+            os.replace(tmp, path)
+            self.new_chunks.append(digest)
+            stats['newChunks'] += 1
+            stats['newBytes'] += len(compressed)
+        stats['chunks'].append([digest, len(data)])
+        stats['size'] += len(data)
+        return digest
+
+    def ingest(self, stream) -> Dict:
+        """读取数据流并切块入库，返回块引用列表和统计信息"""
+        stats = {'chunks': [], 'size': 0, 'newChunks': 0, 'newBytes': 0}
+        buf = bytearray()
+        eof = False
+
+        while not eof or buf:
+            # 保证缓冲区至少有一个最大块的数据，除非已到流末尾
+            while not eof and len(buf) < self.MAX_SIZE:
+                data = stream.read(STREAM_CHUNK_SIZE)
+                if not data:
+                    eof = True
+                    break
+                buf += data
+
+            cut = self._find_boundary(buf)
+            if cut is None:
+                if not eof:
+                    continue
+                cut = len(buf)
+            self._store(bytes(buf[:cut]), stats)
+            del buf[:cut]
+
+        return stats
+
+    def write_to(self, chunks: List[List], out) -> int:
+        """按引用列表还原数据流并写入 out"""
+        total = 0
+        for digest, size in chunks:
+            out.write(self.read(digest, size))
+            total += size
+        return total
+
+    def read(self, digest: str, size: int) -> bytes:
+        """读取并校验一个数据块"""
+        with open(self.chunk_path(digest), 'rb') as f:
+            data = f.read()
+        encrypted = data.startswith(CHUNK_ENCRYPTION_MAGIC)
+        if encrypted:
+            if not self.aead:
+                raise IOError(f"数据块已加密，需要密钥: {digest}")
+            start = len(CHUNK_ENCRYPTION_MAGIC)
+            try:
+                data = self.aead.decrypt(data[start:start + 12], data[start + 12:], digest.encode('ascii'))
+            except InvalidTag:
+                raise IOError(f"数据块解密失败（密钥不匹配或数据被篡改）: {digest}")
+        data = zlib.decompress(data)
+        if len(data) != size or not hmac.compare_digest(self._digest(data, encrypted), digest):
+            raise IOError(f"数据块损坏: {digest}")
+        return data
+
+
+class LocalStorage:
+    """本地文件系统存储（例如挂载的 NAS），对象键即相对路径"""
+
+    def __init__(self, config: Dict):
+        self.root = Path(config['path']).expanduser()
+        self.threads = config.get('threads', 4)
+
+    def describe(self) -> str:
+        return str(self.root)
+
+    def _path(self, key: str) -> Path:
+        return self.root / key
+
+    def open_writer(self, key: str) -> 'LocalUpload':
+        return LocalUpload(self._path(key))
+
+    def put_file(self, key: str, path: Path) -> int:
+        with open(path, 'rb') as src, self.open_writer(key) as dst:
+            return copy_stream(src, dst)
+
+    def get_file(self, key: str, path: Path, size: Optional[int] = None) -> int:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self._path(key), 'rb') as src, open(path, 'wb') as dst:
+            return copy_stream(src, dst)
+
+    def read_bytes(self, key: str) -> Optional[bytes]:
+        try:
+            return self._path(key).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def read_range(self, key: str, offset: int, size: int) -> bytes:
+        with open(self._path(key), 'rb') as f:
+            data = os.pread(f.fileno(), size, offset)
+        if len(data) != size:
+            raise IOError(f"{key}: 范围 {offset}-{offset + size - 1} 长度不符")
+        return data
+
+    def list(self, prefix: str) -> Dict[str, int]:
+        """列出 prefix 下的所有对象: {键: 大小}"""
+        base = self._path(prefix)
+        if not base.is_dir():
+            return {}
+        return {p.relative_to(self.root).as_posix(): p.stat().st_size
+                for p in base.rglob('*') if p.is_file() and '.upload.' not in p.name}
+
+    def list_dirs(self, prefix: str) -> List[str]:
+        """列出 prefix 下一级的“目录”名"""
+        base = self._path(prefix)
+        return sorted(p.name for p in base.iterdir() if p.is_dir()) if base.is_dir() else []
+
+    def delete(self, key: str):
+        self._path(key).unlink(missing_ok=True)
+
+
+class LocalUpload:
+    """写入本地存储的临时文件，close() 时原子替换为目标文件"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.tmp = path.with_name(f"{path.name}.upload.{os.getpid()}.{threading.get_ident()}")
+        self.file = open(self.tmp, 'wb')
+
+    def write(self, data: bytes):
+        self.file.write(data)
+
+    def close(self):
+        self.file.close()
+        os.replace(self.tmp, self.path)
+
+    def abort(self):
+        self.file.close()
+        self.tmp.unlink(missing_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type:
+            self.abort()
+        else:
+            self.close()
+
+
+class S3Storage:
+    """S3 兼容对象存储（AWS S3、MinIO 等），只使用标准库: 请求以 SigV4 签名
+
+    大对象分段并行上传（MultipartUpload），下载时按分段并行读取范围；
+    每个线程复用自己的 HTTP 连接。凭据优先使用配置中的 accessKey/secretKey，
+    其次是环境变量 AWS_ACCESS_KEY_ID / AWS_SECRET_ACCESS_KEY / AWS_SESSION_TOKEN。
+    """
+
+    MIN_PART_SIZE = 5 * 1024 * 1024
+    RETRIES = 4
+
+    def __init__(self, config: Dict):
+        endpoint = urllib.parse.urlsplit(config.get('endpoint', 'https://s3.amazonaws.com'))
+        self.secure = endpoint.scheme == 'https'
+        self.bucket = config['bucket']
+        self.prefix = config.get('prefix', '').strip('/')
+        if self.prefix:
+            self.prefix += '/'
+        self.region = config.get('region', 'us-east-1')
+        self.access_key = config.get('accessKey') or os.environ.get('AWS_ACCESS_KEY_ID', '')
+        self.secret_key = config.get('secretKey') or os.environ.get('AWS_SECRET_ACCESS_KEY', '')
+        self.session_token = config.get('sessionToken') or os.environ.get('AWS_SESSION_TOKEN')
+        # path: endpoint/bucket/key（MinIO 等）；virtual: bucket.endpoint/key
+        if config.get('addressing', 'path') == 'virtual':
+            self.host = f"{self.bucket}.{endpoint.netloc}"
+            self.base_path = ''
+        else:
+            self.host = endpoint.netloc
+            self.base_path = f"/{self.bucket}"
+        self.part_size = max(self.MIN_PART_SIZE, int(config.get('partSizeMB', 16) * 1024 * 1024))
+        self.threads = config.get('threads', 4)
+        self.pool = ThreadPoolExecutor(max_workers=self.threads)
+        # 所有上传共享的在途分段数上限，内存占用不超过 2 x threads x partSize
+        self.slots = threading.BoundedSemaphore(self.threads * 2)
+        self._local = threading.local()
+
+    def describe(self) -> str:
+        return f"s3://{self.bucket}/{self.prefix}"
+
+    def _connection(self, fresh: bool = False):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or fresh:
+            if conn is not None:
+                conn.close()
+            cls = http.client.HTTPSConnection if self.secure else http.client.HTTPConnection
+            conn = self._local.conn = cls(self.host, timeout=120)
+        return conn
+
+    def _sign(self, method: str, path: str, query: Dict[str, str], headers: Dict[str, str],
+              payload_hash: str):
+        """按 AWS Signature Version 4 签名，结果写入 headers"""
+        now = datetime.datetime.now(datetime.timezone.utc)
+        amz_date = now.strftime('%Y%m%dT%H%M%SZ')
+        scope = f"{amz_date[:8]}/{self.region}/s3/aws4_request"
+        headers.update({'host': self.host, 'x-amz-date': amz_date, 'x-amz-content-sha256': payload_hash})
+        if self.session_token:
+            headers['x-amz-security-token'] = self.session_token
+
+        signed = sorted(headers)
+        canonical_query = '&'.join(f"{urllib.parse.quote(k, safe='-_.~')}={urllib.parse.quote(v, safe='-_.~')}"
+                                   for k, v in sorted(query.items()))
+        canonical_headers = ''.join(f"{k}:{' '.join(str(headers[k]).split())}\n" for k in signed)
+        canonical_request = '\n'.join([method, path, canonical_query, canonical_headers,
+                                       ';'.join(signed), payload_hash])
+        string_to_sign = '\n'.join(['AWS4-HMAC-SHA256', amz_date, scope,
+                                    hashlib.sha256(canonical_request.encode('utf-8')).hexdigest()])
+
+        key = ('AWS4' + self.secret_key).encode('utf-8')
+        for part in (amz_date[:8], self.region, 's3', 'aws4_request'):
+            key = hmac.new(key, part.encode('utf-8'), hashlib.sha256).digest()
+        signature = hmac.new(key, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+        headers['Authorization'] = (f"AWS4-HMAC-SHA256 Credential={self.access_key}/{scope}, "
+                                    f"SignedHeaders={';'.join(signed)}, Signature={signature}")
+
+    def _request(self, method: str, key: Optional[str] = None, query: Optional[Dict[str, str]] = None,
+                 body: bytes = b'', headers: Optional[Dict[str, str]] = None,
+                 ok: Tuple[int, ...] = (200,)) -> http.client.HTTPResponse:
+        """发送请求并返回未读取的响应；连接断开、5xx 和限流时退避重试"""
+        query = query or {}
+        path = self.base_path
+        if key is not None:
+            path += '/' + urllib.parse.quote(self.prefix + key, safe='/-_.~')
+        url = path or '/'
+        if query:
+            url += '?' + urllib.parse.urlencode(query, quote_via=urllib.parse.quote)
+        payload_hash = hashlib.sha256(body).hexdigest()
+
+        for attempt in range(self.RETRIES + 1):
+            request_headers = {k.lower(): v for k, v in (headers or {}).items()}
+            self._sign(method, path or '/', query, request_headers, payload_hash)
+            try:
+                conn = self._connection(fresh=attempt > 0)
+                conn.request(method, url, body=body, headers=request_headers)
+                resp = conn.getresponse()
+            except (OSError, http.client.HTTPException) as e:
+                if attempt == self.RETRIES:
+                    raise IOError(f"{method} {key or self.bucket}: {e}")
+                time.sleep(min(2 ** attempt, 10) * random.uniform(0.5, 1.0))
+                continue
+
+            if resp.status in ok:
+                return resp
+            data = resp.read()
+            if (resp.status >= 500 or resp.status == 429) and attempt < self.RETRIES:
+                time.sleep(min(2 ** attempt, 10) * random.uniform(0.5, 1.0))
+                continue
+            raise IOError(f"{method} {key or self.bucket}: HTTP {resp.status} {self._error_text(data)}")
+
+    @staticmethod
+    def _error_text(data: bytes) -> str:
+        try:
+            root = ElementTree.fromstring(data)
+        except ElementTree.ParseError:
+            return data[:200].decode('utf-8', errors='replace')
+        fields = {el.tag.split('}')[-1]: el.text for el in root}
+        return f"{fields.get('Code', '')} {fields.get('Message', '')}".strip()
+
+    @staticmethod
+    def _findall(root, tag: str):
+        return root.iter(f"{{{S3_XMLNS}}}{tag}") if root.tag.startswith('{') else root.iter(tag)
+
+    def open_writer(self, key: str) -> 'MultipartUpload':
+        return MultipartUpload(self, key)
+
+    def put_file(self, key: str, path: Path) -> int:
+        with open(path, 'rb') as src, self.open_writer(key) as dst:
+            return copy_stream(src, dst)
+
+    def get_file(self, key: str, path: Path, size: Optional[int] = None) -> int:
+        """下载对象到本地文件；大于一个分段时并行读取各个范围"""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if size is None or size <= self.part_size:
+            resp = self._request('GET', key)
+            with open(path, 'wb') as f:
+                return copy_stream(resp, f)
+
+        with open(path, 'wb') as f:
+            f.truncate(size)
+            fd = f.fileno()
+
+            def fetch(start: int):
+                end = min(start + self.part_size, size) - 1
+                resp = self._request('GET', key, headers={'Range': f'bytes={start}-{end}'}, ok=(206,))
+                data = resp.read()
+                if len(data) != end - start + 1:
+                    raise IOError(f"GET {key}: 范围 {start}-{end} 长度不符")
+                os.pwrite(fd, data, start)
+
+            with ThreadPoolExecutor(max_workers=self.threads) as pool:
+                for future in [pool.submit(fetch, start) for start in range(0, size, self.part_size)]:
+                    future.result()
+        return size
+
+    def read_bytes(self, key: str) -> Optional[bytes]:
+        resp = self._request('GET', key, ok=(200, 404))
+        data = resp.read()
+        return data if resp.status == 200 else None
+
+    def read_range(self, key: str, offset: int, size: int) -> bytes:
+        """读取对象的 [offset, offset + size) 范围"""
+        end = offset + size - 1
+        data = self._request('GET', key, headers={'Range': f'bytes={offset}-{end}'}, ok=(206,)).read()
+        if len(data) != size:
+            raise IOError(f"GET {key}: 范围 {offset}-{end} 长度不符")
+        return data
+
+    def _list(self, prefix: str, delimiter: Optional[str] = None):
+        """ListObjectsV2 分页遍历，逐页返回 XML 根节点"""
+        query = {'list-type': '2', 'prefix': self.prefix + prefix}
+        if delimiter:
+            query['delimiter'] = delimiter
+        while True:
+            root = ElementTree.fromstring(self._request('GET', query=query).read())
+            yield root
+            token = next((el.text for el in self._findall(root, 'NextContinuationToken')), None)
+            if not token:
+                break
+            query['continuation-token'] = token
+
+    def list(self, prefix: str) -> Dict[str, int]:
+        """列出 prefix 下的所有对象: {键: 大小}"""
+        objects = {}
+        for root in self._list(prefix):
+            for item in self._findall(root, 'Contents'):
+                fields = {el.tag.split('}')[-1]: el.text for el in item}
+                objects[fields['Key'][len(self.prefix):]] = int(fields['Size'])
+        return objects
+
+    def list_dirs(self, prefix: str) -> List[str]:
+        """列出 prefix 下一级的“目录”名"""
+        names = []
+        for root in self._list(prefix, delimiter='/'):
+            for item in self._findall(root, 'CommonPrefixes'):
+                for el in item:
+                    names.append(el.text[len(self.prefix + prefix):].rstrip('/'))
+        return sorted(names)
+
+    def delete(self, key: str):
+        self._request('DELETE', key, ok=(200, 204, 404)).read()
+
+
+class MultipartUpload:
+    """S3 分段上传: 写入的数据每满一个分段就提交到线程池并行上传，不等待整个文件写完
+
+    close() 等待所有分段并完成上传；数据不足一个分段时改为单次 PUT。
+    """
+
+    def __init__(self, storage: S3Storage, key: str):
+        self.storage = storage
+        self.key = key
+        self.upload_id = None
+        self.buf = bytearray()
+        self.futures = []
+        self.error = None
+
+    def write(self, data: bytes):
+        if self.error:
+            raise self.error
+        self.buf += data
+        while len(self.buf) >= self.storage.part_size:
+            self._submit(bytes(self.buf[:self.storage.part_size]))
+            del self.buf[:self.storage.part_size]
+
+    def _submit(self, data: bytes):
+        if self.upload_id is None:
+            root = ElementTree.fromstring(self.storage._request('POST', self.key, {'uploads': ''}).read())
+            self.upload_id = next(self.storage._findall(root, 'UploadId')).text
+        # 在途分段达到上限时等待，限制内存占用
+        self.storage.slots.acquire()
+        future = self.storage.pool.submit(self._upload_part, len(self.futures) + 1, data)
+        future.add_done_callback(self._part_done)
+        self.futures.append(future)
+
+    def _part_done(self, future):
+        self.storage.slots.release()
+        if not future.cancelled() and future.exception() and not self.error:
+            self.error = future.exception()
+
+    def _upload_part(self, number: int, data: bytes) -> str:
+        resp = self.storage._request('PUT', self.key, {'partNumber': str(number), 'uploadId': self.upload_id},
+                                     body=data)
+        resp.read()
+        return resp.getheader('ETag')
+
+    def close(self):
+        if self.upload_id is None:
+            self.storage._request('PUT', self.key, body=bytes(self.buf)).read()
+            return
+        if self.buf:
+            self._submit(bytes(self.buf))
+            self.buf.clear()
+        try:
+            etags = [future.result() for future in self.futures]
+        except Exception:
+            self.abort()
+            raise
+        parts = ''.join(f"<Part><PartNumber>{i}</PartNumber><ETag>{etag}</ETag></Part>"
+                        for i, etag in enumerate(etags, 1))
+        body = f"<CompleteMultipartUpload>{parts}</CompleteMultipartUpload>".encode('utf-8')
+        resp = self.storage._request('POST', self.key, {'uploadId': self.upload_id}, body=body)
+        data = resp.read()
+        # 完成请求可能返回 200 但正文是错误
+        if b'<Error>' in data:
+            raise IOError(f"完成分段上传失败 {self.key}: {S3Storage._error_text(data)}")
+
+    def abort(self):
+        for future in self.futures:
+            future.cancel()
+        if self.upload_id is not None:
+            try:
+                self.storage._request('DELETE', self.key, {'uploadId': self.upload_id}, ok=(200, 204, 404)).read()
+            except IOError:
+                pass
+            self.upload_id = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type:
+            self.abort()
+        else:
+            self.close()
+
+
+class StorageTee:
+    """本地输出文件 + 对象存储上传: 数据在写入本地的同时上传，不需要写完后再读一遍
+
+    上传出错时只停止上传、本地写入继续，备份结束时的同步会从本地文件重新上传。
+    """
+
+    def __init__(self, path: Path, storage, key: str, uploaded: set):
+        self.file = open(path, 'wb')
+        self.key = key
+        self.uploaded = uploaded
+        self.upload = storage.open_writer(key)
+
+    def write(self, data: bytes):
+        self.file.write(data)
+        if self.upload:
+            try:
+                self.upload.write(data)
+            except Exception as e:
+                self._drop(e)
+
+    def flush(self):
+        self.file.flush()
+
+    def _drop(self, error: Exception):
+        Colors.warning(f"上传 {self.key} 中断，备份结束后重新上传: {error}")
+        self.upload.abort()
+        self.upload = None
+
+    def close(self):
+        self.file.close()
+        if self.upload:
+            try:
+                self.upload.close()
+                self.uploaded.add(self.key)
+            except Exception as e:
+                self._drop(e)
+
+    def abort(self):
+        self.file.close()
+        if self.upload:
+            self.upload.abort()
+            self.upload = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type:
+            self.abort()
+        else:
+            self.close()
+
+
+class StoredObject:
+    """对象存储中的一个对象，从对象存储还原时代替版本目录中的本地文件（按范围读取，不落盘）
+
+    name / parent 与该文件下载到本地版本目录时的 Path 相同。
+    """
+
+    def __init__(self, storage, key: str, size: int, local: Path):
+        self.storage = storage
+        self.key = key
+        self.size = size
+        self.name = local.name
+        self.parent = local.parent
+
+    def pread(self, size: int, offset: int) -> bytes:
+        size = min(size, self.size - offset)
+        return self.storage.read_range(self.key, offset, size) if size > 0 else b''
+
+    def open(self) -> 'StoredObjectReader':
+        return StoredObjectReader(self)
+
+
+class StoredObjectReader:
+    """顺序读取 StoredObject: 在线程池中提前并行读取后续的范围（每段 partSizeMB）"""
+
+    def __init__(self, obj: StoredObject):
+        self.obj = obj
+        self.part_size = getattr(obj.storage, 'part_size', 8 * 1024 * 1024)
+        self.workers = obj.storage.threads
+        self.pool = ThreadPoolExecutor(max_workers=self.workers)
+        self.futures = []
+        self.next_offset = 0
+        self.buf = b''
+        self.pos = 0
+
+    def _fill(self):
+        while len(self.futures) < self.workers and self.next_offset < self.obj.size:
+            self.futures.append(self.pool.submit(self.obj.pread, self.part_size, self.next_offset))
+            self.next_offset += self.part_size
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = self.obj.size
+        parts = []
+        while size > 0:
+            if self.pos >= len(self.buf):
+                self._fill()
+                if not self.futures:
+                    break
+                self.buf, self.pos = self.futures.pop(0).result(), 0
+                continue
+            piece = self.buf[self.pos:self.pos + size]
+            parts.append(piece)
+            self.pos += len(piece)
+            size -= len(piece)
+        return b''.join(parts)
+
+    def readable(self) -> bool:
+        return True
+
+    def close(self):
+        for future in self.futures:
+            future.cancel()
+        self.futures.clear()
+        self.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def create_storage(project: Dict):
+    """按项目配置 storage 创建对象存储副本（未配置时返回 None）"""
+    config = project.get('storage')
+    if not config:
+        return None
+    kind = config.get('type', 's3')
+    if kind == 'local':
+        return LocalStorage(config)
+    if kind == 's3':
+        return S3Storage(config)
+    Colors.error(f"未知的存储类型: {kind}（可用: local、s3），不使用对象存储")
+    return None
+
+
 class BackupManager:
     """备份管理器"""
 
@@ -157,11 +2413,61 @@ class BackupManager:
         self.project = project
         self.local_path = Path(project['localPath']).expanduser()
         self.backup_base = self.local_path / "backups"
+        # 压缩包模式: stream（流式，默认）、staged（远程 /tmp 暂存后分段下载）
+        # 或 sharded（按顶层目录拆成多个 tar 并行打包传输）
+        self.archive_mode = project.get('archiveMode', 'stream')
+        self.shards = project.get('archiveShards', 4)
+        # 文件与各数据库阶段的并发数
+        self.workers = project.get('backupWorkers', 4)
+        # 仓库格式: archive（每个版本一个完整压缩包）或 dedup（分块去重存储）
+        self.repo_format = project.get('repoFormat', 'archive')
+        # 压缩包格式，实际使用的格式在备份开始时根据远程可用工具确定
+        self.codec = project.get('archiveCodec', 'gzip')
+        self.threads = project.get('archiveThreads', 0)
+        # 暂存模式下载压缩包的并行连接数
+        self.streams = project.get('transferStreams', 1)
+        self.ssh = create_connection(project)
+        # 远程 tar 是否为 GNU tar（第一次需要时检查）
+        self.gnu_tar: Optional[bool] = None
+        # 对象存储副本（项目配置 storage），流式写入的文件边接收边上传
+        self.storage = create_storage(project)
+        self.uploaded = set()
+        self.new_chunks: List[str] = []
+        # 压缩包和数据库导出在写入时加密（密钥在备份开始时加载）
+        self.encrypt = project.get('encryptSensitive', DEFAULT_ENCRYPT_SENSITIVE)
+        self.key: Optional[bytes] = None
+        # 文件阶段的结果描述，写入 manifest 的 files 字段
+        self.files_info = {}
+        # 文件阶段实际使用的排除规则（项目配置 + 命令行），差异还原时据此忽略远程文件
+        self.exclude: List[str] = []
+        # 接收数据时计算的 SHA-256 {版本内相对路径: 哈希}，各阶段并发写入
+        self.checksums: Dict[str, str] = {}
+        self._checksum_lock = threading.Lock()
+        # 各阶段的耗时、字节数和吞吐量，写入 manifest 和运行日志
+        self.phases: List[Dict] = []
+        self._phase_lock = threading.Lock()
+        self.run_start = time.monotonic()
 
     def create_backup(self, incremental: bool = False, db_only: bool = False,
                       files_only: bool = False, exclude: List[str] = None,
-                      dry_run: bool = False) -> bool:
-        """创建备份"""
+                      dry_run: bool = False, archive_mode: str = None,
+                      workers: int = None, streams: int = None, shards: int = None,
+                      prune: Optional[bool] = None, encrypt: Optional[bool] = None,
+                      multiplex: Optional[bool] = None) -> bool:
+        """创建备份（multiplex 为 False 时不复用 SSH 连接，None 取项目配置 sshMultiplex）"""
+        if encrypt is not None:
+            self.encrypt = encrypt
+        if multiplex is not None:
+            self.ssh.multiplex = multiplex and os.name != 'nt'
+        if archive_mode:
+            self.archive_mode = archive_mode
+        if shards:
+            self.shards = shards
+        if workers:
+            self.workers = workers
+        if streams:
+            self.streams = streams
+
         timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H%M%S")
         backup_path = self.backup_base / timestamp
 
@@ -173,27 +2479,248 @@ class BackupManager:
                 Colors.info(f"[模拟] 备份数据库: {', '.join([db['name'] for db in self.project['databases']])}")
             return True
 
+        if self.encrypt and not self._load_key():
+            return False
+
         # 创建备份目录
         backup_path.mkdir(parents=True, exist_ok=True)
+        self.run_start = time.monotonic()
+        self.phases = []
 
         Colors.header(f"开始备份 {self.project['name']}")
 
-        # 备份文件
+        # 文件和每个数据库互不依赖，作为独立阶段并发执行
+        stages = []
         if not db_only:
-            if not self._backup_files(backup_path, incremental, exclude):
-                return False
+            stages.append(('files', lambda: self._backup_files(backup_path, incremental, exclude)))
 
-        # 备份数据库
         if not files_only and self.project.get('databases'):
-            if not self._backup_databases(backup_path):
-                return False
+            db_dir = backup_path / "databases"
+            db_dir.mkdir(parents=True, exist_ok=True)
+            for db in self.project['databases']:
+                stages.append((f"database:{db['name']}",
+                               lambda db=db: self._backup_single_database(db, db_dir)))
+
+        with self.ssh:
+            results = self._run_stages(stages)
 
         # 创建备份清单
-        self._create_manifest(backup_path)
+        success = all(r['success'] for r in results)
+        self._create_manifest(backup_path, results)
+
+        if self.storage and not self._sync_storage(backup_path):
+            results.append({'name': 'storage', 'success': False})
+            success = False
+
+        Colors.info(self.ssh.summary())
+        if not success:
+            failed = ', '.join(r['name'] for r in results if not r['success'])
+            Colors.error(f"备份未完成，失败阶段: {failed}")
+            self._log_run(backup_path, success)
+            return False
 
         Colors.success(f"备份完成: {backup_path}")
+
+        # 备份成功后按保留策略清理旧版本
+        if prune if prune is not None else self.project.get('pruneAfterBackup', False):
+            with self._phase('prune') as timing:
+                timing['success'] = PruneManager(self.project).prune()
+        self._log_run(backup_path, success)
         return True
 
+    def _load_key(self) -> bool:
+        """加载项目的加密密钥，第一次加密备份时生成密钥文件"""
+        if AESGCM is None:
+            Colors.error("项目开启了加密（encryptSensitive），需要安装 cryptography: pip install cryptography；"
+                         "或使用 --no-encrypt 备份")
+            return False
+        try:
+            self.key = load_encryption_key(self.project, create=True)
+        except IOError as e:
+            Colors.error(str(e))
+            return False
+        return True
+
+    @contextlib.contextmanager
+    def _phase(self, name: str):
+        """计时一个阶段: with self._phase('files:transfer') as timing: ...
+
+        调用方成功时设置 timing['success'] = True，并可设置 bytes（写入/传输的字节数）
+        和 rawBytes（未压缩字节数，用于计算压缩率）；异常或未设置时记为失败。
+        """
+        timing = {'name': name, 'success': False, 'bytes': 0}
+        start = time.monotonic()
+        try:
+            yield timing
+        finally:
+            duration = time.monotonic() - start
+            timing['duration'] = round(duration, 3)
+            timing['mbps'] = round(timing['bytes'] / 1024 / 1024 / duration, 2) if timing['bytes'] and duration > 0 else 0.0
+            with self._phase_lock:
+                self.phases.append(timing)
+
+    def _log_run(self, backup_path: Path, success: bool):
+        """把本次运行追加到 LOG_DIR/runs.jsonl"""
+        record = {
+            'project': self.project['name'],
+            'host': self.project['host'],
+            'version': backup_path.name,
+            'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+            'time': round(time.time(), 3),
+            'success': success,
+            'duration': round(time.monotonic() - self.run_start, 3),
+            'format': self.files_info.get('format'),
+            'codec': self.files_info.get('codec'),
+            'bytes': sum(p['bytes'] for p in self.phases),
+            'phases': self.phases,
+        }
+        try:
+            RunLog().append(record)
+            metrics_file = os.environ.get('BACKMGR_METRICS_FILE')
+            if metrics_file:
+                MetricsExporter().write(Path(metrics_file).expanduser())
+        except OSError as e:
+            Colors.warning(f"写入运行日志或指标失败: {e}")
+
+    def _run_stages(self, stages: List[Tuple[str, callable]]) -> List[Dict]:
+        """并发执行备份阶段，返回每个阶段的结果和耗时"""
+        def run_stage(name, func):
+            start = time.monotonic()
+            try:
+                ok = func()
+            except Exception as e:
+                Colors.error(f"阶段 {name} 异常: {e}")
+                ok = False
+            return {'name': name, 'success': bool(ok), 'duration': round(time.monotonic() - start, 3)}
+
+        if len(stages) <= 1 or self.workers <= 1:
+            return [run_stage(name, func) for name, func in stages]
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = [pool.submit(run_stage, name, func) for name, func in stages]
+            return [f.result() for f in futures]
+
+    def benchmark_codecs(self, sample_mb: int = 64) -> List[Dict]:
+        """在项目目录的样本上测试远程主机各压缩格式的速度和压缩率"""
+        stamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        sample = f'/tmp/back-mgr-sample-{stamp}.tar'
+        results = []
+
+        with self.ssh:
+            tar_cmd = self._build_tar_command('-', self.project.get('exclude', []), compress=False)
+            result = self.ssh.run(f'({tar_cmd}) 2>/dev/null | head -c {sample_mb * 1024 * 1024} > {sample}'
+                                  f' && wc -c < {sample}')
+            if result.returncode != 0 or not result.stdout.strip():
+                Colors.error(f"创建样本失败: {result.stderr.strip()}")
+                return results
+            raw_size = int(result.stdout.strip())
+            Colors.info(f"样本大小: {self._format_size(raw_size)}")
+
+            try:
+                # 读取样本本身的耗时（含 SSH 往返），从各格式的耗时中扣除
+                start = time.monotonic()
+                self.ssh.run(f'cat {sample} | wc -c')
+                baseline = time.monotonic() - start
+
+                for name in COMPRESSORS:
+                    if name == 'none' or not self.ssh.has_command(name):
+                        continue
+                    start = time.monotonic()
+                    # wc 的退出码会掩盖压缩程序的失败，失败时输出标记
+                    result = self.ssh.run(f'{{ {compress_command(name, self.threads)} < {sample} '
+                                          f'|| echo {PIPE_FAILED_MARKER} >&2; }} | wc -c')
+                    elapsed = max(time.monotonic() - start - baseline, 1e-3)
+                    if result.returncode != 0 or PIPE_FAILED_MARKER in result.stderr:
+                        Colors.warning(f"{name} 压缩失败，跳过: "
+                                       f"{result.stderr.replace(PIPE_FAILED_MARKER, '').strip()}")
+                        continue
+                    size = int(result.stdout.strip())
+                    results.append({
+                        'codec': name,
+                        'size': size,
+                        'ratio': raw_size / size if size else 0.0,
+                        'speed': raw_size / elapsed / 1024 / 1024,
+                    })
+            finally:
+                self.ssh.run(f'rm -f {sample}')
+
+        return results
+
+    def benchmark_transfer(self, size_mb: int = 256, streams: List[int] = None) -> List[Dict]:
+        """在远程生成随机测试文件，测试不同并行连接数下的分段下载吞吐量"""
+        stamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        sample = f'/tmp/back-mgr-transfer-{stamp}.bin'
+        results = []
+
+        with self.ssh:
+            result = self.ssh.run(f'head -c {size_mb * 1024 * 1024} /dev/urandom > {sample}')
+            if result.returncode != 0:
+                Colors.error(f"创建测试文件失败: {result.stderr.strip()}")
+                return results
+
+            try:
+                with tempfile.TemporaryDirectory(prefix='back-mgr-transfer-') as tmp:
+                    for n in streams or [1, 2, 4, 8]:
+                        local = Path(tmp) / f'sample-{n}.bin'
+                        transfer = RangeTransfer(self.ssh, sample, local,
+                                                 self.project.get('transferRangeMB', 8),
+                                                 self.project.get('transferRetries', 5), n)
+                        start = time.monotonic()
+                        ok = transfer.download()
+                        elapsed = max(time.monotonic() - start, 1e-3)
+                        if not ok:
+                            transfer.discard()
+                            continue
+                        results.append({'streams': n, 'seconds': elapsed,
+                                        'speed': size_mb / elapsed})
+                        local.unlink()
+            finally:
+                self.ssh.run(f'rm -f {sample}')
+
+        return results
+
+    def benchmark_encryption(self, size_mb: int = 256, threads: List[int] = None) -> Optional[Dict]:
+        """测试本机分块加密和解密的吞吐量，并与 localPath 所在磁盘的写入速度（含 fsync）比较
+
+        使用随机临时密钥和随机数据（与压缩后的数据一样不可再压缩），不读取项目密钥。
+        """
+        if AESGCM is None:
+            Colors.error("需要安装 cryptography: pip install cryptography")
+            return None
+        key = os.urandom(32)
+        block = os.urandom(STREAM_CHUNK_SIZE)
+        results = []
+        self.local_path.mkdir(parents=True, exist_ok=True)
+
+        with tempfile.TemporaryDirectory(prefix='.back-mgr-encrypt-', dir=self.local_path) as tmp:
+            sample = Path(tmp) / 'sample.bin'
+            start = time.monotonic()
+            with open(sample, 'wb') as f:
+                for _ in range(size_mb):
+                    f.write(block)
+                f.flush()
+                os.fsync(f.fileno())
+            disk = size_mb / max(time.monotonic() - start, 1e-3)
+
+            with EncryptingWriter(open(sample, 'wb'), key) as writer:
+                for _ in range(size_mb):
+                    writer.write(block)
+
+            for n in threads or sorted({1, 2, 4, os.cpu_count() or 1}):
+                start = time.monotonic()
+                with EncryptingWriter(open(os.devnull, 'wb'), key, n) as writer:
+                    for _ in range(size_mb):
+                        writer.write(block)
+                encrypt = size_mb / max(time.monotonic() - start, 1e-3)
+
+                start = time.monotonic()
+                with DecryptingReader(sample, key, n) as reader, open(os.devnull, 'wb') as sink:
+                    copy_stream(reader, sink)
+                decrypt = size_mb / max(time.monotonic() - start, 1e-3)
+                results.append({'threads': n, 'encrypt': encrypt, 'decrypt': decrypt})
+
+        return {'disk': disk, 'results': results}
+
     def _get_remote_full_path(self) -> str:
         """获取远程完整路径"""
         port = self.project.get('port', 22)
@@ -210,11 +2737,27 @@ class BackupManager:
         backup_dir.mkdir(parents=True, exist_ok=True)
 
         # 构建排除列表
-        exclude_list = self.project.get('exclude', [])
+        exclude_list = list(self.project.get('exclude', []))
         if exclude:
             exclude_list.extend(exclude)
-
-        if incremental and self._is_command_available('rsync'):
+        self.exclude = exclude_list
+
+        use_tar_incremental = self.project.get('incrementalMode') == 'tar' \
+            or not self._is_command_available('rsync')
+        self.codec = self._resolve_codec(self.project.get('archiveCodec', 'gzip'))
+
+        if self.key and incremental and not use_tar_incremental and self.repo_format != 'dedup':
+            # rsync 目录树无法加密，改用基于文件索引的增量备份（压缩包加密存放）
+            Colors.info("项目开启了加密，增量备份改用文件索引模式（rsync 目录树不加密）")
+            use_tar_incremental = True
+        if self.repo_format == 'dedup':
+            Colors.info("使用分块去重仓库备份...")
+            return self._backup_with_chunks(backup_dir, exclude_list)
+        elif incremental and use_tar_incremental:
+            # 没有 rsync 时使用基于文件索引的 tar 增量备份
+            Colors.info("使用文件索引进行增量备份...")
+            return self._backup_incremental_tar(backup_path, exclude_list)
+        elif incremental:
             # 增量备份使用 rsync
             Colors.info("使用 rsync 进行增量备份...")
             return self._backup_with_rsync(backup_dir, exclude_list)
@@ -227,86 +2770,652 @@ class BackupManager:
         """检查命令是否可用"""
         return shutil.which(cmd) is not None
 
+    def _resolve_codec(self, codec: str) -> str:
+        """按回退链选择远程主机上可用的压缩格式（gzip 使用 tar 内置支持）"""
+        if codec not in COMPRESSORS:
+            Colors.warning(f"未知的压缩格式 {codec}，使用 gzip")
+            return 'gzip'
+
+        requested = codec
+        while codec not in ('gzip', 'none') and not self.ssh.has_command(codec):
+            codec = COMPRESSORS[codec]['fallback']
+        if codec != requested:
+            Colors.warning(f"远程主机没有 {requested}，改用 {codec}")
+        return codec
+
+    def _archive_ext(self) -> str:
+        """当前压缩格式的压缩包扩展名"""
+        return f".tar{COMPRESSORS[self.codec]['ext']}"
+
     def _backup_with_rsync(self, backup_dir: Path, exclude: List[str]) -> bool:
         """使用 rsync 增量备份"""
-        previous = self._get_latest_backup()
+        cmd = ['rsync', '-avz', '-e', self.ssh.rsync_shell()]
+        previous = self._get_latest_backup(exclude=backup_dir.parent)
         if previous and previous.exists():
-            link_dest = previous / "files"
-            cmd = f'rsync -avz -e "ssh -p {self.project["port"]}" --link-dest="{link_dest}" '
-
-            # 添加排除项
-            for pattern in exclude:
-                cmd += f'--exclude="{pattern}" '
-        else:
-            cmd = f'rsync -avz -e "ssh -p {self.project["port"]}" '
-            for pattern in exclude:
-                cmd += f'--exclude="{pattern}" '
-
-        remote = f'{self.project["user"]}@{self.project["host"]}:{self.project["remotePath"]}/'
-        cmd += f'{remote} {backup_dir}/'
+            cmd.append(f'--link-dest={previous / "files"}')
+        cmd += [f'--exclude={pattern}' for pattern in exclude]
+        cmd += [f'{self.ssh.target}:{self.project["remotePath"]}/', f'{backup_dir}/']
 
-        try:
-            result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-            if result.returncode == 0:
-                Colors.success("rsync 增量备份完成")
-                return True
-            else:
-                Colors.error(f"rsync 失败: {result.stderr.strip()}")
+        with self._phase('files:rsync') as timing:
+            try:
+                result = subprocess.run(cmd, capture_output=True, text=True)
+                if result.returncode == 0:
+                    self.files_info = {'format': 'rsync'}
+                    timing['success'] = True
+                    Colors.success("rsync 增量备份完成")
+                    return True
+                else:
+                    Colors.error(f"rsync 失败: {result.stderr.strip()}")
+                    return False
+            except Exception as e:
+                Colors.error(f"备份文件失败: {e}")
                 return False
-        except Exception as e:
-            Colors.error(f"备份文件失败: {e}")
-            return False
 
     def _backup_with_archive(self, backup_dir: Path, exclude: List[str]) -> bool:
         """使用压缩包备份（推荐）"""
+        if self.archive_mode == 'stream':
+            return self._backup_with_stream(backup_dir, exclude)
+        if self.archive_mode == 'sharded':
+            return self._backup_with_shards(backup_dir, exclude)
+
         timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        archive_name = f"backup_{timestamp}.tar.gz"
+        archive_name = f"backup_{timestamp}{self._archive_ext()}"
         remote_archive = f"/tmp/{archive_name}"
 
         # 在远程服务器上创建压缩包
-        if not self._create_remote_tar(remote_archive, exclude):
+        with self._phase('files:archive') as timing:
+            timing['success'] = self._create_remote_tar(remote_archive, exclude)
+        if not timing['success']:
             return False
 
-        # 下载压缩包到本地
+        # 下载压缩包到本地；无论成功与否都清理远程临时文件
         local_archive = backup_dir / archive_name
-        if not self._download_archive(remote_archive, local_archive):
+        try:
+            with self._phase('files:transfer') as timing:
+                downloaded = self._download_archive(remote_archive, local_archive)
+                timing.update(success=downloaded, bytes=local_archive.stat().st_size if downloaded else 0)
+        finally:
+            Colors.info("清理远程临时文件...")
+            with self._phase('files:cleanup') as timing:
+                timing['success'] = self.ssh.run(f'rm -f {shlex.quote(remote_archive)}').returncode == 0
+        if not downloaded:
             return False
+        if self.key:
+            with self._phase('files:encrypt') as timing:
+                timing.update(success=self._encrypt_file(local_archive), bytes=local_archive.stat().st_size)
+            if not timing['success']:
+                return False
 
-        # 清理远程临时文件
-        Colors.info("清理远程临时文件...")
-        cleanup_cmd = f'ssh -p {self.project["port"]} {self.project["user"]}@{self.project["host"]} "rm -f {remote_archive}"'
-        subprocess.run(cleanup_cmd, shell=True, capture_output=True)
-
+        self.files_info = {'format': 'archive', 'archive': archive_name, 'codec': self.codec,
+                           'root': self._archive_root()}
         Colors.success(f"文件备份完成: {archive_name}")
         return True
 
-    def _create_remote_tar(self, remote_archive: str, exclude: List[str]) -> bool:
-        """在远程服务器上创建压缩包"""
-        Colors.info("在远程服务器创建压缩包...")
+    def _backup_with_stream(self, backup_dir: Path, exclude: List[str]) -> bool:
+        """流式备份 - 远程 tar 输出经同一个 SSH 通道直接写入本地文件
 
-        # 构建 tar 排除参数
-        tar_excludes = ""
-        for pattern in exclude:
-            # 转换 rsync 模式到 tar 模式
-            tar_pattern = pattern.replace("/**", "").rstrip("/")
-            tar_excludes += f" --exclude='{tar_pattern}'"
+        不在远程 /tmp 落盘，远程压缩与网络传输同时进行。
+        """
+        if self.project.get('archiveIndex', True):
+            decompress = COMPRESSORS[self.codec]['decompress']
+            if self.codec in ('gzip', 'pigz', 'none') or self._is_command_available(decompress.split()[0]):
+                return self._backup_with_index(backup_dir, exclude)
+            Colors.warning(f"本地没有 {decompress.split()[0]}，不生成成员索引")
 
-        # 创建压缩包命令 - 分两步执行
-        dir_name = os.path.basename(self.project['remotePath'])
-        parent_dir = os.path.dirname(self.project['remotePath'])
-        if not parent_dir:
-            parent_dir = '.'
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        archive_name = f"backup_{timestamp}{self._archive_ext()}"
+        local_archive = backup_dir / archive_name
+
+        tar_cmd = self._build_tar_command('-', exclude)
+
+        Colors.info(f"正在流式压缩并传输... (排除: {len(exclude)} 个规则)")
+        if not self._stream_to_file(tar_cmd, local_archive):
+            return False
+
+        size = local_archive.stat().st_size
+        self.files_info = {'format': 'archive', 'archive': archive_name, 'codec': self.codec,
+                           'root': self._archive_root()}
+        Colors.success(f"文件备份完成: {archive_name} ({self._format_size(size)})")
+        return True
+
+    def _backup_with_index(self, backup_dir: Path, exclude: List[str]) -> bool:
+        """流式备份并在本地写成带成员索引的 tar.gz
+
+        远程仍按 archiveCodec 压缩传输；本地解压后按块重新压缩并记录成员偏移，
+        restore --path / extract / cat 只需读取目标文件所在的块。
+        """
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        archive_name = f"backup_{timestamp}.tar.gz"
+        local_archive = backup_dir / archive_name
+        tar_cmd = self._build_tar_command('-', exclude)
+
+        Colors.info(f"正在流式压缩并传输（生成成员索引）... (排除: {len(exclude)} 个规则)")
+        with self._phase('files:stream') as timing:
+            writer = IndexedArchiveWriter(local_archive, self.threads, self.project.get('archiveIndexLevel', 6),
+                                          self._open_output(local_archive))
+            local = None
+            with tempfile.TemporaryFile() as err:
+                proc = self.ssh.popen(tar_cmd, stdout=subprocess.PIPE, stderr=err)
+                try:
+                    if self.codec in ('gzip', 'pigz'):
+                        source = gzip.GzipFile(fileobj=proc.stdout)
+                    elif self.codec == 'none':
+                        source = proc.stdout
+                    else:
+                        local = subprocess.Popen(COMPRESSORS[self.codec]['decompress'].split(),
+                                                 stdin=proc.stdout, stdout=subprocess.PIPE)
+                        proc.stdout.close()
+                        source = local.stdout
+                    copy_stream(source, writer)
+                    index = writer.close()
+                except Exception as e:
+                    Colors.error(f"流式备份异常: {e}")
+                    writer.abort()
+                    proc.kill()
+                    if local:
+                        local.kill()
+                    proc.wait()
+                    return False
+
+                returncode = proc.wait()
+                if local and local.wait() != 0:
+                    returncode = returncode or local.returncode
+                err.seek(0)
+                stderr = err.read().decode('utf-8', errors='replace')
+
+            if returncode != 0 or PIPE_FAILED_MARKER in stderr or not writer.raw_offset:
+                Colors.error(f"流式备份失败: {stderr.replace(PIPE_FAILED_MARKER, '').strip()}")
+                writer.abort()
+                return False
+
+            self._record_checksum(local_archive, writer.digest.hexdigest())
+            timing.update(success=True, bytes=local_archive.stat().st_size, rawBytes=writer.raw_offset)
+        self.files_info = {'format': 'archive', 'archive': archive_name, 'codec': 'gzip',
+                           'transferCodec': self.codec, 'root': self._archive_root()}
+        if index:
+            with gzip.open(backup_dir / ARCHIVE_INDEX_NAME, 'wt', encoding='utf-8') as f:
+                json.dump(index, f)
+            self.files_info['index'] = ARCHIVE_INDEX_NAME
+            detail = f"{len(index['members'])} 个成员"
+        else:
+            Colors.warning("无法解析 tar 头，未生成成员索引")
+            detail = "无索引"
+
+        size = local_archive.stat().st_size
+        Colors.success(f"文件备份完成: {archive_name} ({self._format_size(size)}，{detail})")
+        return True
+
+    def _backup_with_shards(self, backup_dir: Path, exclude: List[str]) -> bool:
+        """分片备份 - 按顶层条目的大小把 remotePath 分成 N 组，每组一个 tar 并行打包传输
 
-        tar_cmd = f'ssh -p {self.project["port"]} {self.project["user"]}@{self.project["host"]} "cd {parent_dir} && tar -czf {remote_archive} {tar_excludes} {dir_name}"'
+        每个分片在远程各占一个 tar/压缩进程，避免单核瓶颈；分片列表写入 manifest。
+        """
+        entries = self._list_top_entries(exclude)
+        if entries is None:
+            return False
+        if len(entries) < 2 or self.shards < 2:
+            Colors.info("顶层条目不足以分片，使用流式备份")
+            return self._backup_with_stream(backup_dir, exclude)
+
+        shards = self._plan_shards(entries, self.shards)
+        root = self._archive_root()
+        Colors.info(f"分片备份: {len(entries)} 个顶层条目分为 {len(shards)} 个分片"
+                    f"（估算 {', '.join(self._format_size(s['estimatedBytes']) for s in shards)}）")
+
+        def run_shard(i: int, shard: Dict) -> bool:
+            shard['archive'] = f"shard-{i:02d}{self._archive_ext()}"
+            tar_cmd = self._build_tar_command('-', exclude, paths=[f'{root}/{e}' for e in shard['entries']])
+            if not self._stream_to_file(tar_cmd, backup_dir / shard['archive'], phase=f'files:shard-{i:02d}'):
+                return False
+            shard['size'] = (backup_dir / shard['archive']).stat().st_size
+            return True
+
+        with ThreadPoolExecutor(max_workers=len(shards)) as pool:
+            ok = all(list(pool.map(run_shard, range(len(shards)), shards)))
+        if not ok:
+            for shard in shards:
+                if shard.get('archive') and (backup_dir / shard['archive']).exists():
+                    (backup_dir / shard['archive']).unlink()
+            return False
+
+        self.files_info = {'format': 'sharded', 'codec': self.codec, 'root': root, 'shards': shards}
+        total = sum(shard['size'] for shard in shards)
+        Colors.success(f"文件备份完成: {len(shards)} 个分片 ({self._format_size(total)})")
+        return True
+
+    def _list_top_entries(self, exclude: List[str]) -> Optional[Dict[str, int]]:
+        """用 du 估算 remotePath 下每个顶层条目的大小（字节），跳过被整体排除的条目"""
+        remote_path = shlex.quote(self.project['remotePath'])
+        cmd = (f'cd {remote_path} && for f in * .[!.]* ..?*; do '
+               f'if [ -e "$f" ] || [ -L "$f" ]; then du -sk -- "$f"; fi; done')
+        result = self.ssh.run(cmd)
+        if result.returncode != 0 and not result.stdout:
+            Colors.error(f"统计远程目录大小失败: {result.stderr.strip()}")
+            return None
+
+        entries = {}
+        for line in result.stdout.splitlines():
+            size, _, name = line.partition('\t')
+            if name and size.isdigit() and not is_excluded(name, exclude):
+                entries[name] = int(size) * 1024
+        return entries
+
+    @staticmethod
+    def _plan_shards(entries: Dict[str, int], count: int) -> List[Dict]:
+        """最长处理时间优先（LPT）：从大到小依次放入当前最小的分片"""
+        shards = [{'entries': [], 'estimatedBytes': 0} for _ in range(min(count, len(entries)))]
+        for name, size in sorted(entries.items(), key=lambda e: e[1], reverse=True):
+            target = min(shards, key=lambda shard: shard['estimatedBytes'])
+            target['entries'].append(name)
+            target['estimatedBytes'] += size
+        return shards
+
+    def _stream_to_file(self, remote_cmd: str, local_file: Path, stdin=None,
+                        phase: str = 'files:stream', warnings: Optional[List[str]] = None) -> bool:
+        """把远程命令的输出经 SSH 直接写入本地文件，写入时计算 SHA-256，失败时删除不完整的文件
+
+        远程打包/压缩与传输同时进行，整体记为一个阶段 phase。
+        warnings 不为 None 时，成功后把远程 stderr 的各行追加到其中。
+        """
+        with self._phase(phase) as timing:
+            try:
+                with self._open_output(local_file) as f, tempfile.TemporaryFile() as err:
+                    proc = self.ssh.popen(remote_cmd, stdin=stdin, stdout=subprocess.PIPE, stderr=err)
+                    writer = HashingWriter(f)
+                    try:
+                        received = copy_stream(proc.stdout, writer)
+                    finally:
+                        proc.stdout.close()
+                        returncode = proc.wait()
+                    err.seek(0)
+                    stderr = err.read().decode('utf-8', errors='replace')
+
+                if returncode == 0 and PIPE_FAILED_MARKER not in stderr and received > 0:
+                    if warnings is not None:
+                        warnings.extend(stderr.splitlines())
+                    self._record_checksum(local_file, writer.hexdigest())
+                    timing.update(success=True, bytes=local_file.stat().st_size)
+                    return True
+                else:
+                    Colors.error(f"流式备份失败: {stderr.replace(PIPE_FAILED_MARKER, '').strip()}")
+                    local_file.unlink()
+                    return False
+            except Exception as e:
+                Colors.error(f"流式备份异常: {e}")
+                if local_file.exists():
+                    local_file.unlink()
+                return False
+
+    def _open_output(self, path: Path):
+        """打开版本内的输出文件；配置了对象存储时返回边写入边上传的 StorageTee，
+        开启加密时外面再套一层 EncryptingWriter（本地和对象存储中都是密文）
+        """
+        if not self.storage:
+            f = open(path, 'wb')
+        else:
+            f = StorageTee(path, self.storage, self._storage_key(path), self.uploaded)
+        if self.key:
+            return EncryptingWriter(f, self.key, self.threads)
+        return f
+
+    def _encrypt_file(self, path: Path) -> bool:
+        """加密已下载到本地的文件（暂存模式的压缩包），记录明文的 SHA-256"""
+        temp = path.with_name(f'{path.name}.encrypting')
+        try:
+            with open(path, 'rb') as src, EncryptingWriter(open(temp, 'wb'), self.key, self.threads) as dst:
+                writer = HashingWriter(dst)
+                copy_stream(src, writer)
+            os.replace(temp, path)
+        except (IOError, OSError) as e:
+            Colors.error(f"加密压缩包失败: {e}")
+            for leftover in (temp, path):
+                if leftover.exists():
+                    leftover.unlink()
+            return False
+        self._record_checksum(path, writer.hexdigest())
+        return True
+
+    def _storage_key(self, path: Path) -> str:
+        """对象键与 localPath 下的相对路径相同: backups/<版本>/...、chunks/xx/<哈希>"""
+        return path.relative_to(self.local_path).as_posix()
+
+    def _sync_storage(self, backup_path: Path) -> bool:
+        """上传版本中尚未上传的文件（清单、索引、暂存模式的压缩包、rsync 目录树等）和新增的去重块
+
+        流式写入的文件在接收时已经上传，这里不再读取；manifest.json 最后上传，
+        对象存储中有清单的版本才是完整的。上传失败不影响本地版本。
+        """
+        Colors.info(f"同步到对象存储 {self.storage.describe()} ...")
+        with self._phase('storage') as timing:
+            manifest = backup_path / 'manifest.json'
+            pending = [(self._storage_key(path), path) for path in sorted(backup_path.rglob('*'))
+                       if path.is_file() and path != manifest and self._storage_key(path) not in self.uploaded]
+            store = ChunkStore(self.local_path / "chunks")
+            pending += [(self._storage_key(store.chunk_path(digest)), store.chunk_path(digest))
+                        for digest in self.new_chunks]
+            # 上传后又被删除的文件（失败的阶段）
+            stale = [key for key in self.uploaded if not (self.local_path / key).exists()]
+            try:
+                with ThreadPoolExecutor(max_workers=self.storage.threads) as pool:
+                    sizes = list(pool.map(lambda item: self.storage.put_file(*item), pending))
+                for key in stale:
+                    self.storage.delete(key)
+                sizes.append(self.storage.put_file(self._storage_key(manifest), manifest))
+            except (IOError, OSError) as e:
+                Colors.error(f"上传到对象存储失败（本地版本不受影响）: {e}")
+                return False
+
+            timing.update(success=True, bytes=sum(sizes))
+            Colors.success(f"已同步到对象存储: 上传 {len(sizes)} 个文件 ({self._format_size(sum(sizes))})，"
+                           f"{len(self.uploaded) - len(stale)} 个文件已在接收时上传")
+            return True
+
+    def _record_checksum(self, path: Path, digest: str):
+        """记录版本内文件（files/ 或 databases/ 下）的 SHA-256"""
+        with self._checksum_lock:
+            self.checksums[f'{path.parent.name}/{path.name}'] = digest
+
+    def _backup_incremental_tar(self, backup_path: Path, exclude: List[str]) -> bool:
+        """基于文件索引的增量备份（只依赖 tar，适用于没有 rsync 的主机）
+
+        列出远程文件的 (路径, 大小, mtime)，与上一个版本的索引比较，
+        只打包新增或修改的文件，并记录删除列表；还原时按链依次应用。
+        """
+        backup_dir = backup_path / "files"
+        parent = self._find_incremental_parent(backup_path)
+        max_chain = self.project.get('incrementalMaxChain', 14)
+        if parent and parent[1]['level'] + 1 >= max_chain:
+            Colors.info(f"增量链已达 {max_chain} 级，重新创建完整基线")
+            parent = None
+
+        with self._phase('files:list') as timing:
+            current, dirs, agent = self._list_remote_files(exclude, parent[1] if parent else None, timing)
+            timing['success'] = current is not None and dirs is not None
+        if current is None or dirs is None:
+            return False
+
+        previous = parent[1]['files'] if parent else {}
+        changed = [path for path, (size, mtime, _) in current.items()
+                   if path not in previous or previous[path][:2] != [size, mtime]]
+        deleted = sorted(path for path in previous if path not in current)
+
+        # 沿用未变化文件的哈希；开启哈希时，仅 mtime 变化而内容相同的文件不再打包
+        for path, entry in current.items():
+            if path in previous and previous[path][:2] == entry[:2]:
+                entry[2] = previous[path][2]
+        if self.project.get('incrementalHash') and changed:
+            # 索引代理已经为变化的文件计算过哈希
+            unhashed = [path for path in changed if not current[path][2]]
+            if unhashed:
+                with self._phase('files:hash') as timing:
+                    hashes = self.ssh.hash_files(self.project['remotePath'], unhashed)
+                    timing['success'] = hashes is not None
+                if hashes is None:
+                    return False
+                for path in unhashed:
+                    current[path][2] = hashes.get(path)
+            same = {path for path in changed
+                    if path in previous and previous[path][2] and previous[path][2] == current[path][2]}
+            # 内容未变的文件沿用上一版本的条目: 增量链中的压缩包保存的是原来的 mtime，
+            # 索引与还原结果保持一致（之后每次备份会重新比较哈希，直到内容变化）
+            for path in same:
+                current[path] = list(previous[path])
+            changed = [path for path in changed if path not in same]
+
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        archive_name = None
+        if not parent:
+            archive_name = f"backup_{timestamp}{self._archive_ext()}"
+            Colors.info(f"创建完整基线: {len(current)} 个文件")
+            if not self._stream_to_file(self._build_tar_command('-', exclude), backup_dir / archive_name,
+                                        phase='files:transfer'):
+                return False
+        elif changed:
+            archive_name = f"delta_{timestamp}{self._archive_ext()}"
+            Colors.info(f"打包 {len(changed)} 个变化文件（删除 {len(deleted)} 个）")
+            root = self._archive_root()
+            warnings: List[str] = []
+            with tempfile.TemporaryFile() as file_list:
+                file_list.write(''.join(f'{root}/{path}\n' for path in changed).encode('utf-8'))
+                file_list.seek(0)
+                tar_cmd = self._build_tar_command('-', [], files_from_stdin=True)
+                if not self._stream_to_file(tar_cmd, backup_dir / archive_name, stdin=file_list,
+                                            phase='files:transfer', warnings=warnings):
+                    return False
+            # 列出之后被删除的文件不在压缩包中，记为已删除
+            vanished = self._vanished_files(warnings, root)
+            if vanished:
+                Colors.warning(f"{len(vanished)} 个文件在列出之后被删除，记为已删除")
+                for path in vanished:
+                    current.pop(path, None)
+                changed = [path for path in changed if path not in vanished]
+                deleted = sorted(set(deleted) | {path for path in vanished if path in previous})
+        else:
+            Colors.info(f"没有文件变化（删除 {len(deleted)} 个）")
+
+        index = {
+            'parent': parent[0].name if parent else None,
+            'level': parent[1]['level'] + 1 if parent else 0,
+            'archive': archive_name,
+            'deleted': deleted,
+            'files': current,
+            'dirs': sorted(dirs),
+        }
+        if agent:
+            index['agent'] = agent
+        with gzip.open(backup_dir / FILE_INDEX_NAME, 'wt', encoding='utf-8') as f:
+            json.dump(index, f)
+
+        self.files_info = {
+            'format': 'incremental',
+            'index': FILE_INDEX_NAME,
+            'archive': archive_name,
+            'codec': self.codec,
+            'parent': index['parent'],
+            'level': index['level'],
+            'root': self._archive_root(),
+            'fileCount': len(current),
+            'changed': len(current) if not parent else len(changed),
+            'deleted': len(deleted),
+        }
+        Colors.success(f"增量备份完成（第 {index['level']} 级）")
+        return True
+
+    def _list_remote_files(self, exclude: List[str], previous: Optional[Dict],
+                           timing: Dict) -> Tuple[Optional[Dict[str, List]], Optional[set], Optional[Dict]]:
+        """列出远程文件和目录，返回 (文件清单, 目录集合, 索引代理状态)
+
+        开启 remoteAgent 时由远程索引代理只返回自父版本以来的文件变化（以及全部目录），
+        应用到父版本的清单上；新基线要求代理完整扫描。代理不可用时退回 find 完整列出。
+        """
+        remote_path = self.project['remotePath']
+        if not self.project.get('remoteAgent'):
+            files = self.ssh.list_files(remote_path, exclude)
+            dirs = self.ssh.list_dirs(remote_path, exclude) if files is not None else None
+            return files, dirs, None
+
+        known = previous.get('agent') if previous else None
+        listing = self.ssh.agent_changes(
+            remote_path, exclude,
+            since=known['generation'] if known else 0,
+            state_id=known['state'] if known else '',
+            hash_files=bool(self.project.get('incrementalHash')),
+            full=previous is None,
+            quick=bool(self.project.get('agentQuickScan')),
+            full_after=self.project.get('agentFullScanHours', 168) * 3600,
+            python=self.project.get('agentPython', 'python3'))
+        if listing is None:
+            Colors.warning("远程索引代理不可用，改为完整列出远程文件")
+            files = self.ssh.list_files(remote_path, exclude)
+            dirs = self.ssh.list_dirs(remote_path, exclude) if files is not None else None
+            return files, dirs, None
+
+        if listing['full']:
+            current = listing['files']
+        else:
+            current = {path: list(entry) for path, entry in previous['files'].items()}
+            current.update(listing['files'])
+            for path in listing['deleted']:
+                current.pop(path, None)
+
+        stats = listing['stats']
+        scan = "完整扫描" if stats.get('full') else f"重新列出 {stats.get('rescanned', 0)}/{stats.get('dirs', 0)} 个目录"
+        result = "完整清单" if listing['full'] else f"{len(listing['files'])} 个变化、{len(listing['deleted'])} 个删除"
+        Colors.info(f"远程索引代理: 第 {listing['generation']} 代，{scan}，{result}"
+                    f"（{self._format_size(listing['bytes'])}，扫描 {stats.get('seconds', 0)}s）")
+        timing['bytes'] = listing['bytes']
+        return current, listing['dirs'], {'state': listing['state'], 'generation': listing['generation']}
+
+    def _find_incremental_parent(self, current: Path) -> Optional[Tuple[Path, Dict]]:
+        """查找最近一个成功的增量链版本，返回 (版本目录, 文件索引)"""
+        if not self.backup_base.exists():
+            return None
+
+        for version in sorted(self.backup_base.iterdir(), reverse=True):
+            index_file = version / "files" / FILE_INDEX_NAME
+            if version == current or not index_file.exists():
+                continue
+            try:
+                with open(version / 'manifest.json', 'r', encoding='utf-8') as f:
+                    if not json.load(f).get('success'):
+                        continue
+                with gzip.open(index_file, 'rt', encoding='utf-8') as f:
+                    return version, json.load(f)
+            except (OSError, ValueError):
+                continue
+        return None
+
+    def _backup_with_chunks(self, backup_dir: Path, exclude: List[str]) -> bool:
+        """分块去重备份 - 远程输出未压缩的 tar 流，本地切块入库
+
+        只有内容发生变化的块会被写入仓库，版本目录中仅保存块引用列表 chunks.json。
+        """
+        store = ChunkStore(self.local_path / "chunks", self.key)
+        self.new_chunks = store.new_chunks
+        tar_cmd = self._build_tar_command('-', exclude, compress=False)
+
+        with self._phase('files:chunks') as timing:
+            try:
+                with tempfile.TemporaryFile() as err:
+                    proc = self.ssh.popen(tar_cmd, stdout=subprocess.PIPE, stderr=err)
+                    try:
+                        stats = store.ingest(proc.stdout)
+                    except Exception:
+                        # 入库失败（磁盘已满、加密出错）时结束远程 tar，不留下未回收的 ssh 进程
+                        proc.kill()
+                        raise
+                    finally:
+                        proc.stdout.close()
+                        returncode = proc.wait()
+                    err.seek(0)
+                    stderr = err.read().decode('utf-8', errors='replace').strip()
+
+                if returncode != 0 or not stats['chunks']:
+                    Colors.error(f"分块备份失败: {stderr}")
+                    return False
+
+                index = {'format': 'dedup', 'root': self._archive_root(), **stats}
+                if self.key:
+                    index['encryption'] = {'algorithm': 'AES-256-GCM', 'keyId': encryption_key_id(self.key).hex()}
+                with open(backup_dir / 'chunks.json', 'w', encoding='utf-8') as f:
+                    json.dump(index, f)
+
+                self.files_info = {
+                    'format': 'dedup',
+                    'index': 'chunks.json',
+                    'root': index['root'],
+                    'size': stats['size'],
+                    'newBytes': stats['newBytes'],
+                }
+                timing.update(success=True, bytes=stats['size'], rawBytes=stats['size'])
+                Colors.success(f"分块备份完成: {len(stats['chunks'])} 块（新增 {stats['newChunks']} 块，"
+                               f"写入 {self._format_size(stats['newBytes'])} / 原始 {self._format_size(stats['size'])}）")
+                return True
+            except Exception as e:
+                Colors.error(f"分块备份异常: {e}")
+                return False
+
+    def _archive_root(self) -> str:
+        """压缩包中的顶层目录名"""
+        return os.path.basename(self.project['remotePath'])
+
+    def _build_tar_command(self, output: str, exclude: List[str], compress: bool = True,
+                           files_from_stdin: bool = False, paths: Optional[List[str]] = None) -> str:
+        """构建远程 tar 命令
+
+        output 为 '-' 时输出到标准输出；files_from_stdin 时从标准输入读取文件列表，
+        列表先经 VANISHED_FILTER 去掉已不存在的文件，GNU tar 另加 --ignore-failed-read
+        （过滤之后、读取之前被删除的文件只输出警告）；
+        paths 指定要打包的路径（相对 remotePath 的上级目录），默认为整个 remotePath。
+        gzip 使用 tar 内置压缩，其他格式通过管道交给（多线程）压缩程序。
+        """
+        # 构建 tar 排除参数（转换 rsync 模式到 tar 模式），每个参数单独转义
+        tar_excludes = ' '.join(shlex.quote(f'--exclude={pattern.replace("/**", "").rstrip("/")}')
+                                for pattern in exclude)
+
+        if files_from_stdin:
+            sources = '--ignore-failed-read -T -' if self._remote_gnu_tar() else '-T -'
+        else:
+            targets = ' '.join(shlex.quote(p) for p in (paths or [self._archive_root()]))
+            sources = f'{tar_excludes} {targets}'
+        codec = self.codec if compress else 'none'
+        output = shlex.quote(output)
+
+        if codec == 'gzip':
+            tar_cmd = f'tar -czf {output} {sources}'
+        elif codec == 'none':
+            tar_cmd = f'tar -cf {output} {sources}'
+        else:
+            tar_cmd = f'{{ tar -cf - {sources} || echo {PIPE_FAILED_MARKER} >&2; }} | {compress_command(codec, self.threads)}'
+            if output != '-':
+                tar_cmd += f' > {output}'
+        if files_from_stdin:
+            tar_cmd = f'{VANISHED_FILTER} | {tar_cmd}'
+
+        return f'cd {shlex.quote(self._remote_parent())} && {tar_cmd}'
+
+    def _remote_gnu_tar(self) -> bool:
+        """远程 tar 是否为 GNU tar（支持 --ignore-failed-read；BusyBox tar 不支持），结果缓存"""
+        if self.gnu_tar is None:
+            self.gnu_tar = 'GNU tar' in self.ssh.run('tar --version').stdout
+        return self.gnu_tar
+
+    @staticmethod
+    def _vanished_files(warnings: List[str], root: str) -> set:
+        """从增量打包的 stderr 中找出列出之后被删除的文件（相对 remotePath 的路径）"""
+        gnu_warning = re.compile(r'^tar: (.*): Warning: Cannot (?:stat|open): No such file or directory$')
+        vanished = set()
+        for line in warnings:
+            match = gnu_warning.match(line)
+            if line.startswith(f'{VANISHED_MARKER} '):
+                name = line[len(VANISHED_MARKER) + 1:]
+            elif match:
+                name = match.group(1)
+            else:
+                continue
+            if name.startswith(f'{root}/'):
+                vanished.add(name[len(root) + 1:])
+        return vanished
+
+    def _remote_parent(self) -> str:
+        """remotePath 的上级目录（tar 的工作目录）"""
+        return os.path.dirname(self.project['remotePath']) or '.'
+
+    def _create_remote_tar(self, remote_archive: str, exclude: List[str]) -> bool:
+        """在远程服务器上创建压缩包"""
+        Colors.info("在远程服务器创建压缩包...")
+
+        # 创建压缩包命令 - 分两步执行
+        tar_cmd = self._build_tar_command(remote_archive, exclude)
 
         try:
             Colors.info(f"正在压缩... (排除: {len(exclude)} 个规则)")
-            result = subprocess.run(tar_cmd, shell=True, capture_output=True, text=True, timeout=600)
+            result = self.ssh.run(tar_cmd, timeout=600)
 
-            if result.returncode == 0:
+            if result.returncode == 0 and PIPE_FAILED_MARKER not in result.stderr:
                 # 验证文件是否存在
-                check_cmd = f'ssh -p {self.project["port"]} {self.project["user"]}@{self.project["host"]} "test -f {remote_archive} && ls -lh {remote_archive}"'
-                check_result = subprocess.run(check_cmd, shell=True, capture_output=True, text=True)
+                quoted = shlex.quote(remote_archive)
+                check_result = self.ssh.run(f'test -f {quoted} && ls -lh {quoted}')
 
                 if check_result.returncode == 0:
                     Colors.success(f"远程压缩包创建成功\n{check_result.stdout.strip()}")
@@ -315,7 +3424,7 @@ class BackupManager:
                     Colors.error(f"压缩文件创建失败: {check_result.stderr.strip()}")
                     return False
             else:
-                Colors.error(f"创建压缩包失败: {result.stderr.strip()}")
+                Colors.error(f"创建压缩包失败: {result.stderr.replace(PIPE_FAILED_MARKER, '').strip()}")
                 return False
         except subprocess.TimeoutExpired:
             Colors.error("压缩超时（可能文件太大）")
@@ -325,23 +3434,25 @@ class BackupManager:
             return False
 
     def _download_archive(self, remote_archive: str, local_archive: Path) -> bool:
-        """从远程下载压缩包"""
+        """从远程下载压缩包（分段续传并校验）"""
         Colors.info("下载压缩包...")
 
-        scp_cmd = f'scp -P {self.project["port"]} {self.project["user"]}@{self.project["host"]}:{remote_archive} "{local_archive}"'
-
+        transfer = RangeTransfer(self.ssh, remote_archive, local_archive,
+                                 self.project.get('transferRangeMB', 8),
+                                 self.project.get('transferRetries', 5),
+                                 self.streams)
         try:
-            result = subprocess.run(scp_cmd, shell=True, capture_output=True, text=True)
-            if result.returncode == 0 and local_archive.exists():
+            if transfer.download():
+                if transfer.digest:
+                    self._record_checksum(local_archive, transfer.digest)
                 size = local_archive.stat().st_size
-                Colors.success(f"下载完成 ({self._format_size(size)})")
+                Colors.success(f"下载完成 ({self._format_size(size)}，{transfer.count} 段已校验)")
                 return True
-            else:
-                Colors.error(f"下载失败: {result.stderr.strip()}")
-                return False
         except Exception as e:
             Colors.error(f"下载异常: {e}")
-            return False
+        # 远程压缩包会被清理，不完整的本地文件无法再续传
+        transfer.discard()
+        return False
 
     def _format_size(self, size: int) -> str:
         """格式化大小"""
@@ -351,22 +3462,6 @@ class BackupManager:
             size /= 1024
         return f"{size:.1f}TB"
 
-    def _backup_databases(self, backup_path: Path) -> bool:
-        """备份数据库"""
-        Colors.info("备份数据库...")
-
-        db_dir = backup_path / "databases"
-        db_dir.mkdir(parents=True, exist_ok=True)
-
-        success = True
-        for db in self.project.get('databases', []):
-            if not self._backup_single_database(db, db_dir):
-                success = False
-
-        if success:
-            Colors.success("数据库备份完成")
-        return success
-
     def _backup_single_database(self, db: Dict, output_dir: Path) -> bool:
         """备份单个数据库"""
         db_type = db['type']
@@ -384,78 +3479,596 @@ class BackupManager:
 
     def _backup_mysql(self, db: Dict, output_dir: Path) -> bool:
         """备份 MySQL 数据库"""
-        output_file = output_dir / f"{db['name']}.sql"
-
-        cmd = [
-            'ssh', f'-p {self.project["port"]}',
-            f'{self.project["user"]}@{self.project["host"]}',
-            f'mysqldump -u {db["user"]} -p$MYSQL_PWD {db["name"]}'
-        ]
-
-        try:
-            result = subprocess.run(' '.join(cmd), shell=True, capture_output=True, text=True,
-                                    env={**os.environ, 'MYSQL_PWD': os.getenv('MYSQL_PASSWORD', '')})
-
-            if result.returncode == 0:
-                with open(output_file, 'w', encoding='utf-8') as f:
-                    f.write(result.stdout)
-                Colors.success(f"MySQL 备份完成: {output_file.name}")
-                return True
-            else:
-                Colors.error(f"MySQL 备份失败: {result.stderr.strip()}")
-                return False
-        except Exception as e:
-            Colors.error(f"MySQL 备份异常: {e}")
-            return False
+        password = shlex.quote(os.getenv('MYSQL_PASSWORD', ''))
+        dump_cmd = f'MYSQL_PWD={password} mysqldump -u {shlex.quote(db["user"])} {shlex.quote(db["name"])}'
+        return self._stream_dump(db, dump_cmd, output_dir, 'MySQL')
 
     def _backup_postgresql(self, db: Dict, output_dir: Path) -> bool:
         """备份 PostgreSQL 数据库"""
-        output_file = output_dir / f"{db['name']}.sql"
+        password = shlex.quote(os.getenv('PG_PASSWORD', ''))
+        dump_cmd = f'PGPASSWORD={password} pg_dump -U {shlex.quote(db["user"])} {shlex.quote(db["name"])}'
+        return self._stream_dump(db, dump_cmd, output_dir, 'PostgreSQL')
 
-        cmd = [
-            'ssh', f'-p {self.project["port"]}',
-            f'{self.project["user"]}@{self.project["host"]}',
-            f'PGPASSWORD=$PG_PWD pg_dump -U {db["user"]} {db["name"]}'
-        ]
+    def _stream_dump(self, db: Dict, dump_cmd: str, output_dir: Path, label: str) -> bool:
+        """流式导出数据库
 
-        try:
-            result = subprocess.run(' '.join(cmd), shell=True, capture_output=True, text=True,
-                                    env={**os.environ, 'PG_PWD': os.getenv('PG_PASSWORD', '')})
-
-            if result.returncode == 0:
-                with open(output_file, 'w', encoding='utf-8') as f:
-                    f.write(result.stdout)
-                Colors.success(f"PostgreSQL 备份完成: {output_file.name}")
-                return True
-            else:
-                Colors.error(f"PostgreSQL 备份失败: {result.stderr.strip()}")
+        导出内容按块从 SSH 管道直接写入磁盘，可选 gzip/zstd 压缩；
+        默认在远程压缩以减少网络传输量，远程缺少压缩工具时改为本地压缩。
+        """
+        compression = db.get('compression', self.project.get('dbCompression', 'none'))
+        if compression not in COMPRESSORS:
+            Colors.warning(f"未知的压缩格式 {compression}，不压缩")
+            compression = 'none'
+        codec = COMPRESSORS[compression]
+        output_file = output_dir / f"{db['name']}.sql{codec['ext']}"
+
+        remote_cmd = f'{{ {dump_cmd} || echo {PIPE_FAILED_MARKER} >&2; }}'
+        compress_remote = bool(codec['compress']) and self.project.get('dbCompressRemote', True) \
+            and self.ssh.has_command(compression)
+        if compress_remote:
+            remote_cmd += f' | {compress_command(compression)}'
+
+        with self._phase(f"database:{db['name']}") as timing:
+            try:
+                with self._open_output(output_file) as f:
+                    writer = HashingWriter(f)
+                    if codec['compress'] and not compress_remote:
+                        returncode, stderr = self._dump_with_local_compression(remote_cmd, writer, compression)
+                    else:
+                        returncode, stderr = self._dump_to(remote_cmd, writer)
+                stderr = stderr.decode('utf-8', errors='replace')
+
+                if returncode == 0 and PIPE_FAILED_MARKER not in stderr:
+                    self._record_checksum(output_file, writer.hexdigest())
+                    timing.update(success=True, bytes=output_file.stat().st_size)
+                    size = self._format_size(output_file.stat().st_size)
+                    Colors.success(f"{label} 备份完成: {output_file.name} ({size})")
+                    return True
+                else:
+                    Colors.error(f"{label} 备份失败: {stderr.replace(PIPE_FAILED_MARKER, '').strip()}")
+                    output_file.unlink()
+                    return False
+            except Exception as e:
+                Colors.error(f"{label} 备份异常: {e}")
+                if output_file.exists():
+                    output_file.unlink()
                 return False
-        except Exception as e:
-            Colors.error(f"PostgreSQL 备份异常: {e}")
-            return False
 
-    def _get_latest_backup(self) -> Optional[Path]:
-        """获取最新的备份目录"""
-        if not self.backup_base.exists():
-            return None
-
-        backups = sorted(self.backup_base.iterdir(), key=lambda p: p.stat().st_mtime, reverse=True)
-        return backups[0] if backups else None
+    def _dump_to(self, remote_cmd: str, f) -> Tuple[int, bytes]:
+        """把远程命令的输出按块写入 f，返回 (退出码, stderr)"""
+        with tempfile.TemporaryFile() as err:
+            proc = self.ssh.popen(remote_cmd, stdout=subprocess.PIPE, stderr=err)
+            try:
+                copy_stream(proc.stdout, f)
+            except Exception:
+                # 写入失败（磁盘已满、对象存储上传失败）时结束导出进程
+                proc.kill()
+                raise
+            finally:
+                proc.stdout.close()
+                returncode = proc.wait()
+            err.seek(0)
+            return returncode, err.read()
+
+    def _dump_with_local_compression(self, remote_cmd: str, f, compression: str) -> Tuple[int, bytes]:
+        """在本地边接收边压缩，返回 (退出码, stderr)"""
+        with tempfile.TemporaryFile() as err:
+            proc = self.ssh.popen(remote_cmd, stdout=subprocess.PIPE, stderr=err)
+            local = None
+            try:
+                if compression == 'gzip':
+                    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+                    copy_stream(proc.stdout, f, compressor.compress)
+                    f.write(compressor.flush())
+                else:
+                    local = subprocess.Popen(compress_command(compression).split(),
+                                             stdin=proc.stdout, stdout=subprocess.PIPE)
+                    proc.stdout.close()
+                    copy_stream(local.stdout, f)
+            except Exception:
+                # 写入失败时结束导出进程和本地压缩进程
+                proc.kill()
+                if local:
+                    local.kill()
+                raise
+            finally:
+                proc.stdout.close()
+                # 两个进程都要等待（不能短路），任一失败即失败
+                returncode, local_code = proc.wait(), 0
+                if local:
+                    local.stdout.close()
+                    local_code = local.wait()
+            if local_code:
+                err.seek(0, os.SEEK_END)
+                err.write(f"\n本地 {compression} 压缩失败（退出码 {local_code}）".encode('utf-8'))
+                returncode = returncode or local_code
+            err.seek(0)
+            return returncode, err.read()
+
+    def _get_latest_backup(self, exclude: Optional[Path] = None) -> Optional[Path]:
+        """获取最新的成功版本（按清单时间，与还原一致；exclude 为正在创建的版本）
+
+        失败或未完成（没有清单）的版本可能只有部分文件，不用作 rsync --link-dest 的基准。
+        """
+        for backup_dir, manifest in versions_by_time(self.backup_base):
+            if backup_dir != exclude and manifest and manifest.get('success'):
+                return backup_dir
+        return None
 
-    def _create_manifest(self, backup_path: Path):
+    def _create_manifest(self, backup_path: Path, stages: List[Dict]):
         """创建备份清单"""
         manifest = {
             'project': self.project['name'],
             'timestamp': datetime.datetime.now().isoformat(),
             'host': self.project['host'],
             'remotePath': self.project['remotePath'],
-            'includesDatabase': bool(self.project.get('databases')),
+            'includesDatabase': any(s['name'].startswith('database:') for s in stages),
+            'success': all(s['success'] for s in stages),
+            'stages': stages,
         }
+        if self.files_info:
+            manifest['files'] = {**self.files_info, 'exclude': self.exclude}
+
+        with self._phase('manifest') as timing:
+            # 接收时已计算哈希的大文件直接使用；索引等小文件在此补算（rsync 目录树不计算）
+            if self.files_info.get('format') != 'rsync':
+                for sub in ('files', 'databases'):
+                    for path in sorted((backup_path / sub).glob('*')) if (backup_path / sub).exists() else []:
+                        key = f'{sub}/{path.name}'
+                        if path.is_file() and key not in self.checksums:
+                            self.checksums[key] = file_sha256(path)
+            if self.checksums:
+                manifest['checksums'] = {'algorithm': 'sha256', 'files': dict(sorted(self.checksums.items()))}
+            if self.key:
+                # 校验和是明文的哈希，校验加密文件时边解密边计算
+                manifest['encryption'] = {'algorithm': 'AES-256-GCM', 'chunkSize': ENCRYPTION_CHUNK_SIZE,
+                                          'keyId': encryption_key_id(self.key).hex()}
+
+            # 版本统计只在备份时计算一次，去重仓库的新增块也算作该版本独占
+            stats = scan_backup_dir(backup_path)
+            stats['uniqueBytes'] += self.files_info.get('newBytes', 0)
+            manifest['stats'] = stats
+            timing['success'] = True
+
+        # 各阶段耗时（清单写入和清理旧版本只记录在运行日志中）
+        manifest['phases'] = self.phases
+        manifest['duration'] = round(time.monotonic() - self.run_start, 3)
 
         manifest_file = backup_path / 'manifest.json'
         with open(manifest_file, 'w', encoding='utf-8') as f:
             json.dump(manifest, f, indent=2, ensure_ascii=False)
 
+        BackupCatalog(self.local_path).update(backup_path.name, {
+            'timestamp': manifest['timestamp'],
+            'success': manifest['success'],
+            'format': self.files_info.get('format'),
+            'includesDatabase': manifest['includesDatabase'],
+            **stats,
+        })
+
+
+class BackupScheduler:
+    """多项目并行备份调度
+
+    总并发数受 jobs 限制，同一主机的并发数受 per_host 限制，
+    避免多个 tar 同时压在同一台服务器上。
+    """
+
+    def __init__(self, projects: List[Dict], jobs: int = 4, per_host: int = 1):
+        self.projects = projects
+        self.jobs = max(1, jobs)
+        self.per_host = max(1, per_host)
+
+    def run(self, **backup_options) -> List[Dict]:
+        """执行所有项目的备份，返回每个项目的结果"""
+        pending = list(self.projects)
+        host_running: Dict[str, int] = {}
+        running = {}
+        results = []
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            while pending or running:
+                # 在总并发和主机并发允许的范围内提交任务
+                for project in list(pending):
+                    if len(running) >= self.jobs:
+                        break
+                    host = project['host']
+                    if host_running.get(host, 0) >= self.per_host:
+                        continue
+                    pending.remove(project)
+                    host_running[host] = host_running.get(host, 0) + 1
+                    future = pool.submit(self._backup_project, project, backup_options)
+                    running[future] = project
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    project = running.pop(future)
+                    host_running[project['host']] -= 1
+                    results.append(future.result())
+
+        return results
+
+    def _backup_project(self, project: Dict, backup_options: Dict) -> Dict:
+        """备份单个项目并记录耗时"""
+        start = time.monotonic()
+        try:
+            success = BackupManager(project).create_backup(**backup_options)
+        except Exception as e:
+            Colors.error(f"{project['name']} 备份异常: {e}")
+            success = False
+        return {
+            'name': project['name'],
+            'host': project['host'],
+            'success': success,
+            'duration': time.monotonic() - start,
+        }
+
+
+class CronSchedule:
+    """五段式 cron 表达式（分 时 日 月 周），支持 * , - / 、英文月份/星期名和 @daily 等别名
+
+    日和周都不是 * 时按 cron 的约定取并集。
+    """
+
+    ALIASES = {
+        '@hourly': '0 * * * *',
+        '@daily': '0 0 * * *',
+        '@midnight': '0 0 * * *',
+        '@weekly': '0 0 * * 0',
+        '@monthly': '0 0 1 * *',
+        '@yearly': '0 0 1 1 *',
+        '@annually': '0 0 1 1 *',
+    }
+    NAMES = {name: i for i, name in enumerate(
+        ['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec'], 1)}
+    NAMES.update({name: i for i, name in enumerate(['sun', 'mon', 'tue', 'wed', 'thu', 'fri', 'sat'])})
+
+    def __init__(self, expr: str):
+        self.expr = expr
+        fields = self.ALIASES.get(expr.strip().lower(), expr).split()
+        if len(fields) != 5:
+            raise ValueError(f"cron 表达式应为 5 段: {expr}")
+        self.minutes = self._parse(fields[0], 0, 59)
+        self.hours = self._parse(fields[1], 0, 23)
+        self.days = self._parse(fields[2], 1, 31)
+        self.months = self._parse(fields[3], 1, 12)
+        # 周日可写作 0 或 7
+        self.weekdays = {d % 7 for d in self._parse(fields[4], 0, 7)}
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    def _parse(self, field: str, low: int, high: int) -> set:
+        values = set()
+        for part in field.lower().split(','):
+            base, _, step = part.partition('/')
+            if base == '*':
+                start, end = low, high
+            elif '-' in base:
+                start, end = (self._value(v) for v in base.split('-', 1))
+            else:
+                start = self._value(base)
+                end = high if step else start
+            if not (low <= start <= end <= high):
+                raise ValueError(f"cron 字段超出范围: {field}")
+            values.update(range(start, end + 1, int(step) if step else 1))
+        return values
+
+    def _value(self, text: str) -> int:
+        if text in self.NAMES:
+            return self.NAMES[text]
+        if not text.isdigit():
+            raise ValueError(f"无法解析 cron 字段: {text}")
+        return int(text)
+
+    def _day_matches(self, t: datetime.datetime) -> bool:
+        day = t.day in self.days
+        weekday = (t.weekday() + 1) % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def next_after(self, t: datetime.datetime) -> datetime.datetime:
+        """t 之后（不含 t 所在分钟）的下一个触发时间"""
+        t = t.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        limit = t + datetime.timedelta(days=366 * 5)
+        while t < limit:
+            if t.month not in self.months:
+                t = (t.replace(day=1, hour=0, minute=0) + datetime.timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(t):
+                t = t.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+            elif t.hour not in self.hours:
+                t = t.replace(minute=0) + datetime.timedelta(hours=1)
+            elif t.minute not in self.minutes:
+                t += datetime.timedelta(minutes=1)
+            else:
+                return t
+        raise ValueError(f"cron 表达式没有可触发的时间: {self.expr}")
+
+
+class BackupDaemon:
+    """常驻备份调度进程
+
+    在一个 asyncio 事件循环中按各项目的 schedule 触发备份，代替多条 cron 任务：
+    每次触发加随机延迟（jitter）错开同一时刻的任务；总并发和每主机并发用信号量限制；
+    同一项目上一次备份（含排队）未结束时跳过本次触发。备份本身在线程池中执行。
+    本地 Unix 套接字接受 JSON 行请求: {"cmd": "status"} 和 {"cmd": "trigger", "project": ...}。
+    projects.json 修改后自动重新加载调度。每次备份结束后可更新指标文件，
+    也可以在 metrics_port 上提供 Prometheus 的 /metrics。
+    """
+
+    def __init__(self, tags: List[str] = None, jobs: int = 4, per_host: int = 1,
+                 jitter: int = 120, socket_path: Path = DAEMON_SOCKET,
+                 metrics_file: Optional[Path] = None, metrics_port: Optional[int] = None,
+                 metrics_addr: str = '127.0.0.1'):
+        self.tags = tags
+        self.metrics_file = metrics_file
+        self.metrics_port = metrics_port
+        self.metrics_addr = metrics_addr
+        self.exporter = MetricsExporter()
+        self.jobs = max(1, jobs)
+        self.per_host = max(1, per_host)
+        self.jitter = max(0, jitter)
+        self.socket_path = Path(socket_path)
+        self.projects: Dict[str, Dict] = {}
+        self.state: Dict[str, Dict] = {}
+        self.running: Dict[str, asyncio.Task] = {}
+        self.timers: List[asyncio.Task] = []
+        self.config_mtime = None
+
+    def run(self) -> bool:
+        """运行直到收到 SIGINT/SIGTERM；已开始的备份会等待完成"""
+        try:
+            return asyncio.run(self._main())
+        except KeyboardInterrupt:
+            return True
+
+    async def _main(self) -> bool:
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=self.jobs))
+        self.slots = asyncio.Semaphore(self.jobs)
+        self.host_slots: Dict[str, asyncio.Semaphore] = {}
+        stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+
+        if not self._claim_socket():
+            return False
+        server = await asyncio.start_unix_server(self._handle_client, path=str(self.socket_path))
+        os.chmod(self.socket_path, 0o600)
+        Colors.header(f"back-mgr 调度进程 (并发 {self.jobs}, 每主机 {self.per_host}, 随机延迟 ≤{self.jitter}s)")
+        Colors.info(f"控制套接字: {self.socket_path}")
+        servers = [server]
+        if self.metrics_port:
+            servers.append(await asyncio.start_server(self._handle_http, self.metrics_addr, self.metrics_port))
+            Colors.info(f"指标: http://{self.metrics_addr}:{self.metrics_port}/metrics")
+
+        self._load_schedules()
+        self._write_metrics()
+        watcher = asyncio.ensure_future(self._watch_config())
+        await stop.wait()
+
+        Colors.info("正在停止调度...")
+        watcher.cancel()
+        for timer in self.timers:
+            timer.cancel()
+        for server in servers:
+            server.close()
+            await server.wait_closed()
+        await self._drain()
+        if self.socket_path.exists():
+            self.socket_path.unlink()
+        return True
+
+    async def _drain(self):
+        """停止时取消还在排队的备份（不再开始新的备份），等待执行中的备份结束"""
+        queued = [name for name in self.running if self.state[name]['state'] != 'running']
+        for name in queued:
+            self.running[name].cancel()
+        if queued:
+            Colors.info(f"取消 {len(queued)} 个排队中的备份: {', '.join(queued)}")
+        if self.running:
+            Colors.info(f"等待 {len(self.running) - len(queued)} 个进行中的备份结束")
+            await asyncio.gather(*self.running.values(), return_exceptions=True)
+
+    def _claim_socket(self) -> bool:
+        """套接字已被另一个调度进程占用时返回 False，遗留的套接字文件直接删除"""
+        if not self.socket_path.exists():
+            return True
+        if daemon_request({'cmd': 'status'}, self.socket_path) is not None:
+            Colors.error(f"调度进程已在运行: {self.socket_path}")
+            return False
+        self.socket_path.unlink()
+        return True
+
+    def _load_schedules(self):
+        """读取 projects.json，为每个项目的每条 schedule 启动定时任务"""
+        for timer in self.timers:
+            timer.cancel()
+        self.timers = []
+        self.config_mtime = PROJECTS_FILE.stat().st_mtime if PROJECTS_FILE.exists() else None
+
+        self.projects = {}
+        for project in ProjectConfig().filter_projects(self.tags):
+            entries = []
+            for entry in self._schedule_entries(project):
+                try:
+                    entries.append((CronSchedule(entry['cron']), entry))
+                except (KeyError, ValueError) as e:
+                    Colors.error(f"{project['name']}: 无效的 schedule {entry}: {e}")
+            if not entries:
+                continue
+            self.projects[project['name']] = project
+            state = self.state.setdefault(project['name'], {
+                'host': project['host'], 'state': 'idle', 'runs': 0, 'failures': 0, 'skipped': 0,
+            })
+            state['schedules'] = [entry['cron'] for _, entry in entries]
+            state['next'] = {}
+            for schedule, entry in entries:
+                self.timers.append(asyncio.ensure_future(self._timer(project['name'], schedule, entry)))
+        Colors.info(f"已加载 {len(self.projects)} 个项目的 {len(self.timers)} 条定时计划")
+
+    @staticmethod
+    def _schedule_entries(project: Dict) -> List[Dict]:
+        """项目的 schedule: cron 字符串、{"cron": ..., 备份选项} 或它们的列表"""
+        schedule = project.get('schedule')
+        if not schedule:
+            return []
+        if not isinstance(schedule, list):
+            schedule = [schedule]
+        return [{'cron': entry} if isinstance(entry, str) else entry for entry in schedule]
+
+    async def _watch_config(self):
+        """每 30 秒检查 projects.json 是否被修改"""
+        while True:
+            await asyncio.sleep(30)
+            mtime = PROJECTS_FILE.stat().st_mtime if PROJECTS_FILE.exists() else None
+            if mtime != self.config_mtime:
+                Colors.info("projects.json 已修改，重新加载定时计划")
+                self._load_schedules()
+
+    async def _timer(self, name: str, schedule: CronSchedule, entry: Dict):
+        """按 cron 计划反复触发；每次在触发时间后加 0~jitter 秒随机延迟"""
+        while True:
+            target = schedule.next_after(datetime.datetime.now())
+            target += datetime.timedelta(seconds=random.uniform(0, self.jitter))
+            self.state[name]['next'][entry['cron']] = target.isoformat(timespec='seconds')
+            # 分段等待，系统休眠或改时间后不会错过太久
+            while True:
+                remaining = (target - datetime.datetime.now()).total_seconds()
+                if remaining <= 0:
+                    break
+                await asyncio.sleep(min(remaining, 60))
+            self._start(name, self._backup_options(entry), f"定时 {entry['cron']}")
+
+    @staticmethod
+    def _backup_options(entry: Dict) -> Dict:
+        """schedule 条目中的备份选项"""
+        return {
+            'incremental': entry.get('incremental', False),
+            'files_only': entry.get('filesOnly', False),
+            'db_only': entry.get('dbOnly', False),
+            'prune': entry.get('prune'),
+        }
+
+    def _start(self, name: str, options: Dict, reason: str) -> bool:
+        """启动一次备份；该项目已有备份在排队或执行时跳过"""
+        if name in self.running:
+            self.state[name]['skipped'] += 1
+            Colors.warning(f"{name}: 上一次备份尚未结束，跳过本次触发（{reason}）")
+            return False
+        self.running[name] = asyncio.ensure_future(self._run_backup(name, options, reason))
+        return True
+
+    async def _run_backup(self, name: str, options: Dict, reason: str):
+        project = self.projects[name]
+        state = self.state[name]
+        host_slot = self.host_slots.setdefault(project['host'], asyncio.Semaphore(self.per_host))
+        state['state'] = 'queued'
+        try:
+            # 先占用主机名额再占用全局名额，等待繁忙主机的任务不占用全局名额
+            async with host_slot, self.slots:
+                state['state'] = 'running'
+                state['lastStart'] = datetime.datetime.now().isoformat(timespec='seconds')
+                Colors.info(f"{name}: 开始备份（{reason}）")
+                start = time.monotonic()
+                success = await asyncio.get_running_loop().run_in_executor(
+                    None, self._backup, project, options)
+                state['lastDuration'] = round(time.monotonic() - start, 1)
+                state['lastSuccess'] = success
+                state['lastFinish'] = datetime.datetime.now().isoformat(timespec='seconds')
+                state['runs'] += 1
+                if not success:
+                    state['failures'] += 1
+                log = Colors.success if success else Colors.error
+                log(f"{name}: 备份{'成功' if success else '失败'}，耗时 {state['lastDuration']}s")
+        finally:
+            state['state'] = 'idle'
+            self.running.pop(name, None)
+            self._write_metrics()
+
+    def _write_metrics(self):
+        """更新内存中的指标汇总，并写入指标文件（未设置 metrics_file 时只更新汇总）"""
+        try:
+            if not self.metrics_file:
+                self.exporter.refresh()
+                return
+            self.exporter.write(self.metrics_file, self.state)
+        except OSError as e:
+            Colors.warning(f"写入指标文件失败: {e}")
+
+    async def _handle_http(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """最小的 HTTP/1.0 处理: GET /metrics 返回 Prometheus 文本格式"""
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            while (await reader.readline()).strip():
+                pass
+        except (ConnectionError, asyncio.IncompleteReadError):
+            writer.close()
+            return
+        if len(request_line) >= 2 and request_line[0] == 'GET' and request_line[1].split('?')[0] == '/metrics':
+            status = '200 OK'
+            body = self.exporter.render(self.state).encode('utf-8')
+        else:
+            status, body = '404 Not Found', b'not found\n'
+        writer.write(f'HTTP/1.0 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                     f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode('latin-1') + body)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+    @staticmethod
+    def _backup(project: Dict, options: Dict) -> bool:
+        try:
+            return BackupManager(project).create_backup(**options)
+        except Exception as e:
+            Colors.error(f"{project['name']} 备份异常: {e}")
+            return False
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """处理控制套接字上的一条请求"""
+        try:
+            request = json.loads((await reader.readline()).decode('utf-8') or '{}')
+            if not isinstance(request, dict):
+                raise ValueError('请求必须是 JSON 对象')
+            cmd = request.get('cmd')
+            if cmd == 'status':
+                response = {'ok': True, 'projects': self.state}
+            elif cmd == 'trigger':
+                name = request.get('project')
+                if name not in self.projects:
+                    response = {'ok': False, 'error': f"项目 '{name}' 不在调度中"}
+                elif self._start(name, self._backup_options(request), '手动触发'):
+                    response = {'ok': True}
+                else:
+                    response = {'ok': False, 'error': '上一次备份尚未结束'}
+            else:
+                response = {'ok': False, 'error': f'未知命令: {cmd}'}
+        except ValueError as e:
+            response = {'ok': False, 'error': f'无效请求: {e}'}
+        writer.write(json.dumps(response, ensure_ascii=False).encode('utf-8') + b'\n')
+        await writer.drain()
+        writer.close()
+
+
+def daemon_request(request: Dict, socket_path: Path = DAEMON_SOCKET, timeout: float = 5) -> Optional[Dict]:
+    """向调度进程发送一条请求并返回响应，调度进程未运行时返回 None"""
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(str(socket_path))
+            sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+            data = b''
+            while not data.endswith(b'\n'):
+                piece = sock.recv(65536)
+                if not piece:
+                    break
+                data += piece
+    except OSError:
+        return None
+    return json.loads(data.decode('utf-8')) if data else None
+
 
 class RestoreManager:
     """还原管理器"""
@@ -464,27 +4077,208 @@ class RestoreManager:
         self.project = project
         self.local_path = Path(project['localPath']).expanduser()
         self.backup_base = self.local_path / "backups"
-
-    def list_versions(self) -> List[Dict]:
-        """列出所有备份版本"""
+        self.ssh = create_connection(project)
+        # 加密备份的密钥，第一次读取加密文件时加载
+        self.key: Optional[bytes] = None
+        # 从对象存储流式还原时不下载的压缩包和分片: {本地路径: 对象}
+        self.stored: Dict[Path, StoredObject] = {}
+
+    def list_versions(self, recompute: bool = False) -> List[Dict]:
+        """列出所有备份版本（统计信息来自 catalog.json）"""
         if not self.backup_base.exists():
             return []
 
-        versions = []
-        for backup_dir in sorted(self.backup_base.iterdir(), key=lambda p: p.stat().st_mtime, reverse=True):
-            manifest_file = backup_dir / 'manifest.json'
-            manifest = self._load_manifest(manifest_file)
+        catalog = BackupCatalog(self.local_path)
+        if recompute:
+            entries = self.rebuild_catalog()
+        else:
+            entries = catalog.load()
 
-            size = self._calculate_size(backup_dir)
+        versions = []
+        for backup_dir in self.backup_base.iterdir():
+            if not backup_dir.is_dir():
+                continue
+            entry = entries.get(backup_dir.name)
+            if entry is None:
+                # 旧版本没有索引记录: 使用清单中的统计，不遍历文件
+                manifest = self._load_manifest(backup_dir / 'manifest.json') or {}
+                entry = dict(manifest.get('stats', {}), timestamp=manifest.get('timestamp'))
             versions.append({
                 'name': backup_dir.name,
-                'timestamp': backup_dir.stat().st_mtime,
-                'size': size,
-                'manifest': manifest
+                'timestamp': self._version_time(backup_dir, entry),
+                'size': self._format_size(entry['size']) if 'size' in entry else '未知',
+                'files': entry.get('files'),
+                'uniqueBytes': entry.get('uniqueBytes'),
+                'success': entry.get('success'),
             })
 
+        versions.sort(key=lambda v: v['timestamp'], reverse=True)
         return versions
 
+    def list_storage_versions(self) -> Optional[List[Dict]]:
+        """列出对象存储中的版本（直接读取各版本的 manifest.json，没有清单的版本视为上传未完成）"""
+        storage = create_storage(self.project)
+        if not storage:
+            Colors.error("项目未配置对象存储（storage）")
+            return None
+
+        try:
+            names = storage.list_dirs('backups/')
+            with ThreadPoolExecutor(max_workers=storage.threads) as pool:
+                manifests = list(pool.map(lambda name: storage.read_bytes(f'backups/{name}/manifest.json'), names))
+        except (IOError, OSError) as e:
+            Colors.error(f"读取对象存储失败: {e}")
+            return None
+
+        versions = []
+        for name, data in zip(names, manifests):
+            if data is None:
+                Colors.warning(f"{name}: 没有清单，上传未完成")
+                continue
+            manifest = json.loads(data)
+            stats = manifest.get('stats', {})
+            versions.append({
+                'name': name,
+                'timestamp': self._version_time(Path(name), {'timestamp': manifest.get('timestamp')}),
+                'size': self._format_size(stats['size']) if 'size' in stats else '未知',
+                'files': stats.get('files'),
+                'uniqueBytes': stats.get('uniqueBytes'),
+                'success': manifest.get('success'),
+            })
+
+        versions.sort(key=lambda v: v['timestamp'], reverse=True)
+        return versions
+
+    def _fetch_from_storage(self, storage, version: str, cache: Path, stream: bool = False) -> bool:
+        """把对象存储中的版本下载到 cache（与 localPath 结构相同）
+
+        同时下载增量链上的父版本和去重仓库引用的数据块，之后的还原与本地版本完全相同。
+        stream 为 True 时单个压缩包和分片不下载，登记到 self.stored，还原时按范围读取直接送往远程。
+        """
+        Colors.info(f"从对象存储 {storage.describe()} 下载版本 {version} ...")
+        start = time.monotonic()
+        pending, fetched, chunks = [version], set(), set()
+        total = count = 0
+        try:
+            with ThreadPoolExecutor(max_workers=storage.threads) as pool:
+                def download(objects: Dict[str, int]) -> int:
+                    return sum(pool.map(lambda item: storage.get_file(item[0], cache / item[0], item[1]),
+                                        objects.items()))
+
+                while pending:
+                    name = pending.pop()
+                    fetched.add(name)
+                    objects = storage.list(f'backups/{name}/')
+                    if f'backups/{name}/manifest.json' not in objects:
+                        Colors.error(f"对象存储中没有完整的版本 '{name}'")
+                        return False
+                    if stream and not any(key.endswith(f'/{FILE_INDEX_NAME}') or key.endswith('/chunks.json')
+                                          for key in objects):
+                        for key, size in list(objects.items()):
+                            path = cache / key
+                            if path.parent.name == 'files' and fnmatch.fnmatch(path.name, '*.tar*') and \
+                                    path.name.startswith(('backup_', 'shard-')):
+                                self.stored[path] = StoredObject(storage, key, size, path)
+                                path.parent.mkdir(parents=True, exist_ok=True)
+                                del objects[key]
+                        if self.stored:
+                            Colors.info(f"流式读取 {len(self.stored)} 个压缩包/分片 "
+                                        f"({self._format_size(sum(o.size for o in self.stored.values()))})，不下载")
+                    total += download(objects)
+                    count += len(objects)
+
+                    files_dir = cache / 'backups' / name / 'files'
+                    if (files_dir / FILE_INDEX_NAME).exists():
+                        with gzip.open(files_dir / FILE_INDEX_NAME, 'rt', encoding='utf-8') as f:
+                            parent = json.load(f)['parent']
+                        if parent and parent not in fetched:
+                            pending.append(parent)
+                    if (files_dir / 'chunks.json').exists():
+                        with open(files_dir / 'chunks.json', 'r', encoding='utf-8') as f:
+                            chunks.update(digest for digest, _ in json.load(f)['chunks'])
+
+                if chunks:
+                    store = ChunkStore(cache / 'chunks')
+                    objects = {store.chunk_path(d).relative_to(cache).as_posix(): None for d in sorted(chunks)}
+                    total += download(objects)
+                    count += len(objects)
+        except (IOError, OSError) as e:
+            Colors.error(f"从对象存储下载失败: {e}")
+            return False
+
+        elapsed = time.monotonic() - start
+        Colors.success(f"下载完成: {count} 个对象 ({self._format_size(total)})，"
+                       f"{len(fetched)} 个版本，耗时 {elapsed:.1f}s")
+        return True
+
+    def restore_from_storage(self, version: Optional[str] = None, **options) -> bool:
+        """从对象存储还原（本地备份不存在时，例如备份机损坏）
+
+        完整还原单个压缩包或分片格式的版本时，压缩包按范围读取后直接送往远程，只下载清单、
+        索引和数据库导出；其他情况（增量链、分块仓库、按路径或差异还原）把版本及其依赖下载后
+        按本地版本还原。下载目录位于 storageCacheDir（默认 <localPath>/.storage-cache），结束后删除。
+        """
+        storage = create_storage(self.project)
+        if not storage:
+            Colors.error("项目未配置对象存储（storage）")
+            return False
+        if not version:
+            versions = [v for v in self.list_storage_versions() or [] if v['success']]
+            if not versions:
+                Colors.error("对象存储中没有可用的备份")
+                return False
+            version = versions[0]['name']
+
+        cache_root = Path(self.project.get('storageCacheDir') or self.local_path / '.storage-cache').expanduser()
+        try:
+            cache_root.mkdir(parents=True, exist_ok=True)
+            cache = Path(tempfile.mkdtemp(prefix=f'{version}.', dir=cache_root))
+        except OSError as e:
+            Colors.error(f"无法创建下载目录 {cache_root}: {e}")
+            return False
+        stream = not options.get('paths') and not options.get('delta') and not options.get('dry_run')
+        local_path, backup_base = self.local_path, self.backup_base
+        try:
+            if not self._fetch_from_storage(storage, version, cache, stream):
+                return False
+            self.local_path, self.backup_base = cache, cache / 'backups'
+            return self.restore(version, **options)
+        finally:
+            self.local_path, self.backup_base = local_path, backup_base
+            self.stored.clear()
+            shutil.rmtree(cache, ignore_errors=True)
+
+    def rebuild_catalog(self) -> Dict[str, Dict]:
+        """重新遍历所有版本并重建索引
+
+        删除旧版本后，原本共享的硬链接会变为独占，需要重算才能得到准确的独占字节数。
+        """
+        catalog = BackupCatalog(self.local_path)
+        previous = catalog.load()
+        entries = {}
+        for backup_dir in self.backup_base.iterdir():
+            if not backup_dir.is_dir():
+                continue
+            manifest = self._load_manifest(backup_dir / 'manifest.json') or {}
+            files = manifest.get('files', {})
+            stats = scan_backup_dir(backup_dir)
+            stats['uniqueBytes'] += files.get('newBytes', 0)
+            entry = dict(previous.get(backup_dir.name, {}))
+            entry.update({
+                'timestamp': manifest.get('timestamp', entry.get('timestamp')),
+                'success': manifest.get('success', entry.get('success')),
+                'format': files.get('format', entry.get('format')),
+                'includesDatabase': manifest.get('includesDatabase', entry.get('includesDatabase')),
+                **stats,
+            })
+            entries[backup_dir.name] = entry
+        catalog.save(entries)
+        return entries
+
+    def _version_time(self, backup_dir: Path, entry: Dict) -> float:
+        """版本时间: 优先使用索引中的时间，其次是目录名（YYYY-mm-dd_HHMMSS）"""
+        return version_time(backup_dir, entry.get('timestamp'))
+
     def _load_manifest(self, manifest_file: Path) -> Optional[Dict]:
         """加载清单文件"""
         if not manifest_file.exists():
@@ -496,18 +4290,6 @@ class RestoreManager:
         except:
             return None
 
-    def _calculate_size(self, path: Path) -> str:
-        """计算目录大小"""
-        total = 0
-        try:
-            for item in path.rglob('*'):
-                if item.is_file():
-                    total += item.stat().st_size
-        except:
-            pass
-
-        return self._format_size(total)
-
     def _format_size(self, size: int) -> str:
         """格式化大小"""
         for unit in ['B', 'KB', 'MB', 'GB']:
@@ -517,22 +4299,50 @@ class RestoreManager:
         return f"{size:.1f}TB"
 
     def restore(self, version: str = None, files_only: bool = False,
-                db_only: bool = False, dry_run: bool = False) -> bool:
-        """还原备份"""
+                db_only: bool = False, dry_run: bool = False, paths: List[str] = None,
+                delta: bool = False) -> bool:
+        """还原备份
+
+        paths 不为空时只把匹配的文件/目录写回 remotePath（原地覆盖），不还原数据库。
+        delta 为 True 时先比较备份与远程现状，只发送变化的文件并删除多余文件
+        （与 paths 同时使用时只比较匹配的部分）。
+        """
         # 确定备份版本
-        if version:
-            backup_path = self.backup_base / version
-            if not backup_path.exists():
-                Colors.error(f"备份版本 '{version}' 不存在")
-                return False
-        else:
-            backup_path = self._get_latest_backup()
-            if not backup_path:
-                Colors.error("没有可用的备份")
-                return False
+        backup_path = self._resolve_version(version)
+        if not backup_path:
+            return False
 
         Colors.header(f"还原 {self.project['name']} - 版本 {backup_path.name}")
 
+        if delta:
+            patterns = self._normalize_patterns(paths) if paths else None
+            with self.ssh:
+                if not db_only and (backup_path / "files").exists():
+                    if not self._restore_delta(backup_path / "files", patterns, dry_run):
+                        return False
+                if not files_only and not paths and self.project.get('databases'):
+                    if dry_run:
+                        Colors.info(f"[模拟] 还原数据库")
+                    elif (backup_path / "databases").exists():
+                        if not self._restore_databases(backup_path / "databases"):
+                            return False
+            if not dry_run:
+                Colors.info(self.ssh.summary())
+                Colors.success("还原完成")
+            return True
+
+        if paths:
+            patterns = self._normalize_patterns(paths)
+            if dry_run:
+                Colors.info(f"[模拟] 将还原匹配 {', '.join(patterns)} 的文件到 {self.project['remotePath']}")
+                return True
+            with self.ssh:
+                if not self._restore_paths(backup_path / "files", patterns):
+                    return False
+            Colors.info(self.ssh.summary())
+            Colors.success("还原完成")
+            return True
+
         if dry_run:
             Colors.info(f"[模拟] 将还原: {backup_path.name}")
             if not db_only:
@@ -541,36 +4351,627 @@ class RestoreManager:
                 Colors.info(f"[模拟] 还原数据库")
             return True
 
-        # 还原文件
-        if not db_only:
-            files_dir = backup_path / "files"
-            if files_dir.exists():
-                if not self._restore_files(files_dir):
-                    return False
+        with self.ssh:
+            # 还原文件
+            if not db_only:
+                files_dir = backup_path / "files"
+                if files_dir.exists():
+                    if not self._restore_files(files_dir):
+                        return False
 
-        # 还原数据库
-        if not files_only and self.project.get('databases'):
-            db_dir = backup_path / "databases"
-            if db_dir.exists():
-                if not self._restore_databases(db_dir):
-                    return False
+            # 还原数据库
+            if not files_only and self.project.get('databases'):
+                db_dir = backup_path / "databases"
+                if db_dir.exists():
+                    if not self._restore_databases(db_dir):
+                        return False
 
+        Colors.info(self.ssh.summary())
         Colors.success("还原完成")
         return True
 
+    def _resolve_version(self, version: Optional[str]) -> Optional[Path]:
+        """指定版本或最新版本的目录，不存在时输出错误并返回 None"""
+        if version:
+            backup_path = self.backup_base / version
+            if not backup_path.exists():
+                Colors.error(f"备份版本 '{version}' 不存在")
+                return None
+            return backup_path
+        backup_path = self._get_latest_backup()
+        if not backup_path:
+            Colors.error("没有可用的备份")
+        return backup_path
+
+    def _normalize_patterns(self, paths: List[str]) -> List[str]:
+        """把 --path 参数转换为相对 remotePath 的模式（也接受 remotePath 下的绝对路径）"""
+        remote = self.project['remotePath'].rstrip('/') + '/'
+        patterns = []
+        for path in paths:
+            if path.startswith(remote):
+                path = path[len(remote):]
+            elif path.startswith('./'):
+                path = path[2:]
+            patterns.append(path.strip('/'))
+        return patterns
+
+    def _restore_paths(self, files_dir: Path, patterns: List[str]) -> bool:
+        """只还原匹配的文件：在本地选出成员组成 tar 流，远程在 remotePath 上级目录原地解压"""
+        Colors.info(f"还原匹配的路径: {', '.join(patterns)}")
+        archive = IndexedArchive.open(files_dir, self._open_stored)
+        if archive is None:
+            Colors.warning("该版本没有成员索引，需要在本地读取整个备份进行筛选")
+        elif not archive.select(patterns, self._version_root(files_dir)):
+            Colors.warning("没有匹配的文件")
+            return True
+
+        selected = []
+
+        def feed(out):
+            selected.append(self.write_selected(files_dir, patterns, out))
+
+        parent = os.path.dirname(self.project['remotePath'].rstrip('/')) or '.'
+        if not self._extract_into(parent, feed, cleanup=False):
+            return False
+        if not selected or not selected[0]:
+            Colors.warning("没有匹配的文件")
+            return True
+        Colors.success(f"已还原 {selected[0]} 个成员")
+        return True
+
+    def _restore_delta(self, files_dir: Path, patterns: Optional[List[str]] = None,
+                       dry_run: bool = False) -> bool:
+        """差异还原：比较版本的文件清单与远程现状，只发送变化的文件并删除多余文件
+
+        先比较大小和 mtime；大小相同而 mtime 不同时再比较 SHA-256（备份侧取自索引，
+        远程侧用 sha256sum 计算），内容相同的文件不再发送。变化的文件在 remotePath
+        上原地解压，不再整体替换目录；解压成功后才删除多余的文件和（已为空的）目录，
+        解压失败时远程只可能多出已更新的文件。
+        """
+        remote_path = self.project['remotePath']
+        if self.ssh.run(f'test -d {shlex.quote(remote_path)}').returncode != 0:
+            Colors.warning("远程目录不存在，改为完整还原")
+            if dry_run:
+                return True
+            return self._restore_files(files_dir)
+
+        Colors.info("比较备份与远程文件...")
+        backup_dirs = set()
+        listing = self._backup_listing(files_dir, backup_dirs)
+        if listing is None:
+            return False
+        manifest = self._load_manifest(files_dir.parent / 'manifest.json') or {}
+        exclude = manifest.get('files', {}).get('exclude', self.project.get('exclude', []))
+        current = self.ssh.list_files(remote_path, exclude)
+        remote_dirs = self.ssh.list_dirs(remote_path, exclude) if current is not None else None
+        if current is None or remote_dirs is None:
+            return False
+
+        hash_local = None
+        if self._is_tree(files_dir):
+            # rsync 目录树没有记录哈希，在本地计算
+            def hash_local(rel: str) -> Optional[str]:
+                return None if (files_dir / rel).is_symlink() else file_sha256(files_dir / rel)
+        plan = self._plan_delta(listing, backup_dirs, current, remote_dirs, exclude, patterns,
+                                lambda paths: self.ssh.hash_files(remote_path, paths), hash_local)
+        if plan is None:
+            return False
+
+        changed = plan['changed']
+        deletes = plan['early'] + plan['extra']
+        delete_dirs = plan['blockingDirs'] + plan['extraDirs']
+        send_bytes = sum(listing[rel][0] or 0 for rel in changed)
+        Colors.info(f"差异: 更新 {len(changed)} 个文件（{self._format_size(send_bytes)}），"
+                    f"删除 {len(deletes)} 个文件和 {len(delete_dirs)} 个目录，未变化 {plan['unchanged']} 个"
+                    f"（其中 {plan['hashed']} 个经哈希比较）")
+        if dry_run:
+            for rel in changed[:20]:
+                Colors.info(f"[模拟] 更新 {rel}")
+            for rel in (deletes + delete_dirs)[:20]:
+                Colors.info(f"[模拟] 删除 {rel}")
+            if len(changed) > 20 or len(deletes) + len(delete_dirs) > 20:
+                Colors.info("[模拟] ...")
+            return True
+
+        # 挡住解压的路径先删除，其余多余的文件和目录在解压成功后再删除
+        if plan['early'] and not self._delete_in(remote_path, plan['early']):
+            return False
+        if plan['blockingDirs'] and not self._rmdir_in(remote_path, plan['blockingDirs']):
+            return False
+
+        if changed:
+            names = set(changed)
+            parent = os.path.dirname(remote_path.rstrip('/')) or '.'
+            if not self._extract_into(parent, lambda out: self.write_selected(files_dir, [], out, names),
+                                      cleanup=False):
+                return False
+
+        if plan['extra'] and not self._delete_in(remote_path, plan['extra']):
+            return False
+        if plan['touched'] and not self._touch_in(remote_path, plan['touched']):
+            return False
+        if plan['extraDirs'] and not self._rmdir_in(remote_path, plan['extraDirs']):
+            return False
+        # 备份中有而远程没有的（空）目录
+        if plan['missingDirs'] and not self._mkdir_in(remote_path, plan['missingDirs']):
+            return False
+
+        Colors.success("差异还原完成")
+        return True
+
+    @staticmethod
+    def _plan_delta(listing: Dict[str, List], backup_dirs: set, current: Dict[str, List], remote_dirs: set,
+                    exclude: List[str], patterns: Optional[List[str]], hash_remote,
+                    hash_local=None) -> Optional[Dict]:
+        """计算差异还原的计划（不访问远程）
+
+        listing/current 为备份与远程的文件清单 {相对路径: [大小, mtime, 哈希]}，backup_dirs/remote_dirs
+        为目录集合；被排除的远程路径不会被删除。hash_remote(paths) 返回远程文件的 {相对路径: SHA-256}
+        （失败时为 None，此时返回 None）；hash_local(rel) 在备份侧哈希未知时计算（可为 None）。
+        返回 changed（需要发送）、touched（只需改回 mtime: {相对路径: mtime}）、early/blockingDirs
+        （挡住解压、需先删除的文件和目录）、extra/extraDirs（解压后删除，目录深层在前）、
+        missingDirs（需要创建的目录）、unchanged 和 hashed（经哈希比较的文件数）。
+        """
+        current = {rel: entry for rel, entry in current.items() if not is_excluded(rel, exclude)}
+        remote_dirs = {rel for rel in remote_dirs if not is_excluded(rel, exclude)}
+        if patterns:
+            listing = {rel: entry for rel, entry in listing.items() if match_path(rel, patterns)}
+            current = {rel: entry for rel, entry in current.items() if match_path(rel, patterns)}
+            remote_dirs = {rel for rel in remote_dirs if match_path(rel, patterns)}
+        # 备份中的目录: 显式记录的目录和所有文件的上级目录
+        backup_dirs = set(backup_dirs)
+        for rel in listing:
+            parent = os.path.dirname(rel)
+            while parent and parent not in backup_dirs:
+                backup_dirs.add(parent)
+                parent = os.path.dirname(parent)
+
+        # 大小不同或远程缺失的文件直接发送；链接（大小为 None）只比较 mtime
+        changed, unclear = [], []
+        for rel, (size, mtime, _) in listing.items():
+            entry = current.get(rel)
+            if entry is None or (size is not None and size != entry[0]):
+                changed.append(rel)
+            elif mtime is None or mtime != entry[1]:
+                (unclear if size is not None else changed).append(rel)
+
+        # 大小相同而 mtime 不同：比较内容哈希，备份侧哈希未知的直接发送
+        digests = {rel: listing[rel][2] or (hash_local(rel) if hash_local else None) for rel in unclear}
+        known = [rel for rel in unclear if digests[rel]]
+        changed.extend(rel for rel in unclear if not digests[rel])
+        if known:
+            hashes = hash_remote(known)
+            if hashes is None:
+                return None
+            changed.extend(rel for rel in known if hashes.get(rel) != digests[rel])
+        changed.sort()
+        changed_set = set(changed)
+        touched = {rel: listing[rel][1] for rel in known if rel not in changed_set and listing[rel][1] is not None}
+
+        extra = sorted(rel for rel in current if rel not in listing)
+        # 深层目录在前，删除时先删子目录
+        extra_dirs = sorted((rel for rel in remote_dirs if rel not in backup_dirs), reverse=True)
+        missing_dirs = sorted(rel for rel in backup_dirs if rel not in remote_dirs
+                              and (not patterns or match_path(rel, patterns)))
+
+        # 挡住解压的路径: 备份中是目录而远程是文件，或备份中是文件而远程是目录（连同其中的内容）
+        blocking = tuple(f'{rel}/' for rel in extra_dirs if rel in listing)
+        blocking_dirs = [rel for rel in extra_dirs if blocking and (rel in listing or rel.startswith(blocking))]
+        early = [rel for rel in extra if rel in backup_dirs or (blocking and rel.startswith(blocking))]
+        early_set, blocking_set = set(early), set(blocking_dirs)
+        return {
+            'changed': changed,
+            'touched': touched,
+            'early': early,
+            'blockingDirs': blocking_dirs,
+            'extra': [rel for rel in extra if rel not in early_set],
+            'extraDirs': [rel for rel in extra_dirs if rel not in blocking_set],
+            'missingDirs': missing_dirs,
+            'unchanged': len(listing) - len(changed),
+            'hashed': len(known),
+        }
+
+    def _backup_listing(self, files_dir: Path, dirs: Optional[set] = None) -> Optional[Dict[str, List]]:
+        """版本中的文件和链接清单: {相对路径: [大小, mtime, 哈希]}
+
+        有成员索引或文件索引时直接读取；其他格式在本地顺序读取一遍 tar 流并计算哈希，
+        rsync 目录树只读取 stat（哈希在需要时再算）。符号链接的大小为目标路径长度
+        （与远程 stat 一致），硬链接和没有目标路径的链接大小记为 None，未知的哈希为 None。
+        dirs 不为 None 时同时收集版本中的目录（包括空目录）。
+        """
+        if dirs is None:
+            dirs = set()
+        root = self._version_root(files_dir)
+        prefix = f'{root}/'
+        archive = IndexedArchive.open(files_dir, self._open_stored)
+        if archive:
+            listing = {}
+            for name, kind, _, _, size, *extra in archive.index['members']:
+                if name.startswith(prefix) and kind == '5':
+                    dirs.add(name[len(prefix):])
+                if name.startswith(prefix) and kind in ('0', '\x00', '7', '1', '2'):
+                    regular = kind in ('0', '\x00', '7')
+                    listing[name[len(prefix):]] = [size if regular else None,
+                                                  extra[1] if len(extra) > 1 else None,
+                                                  extra[0] if extra else None]
+            return listing
+
+        if (files_dir / FILE_INDEX_NAME).exists():
+            chain = self._load_chain(files_dir)
+            if chain is None:
+                return None
+            dirs.update(chain[-1][1].get('dirs', []))
+            return {rel: list(entry) for rel, entry in chain[-1][1]['files'].items()}
+
+        if self._is_tree(files_dir):
+            listing = {}
+            for path in files_dir.rglob('*'):
+                if path.is_dir() and not path.is_symlink():
+                    dirs.add(path.relative_to(files_dir).as_posix())
+                elif path.is_symlink() or path.is_file():
+                    st = path.lstat()
+                    listing[path.relative_to(files_dir).as_posix()] = [st.st_size, int(st.st_mtime), None]
+            return listing
+
+        listing = {}
+        source = self._piped(lambda out: self.write_selected(files_dir, ['*'], out))
+        with tarfile.open(fileobj=source, mode='r|') as tar:
+            for member in tar:
+                name = member.name.rstrip('/')
+                if not name.startswith(prefix):
+                    continue
+                if member.isdir():
+                    dirs.add(name[len(prefix):])
+                elif member.isreg():
+                    writer = HashingWriter()
+                    copy_stream(tar.extractfile(member), writer)
+                    listing[name[len(prefix):]] = [member.size, int(member.mtime), writer.hexdigest()]
+                elif member.issym():
+                    listing[name[len(prefix):]] = [len(member.linkname.encode('utf-8', 'surrogateescape')),
+                                                   int(member.mtime), None]
+                elif member.islnk():
+                    listing[name[len(prefix):]] = [None, int(member.mtime), None]
+        return listing
+
+    def _is_tree(self, files_dir: Path) -> bool:
+        """版本文件是 rsync 目录树（没有分块索引、文件索引、分片或压缩包）"""
+        if (files_dir / 'chunks.json').exists() or (files_dir / FILE_INDEX_NAME).exists():
+            return False
+        return not any(files_dir.glob('shard-*.tar*')) and not any(files_dir.glob('backup_*.tar*'))
+
+    def write_selected(self, files_dir: Path, patterns: List[str], out,
+                       names: Optional[set] = None) -> int:
+        """把版本中匹配模式的文件写成 tar 流，返回成员数
+
+        有成员索引时只解压目标所在的块；其他格式在本地按顺序读取并筛选。
+        names 不为 None 时按相对路径精确选择，忽略 patterns。
+        """
+        root = self._version_root(files_dir)
+        archive = IndexedArchive.open(files_dir, self._open_stored)
+        if archive:
+            members = archive.select(patterns, root, names)
+            archive.write_members(members, out)
+            return len(members)
+
+        def keep(name: str, final: Optional[Dict] = None, is_dir: bool = False) -> bool:
+            if not name.startswith(f'{root}/'):
+                return False
+            rel = name[len(root) + 1:]
+            if names is not None:
+                return rel in names
+            if final is not None and not is_dir and rel not in final:
+                return False
+            return match_path(rel, patterns)
+
+        count = 0
+        with tarfile.open(fileobj=out, mode='w|', format=tarfile.PAX_FORMAT) as tar_out:
+            if (files_dir / 'chunks.json').exists():
+                with open(files_dir / 'chunks.json', 'r', encoding='utf-8') as f:
+                    index = json.load(f)
+                store = self._chunk_store('encryption' in index)
+                source = self._piped(lambda w: store.write_to(index['chunks'], w))
+                count += self._filter_tar(source, tar_out, lambda name, is_dir: keep(name))
+            elif (files_dir / FILE_INDEX_NAME).exists():
+                chain = self._load_chain(files_dir)
+                if chain is None:
+                    raise IOError("增量链不完整")
+                final = chain[-1][1]['files']
+                for level_dir, index in chain:
+                    if index['archive']:
+                        with self._open_archive(level_dir / index['archive']) as source:
+                            count += self._filter_tar(source, tar_out,
+                                                      lambda name, is_dir: keep(name, final, is_dir))
+            elif sorted(files_dir.glob('shard-*.tar*')):
+                for shard in sorted(files_dir.glob('shard-*.tar*')):
+                    with self._open_archive(shard) as source:
+                        count += self._filter_tar(source, tar_out, lambda name, is_dir: keep(name))
+            elif sorted(files_dir.glob('backup_*.tar*')):
+                with self._open_archive(sorted(files_dir.glob('backup_*.tar*'))[0]) as source:
+                    count += self._filter_tar(source, tar_out, lambda name, is_dir: keep(name))
+            else:
+                # rsync 目录树
+                for path in sorted(files_dir.rglob('*')):
+                    rel = path.relative_to(files_dir).as_posix()
+                    if rel in names if names is not None else match_path(rel, patterns):
+                        tar_out.add(path, arcname=f'{root}/{rel}', recursive=False)
+                        count += 1
+        return count
+
+    def _filter_tar(self, source, tar_out: tarfile.TarFile, keep) -> int:
+        """顺序读取 tar 流，把 keep(name, is_dir) 为真的成员写入 tar_out"""
+        count = 0
+        with tarfile.open(fileobj=source, mode='r|') as tar_in:
+            for member in tar_in:
+                if keep(member.name.rstrip('/'), member.isdir()):
+                    tar_out.addfile(member, tar_in.extractfile(member) if member.isreg() else None)
+                    count += 1
+        return count
+
+    def _open_archive(self, path: Path):
+        """以流的方式打开本地压缩包（解压后的 tar 数据）"""
+        compression = detect_compression(path)
+        if compression == 'none':
+            return self._open_stored(path)
+        if is_encrypted(path):
+            # 先打开一次，密钥缺失或不匹配时在调用方抛出 IOError；解密和解压在后台线程中进行
+            self._open_stored(path).close()
+            return self._piped(lambda out: self._feed_decompressed(path, out))
+        if compression == 'gzip':
+            return gzip.open(path, 'rb')
+        proc = subprocess.Popen(COMPRESSORS[compression]['decompress'].split() + [str(path)],
+                                stdout=subprocess.PIPE)
+        return proc.stdout
+
+    def _open_stored(self, path: Path):
+        """打开版本内的文件用于读取，加密文件返回边读边解密的 DecryptingReader"""
+        if not is_encrypted(path):
+            return path.open() if isinstance(path, StoredObject) else open(path, 'rb')
+        return DecryptingReader(path, self._require_key())
+
+    def _require_key(self) -> bytes:
+        """读取解密密钥（缓存），缺少 cryptography 或密钥时抛出 IOError"""
+        if self.key is None:
+            if AESGCM is None:
+                raise IOError("备份已加密，需要安装 cryptography: pip install cryptography")
+            self.key = load_encryption_key(self.project)
+        return self.key
+
+    def _chunk_store(self, encrypted: bool = False) -> ChunkStore:
+        """打开分块仓库，版本的数据块加密时先读取密钥"""
+        if encrypted:
+            self._require_key()
+        return ChunkStore(self.local_path / "chunks", self.key)
+
+    def _stored_stdin(self, path: Path):
+        """可作为子进程 stdin 的版本文件，加密文件（和对象存储中的对象）在后台线程中读取后经管道提供"""
+        if isinstance(path, StoredObject) or is_encrypted(path):
+            return self._piped(lambda out: self._feed_file(path, out))
+        return open(path, 'rb')
+
+    def _piped(self, feed):
+        """在后台线程中运行 feed(out)，返回可读取其输出的管道
+
+        读取端提前关闭（BrokenPipeError）时静默结束；其他错误（如解密失败）输出后关闭管道，
+        读取端看到的是不完整的数据流。
+        """
+        read_fd, write_fd = os.pipe()
+        reader, writer = os.fdopen(read_fd, 'rb'), os.fdopen(write_fd, 'wb')
+
+        def run():
+            try:
+                feed(writer)
+            except BrokenPipeError:
+                pass
+            except OSError as e:
+                Colors.error(f"读取备份数据失败: {e}")
+            finally:
+                try:
+                    writer.close()
+                except BrokenPipeError:
+                    pass
+
+        threading.Thread(target=run, daemon=True).start()
+        return reader
+
+    def _version_root(self, files_dir: Path) -> str:
+        """压缩包内的顶层目录名（清单中的 files.root，默认 remotePath 的目录名）"""
+        manifest = self._load_manifest(files_dir.parent / 'manifest.json') or {}
+        return manifest.get('files', {}).get('root') or os.path.basename(self.project['remotePath'].rstrip('/'))
+
+    def extract_local(self, version: Optional[str], paths: List[str], output: Path) -> bool:
+        """把匹配的文件解压到本地目录（路径相对 remotePath，不含顶层目录）"""
+        backup_path = self._resolve_version(version)
+        if not backup_path:
+            return False
+        patterns = self._normalize_patterns(paths)
+        files_dir = backup_path / "files"
+        root = self._version_root(files_dir)
+        extract_options = {'filter': 'data'} if hasattr(tarfile, 'data_filter') else {}
+
+        try:
+            with tempfile.TemporaryFile() as selected:
+                if not self.write_selected(files_dir, patterns, selected):
+                    Colors.error("没有匹配的文件")
+                    return False
+                selected.seek(0)
+                output.mkdir(parents=True, exist_ok=True)
+                count = 0
+                with tarfile.open(fileobj=selected, mode='r:') as tar:
+                    for member in tar:
+                        member.name = member.name[len(root) + 1:]
+                        if member.islnk():
+                            member.linkname = member.linkname[len(root) + 1:]
+                        if not member.name:
+                            continue
+                        tar.extract(member, output, **extract_options)
+                        count += 1
+        except (IOError, OSError, tarfile.TarError) as e:
+            Colors.error(f"读取备份失败: {e}")
+            return False
+
+        Colors.success(f"已解压 {count} 个成员到 {output}")
+        return True
+
+    def cat_file(self, version: Optional[str], path: str, out) -> bool:
+        """把备份中的单个文件内容写入 out"""
+        backup_path = self._resolve_version(version)
+        if not backup_path:
+            return False
+        rel = self._normalize_patterns([path])[0]
+        files_dir = backup_path / "files"
+        root = self._version_root(files_dir)
+        name = f'{root}/{rel}'
+
+        try:
+            archive = IndexedArchive.open(files_dir, self._open_stored)
+            if archive:
+                for member_name, kind, _, data_offset, size, *extra in archive.index['members']:
+                    if member_name == name and kind in ('0', '\x00', '7'):
+                        writer = HashingWriter(out)
+                        archive.read(data_offset, data_offset + size, writer)
+                        if extra and extra[0] and writer.hexdigest() != extra[0]:
+                            Colors.error(f"文件校验失败: {rel}")
+                            return False
+                        return True
+                Colors.error(f"备份中没有文件: {rel}")
+                return False
+
+            with tempfile.TemporaryFile() as selected:
+                self.write_selected(files_dir, [glob_escape(rel)], selected)
+                selected.seek(0)
+                with tarfile.open(fileobj=selected, mode='r:') as tar:
+                    for member in tar:
+                        if member.name.rstrip('/') == name and member.isreg():
+                            copy_stream(tar.extractfile(member), out)
+                            return True
+        except (IOError, OSError, tarfile.TarError) as e:
+            Colors.error(f"读取备份失败: {e}")
+            return False
+        Colors.error(f"备份中没有文件: {rel}")
+        return False
+
+    def verify(self, version: Optional[str] = None, all_versions: bool = False,
+               workers: int = 0) -> bool:
+        """按清单中的 SHA-256 校验备份文件，分块仓库版本校验所引用的数据块
+
+        所有版本的文件和数据块一起放入线程池并行校验（mmap 读取，hashlib 释放 GIL）。
+        加密文件边解密边计算明文的哈希，同时校验每块的认证标签（需要密钥）。
+        """
+        if all_versions:
+            paths = sorted(p for p in self.backup_base.iterdir() if p.is_dir()) if self.backup_base.exists() else []
+        else:
+            backup_path = self._resolve_version(version)
+            paths = [backup_path] if backup_path else []
+        if not paths:
+            Colors.warning("没有可校验的版本")
+            return False
+
+        tasks = []
+        chunks: Dict[str, int] = {}
+        encrypted_chunks = False
+        unchecked = []
+        for backup_path in paths:
+            manifest = self._load_manifest(backup_path / 'manifest.json') or {}
+            checksums = manifest.get('checksums', {}).get('files', {})
+            for rel, expected in checksums.items():
+                tasks.append((backup_path.name, rel, backup_path / rel, expected))
+            index_file = backup_path / "files" / 'chunks.json'
+            if index_file.exists():
+                with open(index_file, 'r', encoding='utf-8') as f:
+                    index = json.load(f)
+                chunks.update((digest, size) for digest, size in index['chunks'])
+                encrypted_chunks = encrypted_chunks or 'encryption' in index
+            elif not checksums:
+                unchecked.append(backup_path.name)
+
+        try:
+            store = self._chunk_store(encrypted_chunks)
+        except IOError as e:
+            Colors.warning(f"{e}，加密的数据块无法校验")
+            store = ChunkStore(self.local_path / "chunks")
+
+        def check_file(task) -> Tuple[Optional[str], int]:
+            name, rel, path, expected = task
+            if not path.exists():
+                return f"{name}/{rel}: 文件缺失", 0
+            try:
+                digest = self._stored_sha256(path)
+            except (IOError, OSError) as e:
+                return f"{name}: {e}", path.stat().st_size
+            if digest != expected:
+                return f"{name}/{rel}: 校验和不一致", path.stat().st_size
+            return None, path.stat().st_size
+
+        def check_chunk(item) -> Tuple[Optional[str], int]:
+            digest, size = item
+            try:
+                store.read(digest, size)
+            except (OSError, zlib.error) as e:
+                return f"数据块 {digest[:12]}: {e}", size
+            return None, size
+
+        Colors.info(f"校验 {len(paths)} 个版本: {len(tasks)} 个文件，{len(chunks)} 个数据块")
+        start = time.monotonic()
+        errors = []
+        total = 0
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+            results = list(pool.map(check_file, tasks)) + list(pool.map(check_chunk, chunks.items()))
+        for error, size in results:
+            total += size
+            if error:
+                errors.append(error)
+        elapsed = max(time.monotonic() - start, 1e-3)
+
+        for name in unchecked:
+            Colors.warning(f"{name}: 清单中没有校验和（旧版本或 rsync 目录树），跳过")
+        for error in errors:
+            Colors.error(error)
+        rate = total / elapsed / 1024 / 1024
+        if errors:
+            Colors.error(f"校验失败: {len(errors)} 个错误（{self._format_size(total)}，{rate:.1f}MB/s）")
+            return False
+        Colors.success(f"校验通过: {self._format_size(total)}，耗时 {elapsed:.1f}s（{rate:.1f}MB/s）")
+        return True
+
+    def _stored_sha256(self, path: Path) -> str:
+        """版本文件内容的 SHA-256（加密文件为解密后的明文）"""
+        if not is_encrypted(path):
+            return file_sha256(path)
+        writer = HashingWriter()
+        with self._open_stored(path) as f:
+            copy_stream(f, writer)
+        return writer.hexdigest()
+
     def _get_latest_backup(self) -> Optional[Path]:
-        """获取最新的备份"""
-        backups = list(self.backup_base.iterdir())
-        if not backups:
-            return None
-        return max(backups, key=lambda p: p.stat().st_mtime)
+        """获取最新的成功版本（按清单时间，与 PruneManager 一致）
+
+        没有清单（备份未完成）或清单记为失败的版本被跳过，不会被当作最新版本还原。
+        """
+        for backup_dir, manifest in versions_by_time(self.backup_base):
+            if manifest and manifest.get('success'):
+                return backup_dir
+            Colors.warning(f"跳过版本 {backup_dir.name}: 没有清单或备份未成功")
+        return None
 
     def _restore_files(self, files_dir: Path) -> bool:
         """还原文件"""
         Colors.info("还原文件系统...")
 
-        # 检查是否有压缩包
-        archives = list(files_dir.glob('backup_*.tar.gz'))
+        # 分块去重仓库
+        if (files_dir / 'chunks.json').exists():
+            return self._restore_from_chunks(files_dir / 'chunks.json')
+
+        # 基于文件索引的增量链
+        if (files_dir / FILE_INDEX_NAME).exists():
+            return self._restore_incremental(files_dir)
+
+        # 分片压缩包
+        shards = self._version_files(files_dir, 'shard-*.tar*')
+        if shards:
+            return self._restore_from_shards(files_dir, shards)
+
+        # 检查是否有压缩包（.tar / .tar.gz / .tar.zst / .tar.lz4）
+        archives = self._version_files(files_dir, 'backup_*.tar*')
         if archives:
             # 使用压缩包还原
             return self._restore_from_archive(archives[0])
@@ -579,13 +4980,13 @@ class RestoreManager:
         if self._is_command_available('rsync'):
             cmd = [
                 'rsync', '-avz',
-                f'-e "ssh -p {self.project["port"]}"',
+                '-e', self.ssh.rsync_shell(),
                 f'{files_dir}/',
-                f'{self.project["user"]}@{self.project["host"]}:{self.project["remotePath"]}/'
+                f'{self.ssh.target}:{self.project["remotePath"]}/'
             ]
 
             try:
-                result = subprocess.run(' '.join(cmd), shell=True, capture_output=True, text=True)
+                result = subprocess.run(cmd, capture_output=True, text=True)
                 if result.returncode == 0:
                     Colors.success("文件还原完成")
                     return True
@@ -603,71 +5004,271 @@ class RestoreManager:
         """检查命令是否可用"""
         return shutil.which(cmd) is not None
 
-    def _restore_from_archive(self, archive_path: Path) -> bool:
-        """从压缩包还原"""
-        Colors.info(f"使用压缩包还原: {archive_path.name}")
+    def _version_files(self, files_dir: Path, pattern: str) -> List:
+        """版本目录中匹配 pattern 的文件，包括从对象存储流式读取的对象（StoredObject）"""
+        files = list(files_dir.glob(pattern))
+        files += [obj for path, obj in self.stored.items()
+                  if path.parent == files_dir and fnmatch.fnmatch(path.name, pattern)]
+        return sorted(files, key=lambda f: f.name)
 
-        remote_target = f'/tmp/{archive_path.name}'
+    def _restore_from_chunks(self, index_file: Path) -> bool:
+        """从分块仓库还原：按块引用重建 tar 流并直接送入远程解压"""
+        with open(index_file, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+
+        try:
+            store = self._chunk_store('encryption' in index)
+        except IOError as e:
+            Colors.error(str(e))
+            return False
+        missing = [d for d, _ in index['chunks'] if not store.chunk_path(d).exists()]
+        if missing:
+            Colors.error(f"分块仓库缺少 {len(missing)} 个数据块，无法还原")
+            return False
 
-        # 上传压缩包
-        if not self._upload_archive(archive_path, remote_target):
+        Colors.info(f"从分块仓库还原: {len(index['chunks'])} 块 ({self._format_size(index['size'])})")
+        if not self._stream_extract(lambda out: store.write_to(index['chunks'], out), index['root']):
             return False
 
-        # 在远程解压
-        if not self._extract_remote_archive(remote_target):
+        Colors.success("文件还原完成")
+        return True
+
+    def _load_chain(self, files_dir: Path) -> Optional[List[Tuple[Path, Dict]]]:
+        """从指定版本沿 parent 回溯，返回从完整基线开始的 (目录, 索引) 列表"""
+        chain = []
+        level_dir = files_dir
+        while level_dir:
+            index_file = level_dir / FILE_INDEX_NAME
+            if not index_file.exists():
+                Colors.error(f"增量链不完整，缺少版本: {level_dir.parent.name}")
+                return None
+            with gzip.open(index_file, 'rt', encoding='utf-8') as f:
+                index = json.load(f)
+            chain.insert(0, (level_dir, index))
+            level_dir = self.backup_base / index['parent'] / "files" if index['parent'] else None
+        return chain
+
+    def _restore_incremental(self, files_dir: Path) -> bool:
+        """还原增量链：从完整基线开始依次应用各级的删除列表并解压变化文件
+
+        每一级先删除该级已不存在的文件和目录（索引记录了 dirs 时），再解压，
+        文件与目录互相替换的路径不会与解压冲突；最后按最终版本的 dirs 补上空目录。
+        """
+        chain = self._load_chain(files_dir)
+        if chain is None:
             return False
 
-        # 清理远程临时文件
-        Colors.info("清理远程临时文件...")
-        cleanup_cmd = f'ssh -p {self.project["port"]} {self.project["user"]}@{self.project["host"]} "rm -f {remote_target}"'
-        subprocess.run(cleanup_cmd, shell=True, capture_output=True)
+        Colors.info(f"还原增量链: {' -> '.join(d.parent.name for d, _ in chain)}")
+        root = self._version_root(files_dir)
+        staging, stamp = self._new_staging()
+
+        previous_dirs = None
+        for level_dir, index in chain:
+            if index['deleted']:
+                if not self._delete_in(f'{staging}/{root}', index['deleted']):
+                    return False
+            dirs = index.get('dirs')
+            if previous_dirs is not None and dirs is not None:
+                removed = sorted(set(previous_dirs) - set(dirs), key=lambda d: d.count('/'), reverse=True)
+                if removed and not self._rmdir_in(f'{staging}/{root}', removed):
+                    return False
+            previous_dirs = dirs
+            if index['archive']:
+                if not self._extract_archive_into(staging, level_dir / index['archive']):
+                    return False
+
+        if previous_dirs and not self._mkdir_in(f'{staging}/{root}', previous_dirs):
+            return False
+        if not self._swap_in(staging, root, stamp):
+            return False
 
         Colors.success("文件还原完成")
         return True
 
-    def _upload_archive(self, local_archive: Path, remote_archive: str) -> bool:
-        """上传压缩包到远程"""
-        Colors.info("上传压缩包...")
+    def _feed_file(self, path: Path, out):
+        """把本地文件按块写入 out（加密文件写入解密后的数据）"""
+        with self._open_stored(path) as f:
+            copy_stream(f, out)
+
+    def _feed_decompressed(self, path: Path, out) -> bool:
+        """在本地解压文件并写入 out（远程缺少解压工具时使用）"""
+        compression = detect_compression(path)
+        if compression == 'gzip':
+            with self._open_stored(path) as raw, gzip.GzipFile(fileobj=raw) as src:
+                copy_stream(src, out)
+            return True
+        with self._stored_stdin(path) as src:
+            result = subprocess.run(COMPRESSORS[compression]['decompress'].split(), stdin=src, stdout=out)
+        return result.returncode == 0
+
+    def _remote_decompress(self, path: Path) -> Tuple[Optional[str], bool]:
+        """返回 (远程解压命令, 是否需要本地解压)，未压缩文件返回 (None, False)"""
+        codec = COMPRESSORS[detect_compression(path)]
+        if not codec['decompress']:
+            return None, False
+        if self.ssh.has_command(codec['decompress'].split()[0]):
+            return codec['decompress'], False
+        return None, True
+
+    def _extract_archive_into(self, staging: str, archive: Path, cleanup: bool = True) -> bool:
+        """把任意格式的本地压缩包流式解压到远程临时目录，优先在远程解压"""
+        decompress, local = self._remote_decompress(archive)
+        if local:
+            def feed(out):
+                if not self._feed_decompressed(archive, out):
+                    raise IOError(f"本地解压失败: {archive.name}")
+            return self._extract_into(staging, feed, cleanup=cleanup)
+        return self._extract_into(staging, lambda out: self._feed_file(archive, out), decompress, cleanup)
+
+    def _new_staging(self) -> Tuple[str, str]:
+        """remotePath 旁的临时解压目录"""
+        stamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        return f'{self.project["remotePath"]}.restore.{stamp}', stamp
+
+    def _stream_extract(self, feed, root: str, decompress: Optional[str] = None) -> bool:
+        """把 tar 数据流经 SSH 送入 remotePath 旁的临时目录解压，成功后再替换 remotePath
+
+        feed(out) 负责把 tar 数据写入 out；解压失败时现有文件保持不变。
+        """
+        staging, stamp = self._new_staging()
+        if not self._extract_into(staging, feed, decompress):
+            return False
+        return self._swap_in(staging, root, stamp)
 
-        scp_cmd = f'scp -P {self.project["port"]} "{local_archive}" {self.project["user"]}@{self.project["host"]}:{remote_archive}'
+    def _extract_into(self, staging: str, feed, decompress: Optional[str] = None,
+                      cleanup: bool = True) -> bool:
+        """把 feed 写出的 tar 数据流在远程临时目录中解压，失败时删除临时目录
 
-        try:
-            result = subprocess.run(scp_cmd, shell=True, capture_output=True, text=True)
-            if result.returncode == 0:
-                Colors.success(f"上传完成")
-                return True
-            else:
-                Colors.error(f"上传失败: {result.stderr.strip()}")
-                return False
-        except Exception as e:
-            Colors.error(f"上传异常: {e}")
+        decompress 为远程解压命令，数据流未压缩时为 None；
+        cleanup 为 False 时（原地解压到已有目录）失败也不删除目录。
+        """
+        extract = f'tar -xf - -C {shlex.quote(staging)}'
+        if decompress:
+            extract = f'{decompress} | {extract}'
+
+        with tempfile.TemporaryFile() as err:
+            proc = self.ssh.popen(f'mkdir -p {shlex.quote(staging)} && {extract}',
+                                  stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=err)
+            try:
+                feed(proc.stdin)
+            except BrokenPipeError:
+                pass
+            except Exception as e:
+                Colors.error(f"读取备份数据失败: {e}")
+                proc.kill()
+            finally:
+                try:
+                    proc.stdin.close()
+                except BrokenPipeError:
+                    pass
+            returncode = proc.wait()
+            err.seek(0)
+            stderr = err.read().decode('utf-8', errors='replace').strip()
+
+        if returncode != 0:
+            Colors.error(f"远程解压失败: {stderr}")
+            if cleanup:
+                self.ssh.run(f'rm -rf {shlex.quote(staging)}')
+            return False
+        return True
+
+    def _delete_in(self, remote_dir: str, paths: List[str]) -> bool:
+        """在远程目录中删除文件列表"""
+        with tempfile.TemporaryFile() as file_list:
+            file_list.write('\0'.join(paths).encode('utf-8'))
+            file_list.seek(0)
+            result = self.ssh.run(f'cd {shlex.quote(remote_dir)} && xargs -0 rm -f', stdin=file_list)
+        if result.returncode != 0:
+            Colors.error(f"删除文件失败: {result.stderr.strip()}")
             return False
+        return True
 
-    def _extract_remote_archive(self, remote_archive: str) -> bool:
-        """在远程服务器解压压缩包"""
-        Colors.info("在远程服务器解压...")
+    def _rmdir_in(self, remote_dir: str, paths: List[str]) -> bool:
+        """在远程目录中删除空目录（按给定顺序，应深层在前）；非空的目录（例如含有被排除的文件）保留"""
+        with tempfile.TemporaryFile() as file_list:
+            file_list.write('\0'.join(paths).encode('utf-8'))
+            file_list.seek(0)
+            result = self.ssh.run(f'cd {shlex.quote(remote_dir)} && '
+                                  f'xargs -0 sh -c \'for d; do rmdir -- "$d" 2>/dev/null; done; true\' sh',
+                                  stdin=file_list)
+        if result.returncode != 0:
+            Colors.error(f"删除目录失败: {result.stderr.strip()}")
+            return False
+        return True
 
-        # 先备份远程现有文件
-        backup_cmd = f'ssh -p {self.project["port"]} {self.project["user"]}@{self.project["host"]} "mv {self.project["remotePath"]} {self.project["remotePath"]}.backup.$(date +%Y%m%d_%H%M%S) 2>/dev/null || true"'
-        subprocess.run(backup_cmd, shell=True, capture_output=True)
+    def _mkdir_in(self, remote_dir: str, paths: List[str]) -> bool:
+        """在远程目录中创建目录（已存在时跳过）"""
+        with tempfile.TemporaryFile() as file_list:
+            file_list.write('\0'.join(paths).encode('utf-8'))
+            file_list.seek(0)
+            result = self.ssh.run(f'cd {shlex.quote(remote_dir)} && xargs -0 mkdir -p --', stdin=file_list)
+        if result.returncode != 0:
+            Colors.error(f"创建目录失败: {result.stderr.strip()}")
+            return False
+        return True
 
-        # 解压命令
-        extract_cmd = f'ssh -p {self.project["port"]} {self.project["user"]}@{self.project["host"]} "cd /tmp && tar -xzf {remote_archive} && mv $(tar -tzf {remote_archive} | head -1 | cut -f1 -d\"/\") {self.project["remotePath"]}"'
+    def _touch_in(self, remote_dir: str, mtimes: Dict[str, int]) -> bool:
+        """在远程目录中把文件的 mtime 改回备份中的值（内容相同、只有 mtime 不同的文件）"""
+        with tempfile.TemporaryFile() as file_list:
+            file_list.write(''.join(f'{mtime}\0{rel}\0' for rel, mtime in mtimes.items()).encode('utf-8'))
+            file_list.seek(0)
+            result = self.ssh.run(f'cd {shlex.quote(remote_dir)} && xargs -0 -n 2 sh -c \'touch -h -m -d "@$0" -- "$1"\'',
+                                  stdin=file_list)
+        if result.returncode != 0:
+            Colors.error(f"更新文件时间失败: {result.stderr.strip()}")
+            return False
+        return True
 
-        try:
-            result = subprocess.run(extract_cmd, shell=True, capture_output=True, text=True)
-            if result.returncode == 0:
-                Colors.success("远程解压完成")
-                return True
-            else:
-                Colors.error(f"远程解压失败: {result.stderr.strip()}")
-                # 恢复备份
-                restore_cmd = f'ssh -p {self.project["port"]} {self.project["user"]}@{self.project["host"]} "rm -rf {self.project["remotePath"]} && mv {self.project["remotePath"]}.backup.* {self.project["remotePath"]} 2>/dev/null || true"'
-                subprocess.run(restore_cmd, shell=True, capture_output=True)
-                return False
-        except Exception as e:
-            Colors.error(f"远程解压异常: {e}")
+    def _swap_in(self, staging: str, root: str, stamp: str) -> bool:
+        """先备份远程现有目录，再换上临时目录中解压好的目录"""
+        remote_path = shlex.quote(self.project['remotePath'])
+        backup = shlex.quote(f'{self.project["remotePath"]}.backup.{stamp}')
+        extracted = shlex.quote(f'{staging}/{root}')
+        swap_cmd = (f'if [ -e {remote_path} ]; then mv {remote_path} {backup}; fi'
+                    f' && {{ mv {extracted} {remote_path} || {{ mv {backup} {remote_path} 2>/dev/null; false; }}; }}'
+                    f' && rmdir {shlex.quote(staging)}')
+        result = self.ssh.run(swap_cmd)
+        if result.returncode != 0:
+            Colors.error(f"替换远程目录失败: {result.stderr.strip()}")
+            return False
+
+        Colors.success("远程解压完成")
+        return True
+
+    def _restore_from_shards(self, files_dir: Path, shards: List[Path]) -> bool:
+        """并行把各分片解压到同一个临时目录，全部成功后再替换 remotePath"""
+        Colors.info(f"并行还原 {len(shards)} 个分片")
+        staging, stamp = self._new_staging()
+        self.ssh.run(f'mkdir -p {shlex.quote(staging)}')
+
+        with ThreadPoolExecutor(max_workers=len(shards)) as pool:
+            results = list(pool.map(lambda shard: self._extract_archive_into(staging, shard, cleanup=False),
+                                    shards))
+        if not all(results):
+            self.ssh.run(f'rm -rf {shlex.quote(staging)}')
             return False
+        if not self._swap_in(staging, self._version_root(files_dir), stamp):
+            return False
+
+        Colors.success("文件还原完成")
+        return True
+
+    def _restore_from_archive(self, archive_path: Path) -> bool:
+        """从压缩包还原：本地压缩包经一个 SSH 通道直接送入 remotePath 旁的临时目录解压
+
+        顶层目录名取自清单（files.root），不再上传到 /tmp 或重新列出压缩包。
+        """
+        size = archive_path.size if isinstance(archive_path, StoredObject) else archive_path.stat().st_size
+        Colors.info(f"使用压缩包流式还原: {archive_path.name} ({self._format_size(size)})")
+
+        staging, stamp = self._new_staging()
+        if not self._extract_archive_into(staging, archive_path):
+            return False
+        if not self._swap_in(staging, self._version_root(archive_path.parent), stamp):
+            return False
+
+        Colors.success("文件还原完成")
+        return True
 
     def _restore_databases(self, db_dir: Path) -> bool:
         """还原数据库"""
@@ -675,8 +5276,8 @@ class RestoreManager:
 
         success = True
         for db in self.project.get('databases', []):
-            sql_file = db_dir / f"{db['name']}.sql"
-            if not sql_file.exists():
+            sql_file = self._find_dump(db_dir, db['name'])
+            if not sql_file:
                 continue
 
             if not self._restore_single_database(db, sql_file):
@@ -701,19 +5302,27 @@ class RestoreManager:
             Colors.warning(f"暂不支持 {db_type} 数据库类型")
             return True
 
+    def _find_dump(self, db_dir: Path, name: str) -> Optional[Path]:
+        """查找数据库导出文件（支持压缩格式）"""
+        for codec in COMPRESSORS.values():
+            sql_file = db_dir / f"{name}.sql{codec['ext']}"
+            if sql_file.exists():
+                return sql_file
+        return None
+
     def _restore_mysql(self, db: Dict, sql_file: Path) -> bool:
         """还原 MySQL 数据库"""
-        cmd = f'cat "{sql_file}" | ssh -p {self.project["port"]} {self.project["user"]}@{self.project["host"]} "mysql -u {db["user"]} -p$MYSQL_PWD {db["name"]}"'
+        password = shlex.quote(os.getenv('MYSQL_PASSWORD', ''))
+        load_cmd = f'MYSQL_PWD={password} mysql -u {shlex.quote(db["user"])} {shlex.quote(db["name"])}'
 
         try:
-            result = subprocess.run(cmd, shell=True, capture_output=True, text=True,
-                                    env={**os.environ, 'MYSQL_PASSWORD': os.getenv('MYSQL_PASSWORD', '')})
+            returncode, stderr = self._stream_load(sql_file, load_cmd)
 
-            if result.returncode == 0:
+            if returncode == 0:
                 Colors.success(f"MySQL 还原完成")
                 return True
             else:
-                Colors.error(f"MySQL 还原失败: {result.stderr.strip()}")
+                Colors.error(f"MySQL 还原失败: {stderr}")
                 return False
         except Exception as e:
             Colors.error(f"MySQL 还原异常: {e}")
@@ -721,22 +5330,339 @@ class RestoreManager:
 
     def _restore_postgresql(self, db: Dict, sql_file: Path) -> bool:
         """还原 PostgreSQL 数据库"""
-        cmd = f'cat "{sql_file}" | ssh -p {self.project["port"]} {self.project["user"]}@{self.project["host"]} "PGPASSWORD=$PG_PWD psql -U {db["user"]} {db["name"]}"'
+        password = shlex.quote(os.getenv('PG_PASSWORD', ''))
+        load_cmd = f'PGPASSWORD={password} psql -U {shlex.quote(db["user"])} {shlex.quote(db["name"])}'
 
         try:
-            result = subprocess.run(cmd, shell=True, capture_output=True, text=True,
-                                    env={**os.environ, 'PG_PASSWORD': os.getenv('PG_PASSWORD', '')})
+            returncode, stderr = self._stream_load(sql_file, load_cmd)
 
-            if result.returncode == 0:
+            if returncode == 0:
                 Colors.success(f"PostgreSQL 还原完成")
                 return True
             else:
-                Colors.error(f"PostgreSQL 还原失败: {result.stderr.strip()}")
+                Colors.error(f"PostgreSQL 还原失败: {stderr}")
                 return False
         except Exception as e:
             Colors.error(f"PostgreSQL 还原异常: {e}")
             return False
 
+    def _stream_load(self, sql_file: Path, load_cmd: str) -> Tuple[int, str]:
+        """把导出文件流式送入远程导入命令，压缩文件透明解压
+
+        优先在远程解压（网络只传输压缩数据），远程缺少解压工具时在本地解压。
+        返回 (退出码, stderr)。
+        """
+        decompress, local = self._remote_decompress(sql_file)
+
+        if not local:
+            remote_cmd = load_cmd
+            if decompress:
+                remote_cmd = f'{{ {decompress} || echo {PIPE_FAILED_MARKER} >&2; }} | {load_cmd}'
+            with self._stored_stdin(sql_file) as f:
+                result = self.ssh.run(remote_cmd, stdin=f)
+            failed = PIPE_FAILED_MARKER in result.stderr
+            return result.returncode or int(failed), result.stderr.replace(PIPE_FAILED_MARKER, '').strip()
+
+        with tempfile.TemporaryFile() as err:
+            proc = self.ssh.popen(load_cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=err)
+            try:
+                if not self._feed_decompressed(sql_file, proc.stdin):
+                    proc.kill()
+            finally:
+                proc.stdin.close()
+            returncode = proc.wait()
+            err.seek(0)
+            return returncode, err.read().decode('utf-8', errors='replace').strip()
+
+
+class PruneManager:
+    """按保留策略清理旧版本
+
+    策略（项目配置 retention）: keepLast / keepDaily / keepWeekly / keepMonthly 取并集，
+    maxTotalBytes 再从最旧的版本开始删除直到总占用不超过上限。
+    增量链中被保留版本依赖的父版本不会被删除；rsync --link-dest 共享的 inode
+    只有在所有硬链接都位于被删除版本中时才计入释放空间；分块仓库中
+    不再被任何版本引用的块在删除版本后回收，计算 maxTotalBytes 时计入引用它们的版本。
+    """
+
+    POLICY_KEYS = ('keepLast', 'keepDaily', 'keepWeekly', 'keepMonthly', 'maxTotalBytes')
+
+    def __init__(self, project: Dict, policy: Optional[Dict] = None):
+        self.project = project
+        self.local_path = Path(project['localPath']).expanduser()
+        self.backup_base = self.local_path / "backups"
+        self.policy = dict(project.get('retention', {}))
+        self.policy.update({k: v for k, v in (policy or {}).items() if v is not None})
+
+    def prune(self, dry_run: bool = False) -> bool:
+        """执行清理，dry_run 时只输出计划"""
+        if not any(self.policy.get(key) for key in self.POLICY_KEYS):
+            Colors.warning("未配置保留策略（retention），跳过清理")
+            return True
+        if not self.backup_base.exists():
+            return True
+
+        versions = self._load_versions()
+        inodes = self._scan_inodes(versions)
+        keep, reasons = self._select(versions, inodes)
+        delete = [v for v in versions if v['name'] not in keep and v['complete']]
+
+        freed = self._freed_bytes(delete, inodes)
+        chunks = self._unreferenced_chunks(versions, delete)
+        chunk_bytes = sum(size for _, size in chunks)
+
+        Colors.header(f"{self.project['name']} 清理{'（模拟）' if dry_run else ''}")
+        for v in versions:
+            time_str = datetime.datetime.fromtimestamp(v['time']).strftime('%Y-%m-%d %H:%M')
+            if not v['complete']:
+                print(f"  {Colors.YELLOW}跳过{Colors.RESET} {v['name']}  {time_str}  没有清单（备份可能仍在进行）")
+            elif v['name'] in keep:
+                print(f"  {Colors.GREEN}保留{Colors.RESET} {v['name']}  {time_str}  {', '.join(reasons[v['name']])}")
+            else:
+                print(f"  {Colors.RED}删除{Colors.RESET} {v['name']}  {time_str}")
+        print()
+        Colors.info(f"删除 {len(delete)} 个版本，释放 {self._format_size(freed)}"
+                    f"（另有 {len(chunks)} 个分块 {self._format_size(chunk_bytes)}）")
+
+        if dry_run or not delete:
+            return True
+
+        for v in delete:
+            shutil.rmtree(v['path'])
+        for path, _ in chunks:
+            path.unlink()
+        self._update_catalog(versions, delete, inodes)
+        Colors.success(f"清理完成，释放 {self._format_size(freed + chunk_bytes)}")
+        return True
+
+    def _load_versions(self) -> List[Dict]:
+        """读取所有版本（新到旧）及其依赖的增量父版本"""
+        versions = []
+        for path in self.backup_base.iterdir():
+            if not path.is_dir():
+                continue
+            manifest = self._load_manifest(path / 'manifest.json')
+            parent = None
+            index_file = path / "files" / FILE_INDEX_NAME
+            if index_file.exists():
+                try:
+                    with gzip.open(index_file, 'rt', encoding='utf-8') as f:
+                        parent = json.load(f).get('parent')
+                except (OSError, ValueError):
+                    pass
+            try:
+                version_time = datetime.datetime.strptime(path.name, "%Y-%m-%d_%H%M%S").timestamp()
+            except ValueError:
+                version_time = path.stat().st_mtime
+            versions.append({
+                'name': path.name,
+                'path': path,
+                'time': version_time,
+                'complete': manifest is not None,
+                'success': bool(manifest and manifest.get('success')),
+                'parent': parent,
+            })
+        versions.sort(key=lambda v: v['time'], reverse=True)
+        return versions
+
+    def _select(self, versions: List[Dict], inodes: Dict) -> Tuple[set, Dict[str, List[str]]]:
+        """按策略选出保留的版本，返回 (保留的版本名, 保留原因)"""
+        reasons: Dict[str, List[str]] = {v['name']: [] for v in versions}
+        successful = [v for v in versions if v['success']]
+
+        if self.policy.get('keepLast'):
+            for v in successful[:self.policy['keepLast']]:
+                reasons[v['name']].append('最近')
+        periods = (('keepDaily', '每日', '%Y-%m-%d'), ('keepWeekly', '每周', '%G-W%V'),
+                   ('keepMonthly', '每月', '%Y-%m'))
+        for key, label, fmt in periods:
+            limit = self.policy.get(key)
+            if not limit:
+                continue
+            seen = set()
+            for v in successful:
+                period = datetime.datetime.fromtimestamp(v['time']).strftime(fmt)
+                if period in seen:
+                    continue
+                seen.add(period)
+                reasons[v['name']].append(label)
+                if len(seen) >= limit:
+                    break
+        # 最新的成功版本始终保留
+        if successful and not reasons[successful[0]['name']]:
+            reasons[successful[0]['name']].append('最新')
+
+        keep = {name for name, why in reasons.items() if why}
+        # 没有清单的版本（可能正在备份）不删除
+        keep |= {v['name'] for v in versions if not v['complete']}
+        self._add_dependencies(versions, keep, reasons)
+
+        max_total = self.policy.get('maxTotalBytes')
+        if max_total:
+            self._apply_size_limit(versions, keep, reasons, inodes, max_total)
+        return keep, reasons
+
+    def _add_dependencies(self, versions: List[Dict], keep: set, reasons: Dict[str, List[str]]):
+        """保留增量链中被保留版本依赖的所有父版本"""
+        by_name = {v['name']: v for v in versions}
+        for name in list(keep):
+            child = name
+            parent = by_name[name]['parent']
+            while parent and parent in by_name:
+                if f'被 {child} 依赖' not in reasons[parent]:
+                    reasons[parent].append(f'被 {child} 依赖')
+                keep.add(parent)
+                child, parent = parent, by_name[parent]['parent']
+
+    def _apply_size_limit(self, versions: List[Dict], keep: set, reasons: Dict[str, List[str]],
+                          inodes: Dict, max_total: int):
+        """从最旧的版本开始去掉保留标记，直到保留版本的实际占用不超过上限
+
+        最新的成功版本、未完成的版本以及仍被其他保留版本依赖的父版本不会被去掉。
+        占用包括版本目录中的 inode 和版本引用的分块（被多个版本共享的只计一次）。
+        """
+        refs: Dict[Tuple, int] = {}
+        for v in versions:
+            if v['name'] in keep:
+                for key in [*inodes['versions'][v['name']], *inodes['chunks'][v['name']]]:
+                    refs[key] = refs.get(key, 0) + 1
+        total = sum(inodes['sizes'][key] for key in refs)
+
+        newest = next((v['name'] for v in versions if v['success']), None)
+        for v in reversed(versions):
+            if total <= max_total:
+                break
+            name = v['name']
+            if name not in keep or name == newest or not v['complete']:
+                continue
+            if any(other['parent'] == name and other['name'] in keep for other in versions):
+                continue
+            keep.discard(name)
+            reasons[name] = []
+            for key in [*inodes['versions'][name], *inodes['chunks'][name]]:
+                refs[key] -= 1
+                if not refs[key]:
+                    total -= inodes['sizes'][key]
+                    del refs[key]
+
+    def _scan_inodes(self, versions: List[Dict]) -> Dict:
+        """统计每个版本引用的 inode 及其在该版本中的硬链接数，以及每个版本引用的分块
+
+        分块以 ('chunk', 摘要) 为键记入 sizes（仓库中的文件大小），不参与硬链接计数。
+        """
+        sizes: Dict[Tuple, int] = {}
+        nlinks: Dict[Tuple[int, int], int] = {}
+        per_version: Dict[str, Dict[Tuple[int, int], int]] = {}
+        chunks: Dict[str, List[Tuple[str, str]]] = {}
+        store = ChunkStore(self.local_path / "chunks")
+        for v in versions:
+            chunks[v['name']] = []
+            index_file = v['path'] / "files" / 'chunks.json'
+            if index_file.exists():
+                try:
+                    with open(index_file, 'r', encoding='utf-8') as f:
+                        digests = {digest for digest, _ in json.load(f)['chunks']}
+                except (OSError, ValueError, KeyError):
+                    digests = set()
+                for digest in digests:
+                    key = ('chunk', digest)
+                    if key not in sizes:
+                        try:
+                            sizes[key] = store.chunk_path(digest).stat().st_size
+                        except OSError:
+                            continue
+                    chunks[v['name']].append(key)
+
+            links: Dict[Tuple[int, int], int] = {}
+            stack = [str(v['path'])]
+            while stack:
+                try:
+                    with os.scandir(stack.pop()) as entries:
+                        for entry in entries:
+                            if entry.is_dir(follow_symlinks=False):
+                                stack.append(entry.path)
+                            elif entry.is_file(follow_symlinks=False):
+                                st = entry.stat(follow_symlinks=False)
+                                key = (st.st_dev, st.st_ino)
+                                links[key] = links.get(key, 0) + 1
+                                sizes[key] = st.st_size
+                                nlinks[key] = st.st_nlink
+                except OSError:
+                    continue
+            per_version[v['name']] = links
+        return {'sizes': sizes, 'nlinks': nlinks, 'versions': per_version, 'chunks': chunks}
+
+    def _freed_bytes(self, delete: List[Dict], inodes: Dict) -> int:
+        """只有所有硬链接都位于被删除版本中的 inode 才会真正释放空间"""
+        removed: Dict[Tuple[int, int], int] = {}
+        for v in delete:
+            for key, count in inodes['versions'][v['name']].items():
+                removed[key] = removed.get(key, 0) + count
+        return sum(inodes['sizes'][key] for key, count in removed.items() if count >= inodes['nlinks'][key])
+
+    def _unreferenced_chunks(self, versions: List[Dict], delete: List[Dict]) -> List[Tuple[Path, int]]:
+        """删除版本后不再被任何版本引用的分块；存在未完成的版本时不回收"""
+        chunk_root = self.local_path / "chunks"
+        if not delete or not chunk_root.exists():
+            return []
+        deleted = {v['name'] for v in delete}
+        if any(not v['complete'] for v in versions):
+            Colors.warning("存在未完成的版本，本次不回收分块")
+            return []
+
+        referenced = set()
+        for v in versions:
+            index_file = v['path'] / "files" / 'chunks.json'
+            if v['name'] in deleted or not index_file.exists():
+                continue
+            with open(index_file, 'r', encoding='utf-8') as f:
+                referenced.update(digest for digest, _ in json.load(f)['chunks'])
+
+        unreferenced = []
+        for path in chunk_root.glob('*/*'):
+            if path.name not in referenced:
+                unreferenced.append((path, path.stat().st_size))
+        return unreferenced
+
+    def _update_catalog(self, versions: List[Dict], delete: List[Dict], inodes: Dict):
+        """从索引中移除已删除的版本，并按删除后的硬链接数重算其余版本的独占字节数"""
+        deleted = {v['name'] for v in delete}
+        removed: Dict[Tuple[int, int], int] = {}
+        for name in deleted:
+            for key, count in inodes['versions'][name].items():
+                removed[key] = removed.get(key, 0) + count
+
+        catalog = BackupCatalog(self.local_path)
+        entries = catalog.load()
+        for name in deleted:
+            entries.pop(name, None)
+        for v in versions:
+            entry = entries.get(v['name'])
+            # 分块仓库版本的独占字节数来自新增分块，与硬链接无关
+            if v['name'] in deleted or not entry or entry.get('format') == 'dedup':
+                continue
+            entry['uniqueBytes'] = sum(inodes['sizes'][key] for key, count in inodes['versions'][v['name']].items()
+                                       if count >= inodes['nlinks'][key] - removed.get(key, 0))
+        catalog.save(entries)
+
+    def _load_manifest(self, manifest_file: Path) -> Optional[Dict]:
+        """加载清单文件"""
+        if not manifest_file.exists():
+            return None
+        try:
+            with open(manifest_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _format_size(self, size: int) -> str:
+        """格式化大小"""
+        for unit in ['B', 'KB', 'MB', 'GB']:
+            if size < 1024:
+                return f"{size:.1f}{unit}"
+            size /= 1024
+        return f"{size:.1f}TB"
+
 
 def cmd_add(args):
     """添加项目命令"""
@@ -748,7 +5674,18 @@ def cmd_add(args):
         'remotePath': args.remote_path,
         'localPath': args.local_path,
         'exclude': list(args.exclude) if args.exclude else [],
+        'tags': list(args.tag) if args.tag else [],
     }
+    if args.schedule:
+        for expr in args.schedule:
+            try:
+                CronSchedule(expr)
+            except ValueError as e:
+                Colors.error(f"无效的 schedule: {e}")
+                return
+        project['schedule'] = list(args.schedule)
+    if args.ssh_transport:
+        project['sshTransport'] = args.ssh_transport
 
     if args.db_type and args.db_name:
         project['databases'] = [{
@@ -780,6 +5717,8 @@ def cmd_list(args):
         print(f"    本地: {p['localPath']}")
         if p.get('databases'):
             print(f"    数据库: {', '.join([db['name'] for db in p['databases']])}")
+        if p.get('tags'):
+            print(f"    标签: {', '.join(p['tags'])}")
         print()
 
 
@@ -792,6 +5731,18 @@ def cmd_delete(args):
 def cmd_backup(args):
     """备份命令"""
     config = ProjectConfig()
+
+    if args.all or args.tag:
+        if args.project_name:
+            Colors.error(f"不能同时指定项目名称 '{args.project_name}' 和 --all / --tag")
+            return
+        cmd_backup_all(args, config)
+        return
+
+    if not args.project_name:
+        Colors.error("请指定项目名称，或使用 --all / --tag 备份多个项目")
+        return
+
     project = config.get_project(args.project_name)
 
     if not project:
@@ -804,10 +5755,59 @@ def cmd_backup(args):
         db_only=args.db_only,
         files_only=args.files_only,
         exclude=list(args.exclude) if args.exclude else None,
-        dry_run=args.dry_run
+        dry_run=args.dry_run,
+        archive_mode=args.archive_mode,
+        workers=args.workers,
+        streams=args.streams,
+        shards=args.shards,
+        prune=args.prune,
+        encrypt=False if args.no_encrypt else None,
+        multiplex=False if args.no_multiplex else None
     )
 
 
+def cmd_backup_all(args, config: ProjectConfig):
+    """批量备份多个项目"""
+    projects = config.filter_projects(args.tag)
+    if not projects:
+        Colors.warning("没有匹配的项目")
+        return
+
+    Colors.header(f"批量备份 {len(projects)} 个项目 (并发 {args.jobs}, 每主机 {args.per_host})")
+
+    start = time.monotonic()
+    scheduler = BackupScheduler(projects, jobs=args.jobs, per_host=args.per_host)
+    results = scheduler.run(
+        incremental=args.incremental,
+        db_only=args.db_only,
+        files_only=args.files_only,
+        exclude=list(args.exclude) if args.exclude else None,
+        dry_run=args.dry_run,
+        archive_mode=args.archive_mode,
+        workers=args.workers,
+        streams=args.streams,
+        shards=args.shards,
+        prune=args.prune,
+        encrypt=False if args.no_encrypt else None,
+        multiplex=False if args.no_multiplex else None
+    )
+    elapsed = time.monotonic() - start
+
+    Colors.header("批量备份汇总")
+    for r in sorted(results, key=lambda r: r['name']):
+        status = f"{Colors.GREEN}成功{Colors.RESET}" if r['success'] else f"{Colors.RED}失败{Colors.RESET}"
+        print(f"  {r['name']:<24} {r['host']:<24} {status}  {r['duration']:.1f}s")
+    print()
+
+    failed = [r for r in results if not r['success']]
+    total = sum(r['duration'] for r in results)
+    Colors.info(f"总耗时 {elapsed:.1f}s（串行合计 {total:.1f}s）")
+    if failed:
+        Colors.error(f"{len(failed)}/{len(results)} 个项目备份失败")
+        sys.exit(1)
+    Colors.success(f"全部 {len(results)} 个项目备份成功")
+
+
 def cmd_restore(args):
     """还原命令"""
     config = ProjectConfig()
@@ -818,14 +5818,180 @@ def cmd_restore(args):
         return
 
     manager = RestoreManager(project)
-    manager.restore(
+    if args.no_multiplex:
+        manager.ssh.multiplex = False
+    restore = manager.restore_from_storage if args.from_storage else manager.restore
+    restore(
         version=args.version,
         files_only=args.files_only,
         db_only=args.db_only,
-        dry_run=args.dry_run
+        dry_run=args.dry_run,
+        paths=args.path,
+        delta=args.delta
     )
 
 
+def cmd_extract(args):
+    """从备份中解压文件到本地命令"""
+    config = ProjectConfig()
+    project = config.get_project(args.project_name)
+
+    if not project:
+        Colors.error(f"项目 '{args.project_name}' 不存在")
+        return
+
+    manager = RestoreManager(project)
+    if not manager.extract_local(args.version, args.paths, Path(args.output)):
+        sys.exit(1)
+
+
+def cmd_cat(args):
+    """输出备份中单个文件的内容命令"""
+    config = ProjectConfig()
+    project = config.get_project(args.project_name)
+
+    if not project:
+        Colors.error(f"项目 '{args.project_name}' 不存在")
+        return
+
+    manager = RestoreManager(project)
+    try:
+        ok = manager.cat_file(args.version, args.path, sys.stdout.buffer)
+        sys.stdout.buffer.flush()
+    except BrokenPipeError:
+        ok = True
+    if not ok:
+        sys.exit(1)
+
+
+def cmd_bench_codecs(args):
+    """压缩格式测试命令"""
+    config = ProjectConfig()
+    project = config.get_project(args.project_name)
+
+    if not project:
+        Colors.error(f"项目 '{args.project_name}' 不存在")
+        return
+
+    manager = BackupManager(project)
+    if args.threads is not None:
+        manager.threads = args.threads
+
+    Colors.header(f"{project['name']} 压缩格式测试")
+    results = manager.benchmark_codecs(sample_mb=args.sample_mb)
+    if not results:
+        Colors.warning("没有可用的测试结果")
+        return
+
+    print(f"  {'格式':<8} {'压缩后':>10} {'压缩率':>8} {'速度':>12}")
+    for r in sorted(results, key=lambda r: r['speed'], reverse=True):
+        print(f"  {r['codec']:<8} {manager._format_size(r['size']):>10} {r['ratio']:>7.2f}x {r['speed']:>8.1f}MB/s")
+    print()
+
+
+def cmd_bench_transfer(args):
+    """并行传输测试命令"""
+    config = ProjectConfig()
+    project = config.get_project(args.project_name)
+
+    if not project:
+        Colors.error(f"项目 '{args.project_name}' 不存在")
+        return
+
+    try:
+        streams = [int(n) for n in args.streams.split(',')]
+    except ValueError:
+        Colors.error(f"无效的连接数列表: {args.streams}")
+        return
+
+    manager = BackupManager(project)
+    Colors.header(f"{project['name']} 并行传输测试 ({args.size_mb}MB)")
+    results = manager.benchmark_transfer(size_mb=args.size_mb, streams=streams)
+    if not results:
+        Colors.warning("没有可用的测试结果")
+        return
+
+    base = results[0]['speed']
+    print(f"  {'连接数':<6} {'耗时':>8} {'速度':>12} {'加速比':>8}")
+    for r in results:
+        print(f"  {r['streams']:<6} {r['seconds']:>7.2f}s {r['speed']:>8.1f}MB/s {r['speed'] / base:>7.2f}x")
+    print()
+
+
+def cmd_bench_encrypt(args):
+    """加密吞吐量测试命令"""
+    config = ProjectConfig()
+    project = config.get_project(args.project_name)
+
+    if not project:
+        Colors.error(f"项目 '{args.project_name}' 不存在")
+        return
+
+    try:
+        threads = [int(n) for n in args.threads.split(',')] if args.threads else None
+    except ValueError:
+        Colors.error(f"无效的线程数列表: {args.threads}")
+        return
+
+    manager = BackupManager(project)
+    Colors.header(f"{project['name']} 加密吞吐量测试 ({args.size_mb}MB)")
+    report = manager.benchmark_encryption(size_mb=args.size_mb, threads=threads)
+    if not report:
+        return
+
+    print("  线程数         加密         解密")
+    for r in report['results']:
+        print(f"  {r['threads']:<6} {r['encrypt']:>8.1f}MB/s {r['decrypt']:>8.1f}MB/s")
+    print()
+
+    best = max(r['encrypt'] for r in report['results'])
+    Colors.info(f"磁盘写入速度 ({manager.local_path}): {report['disk']:.1f}MB/s")
+    if best >= report['disk']:
+        Colors.success(f"加密吞吐量 {best:.1f}MB/s 高于磁盘写入速度，加密不会成为瓶颈")
+    else:
+        Colors.warning(f"加密吞吐量 {best:.1f}MB/s 低于磁盘写入速度，加密会限制备份速度")
+
+
+def cmd_verify(args):
+    """校验备份命令"""
+    config = ProjectConfig()
+    project = config.get_project(args.project_name)
+
+    if not project:
+        Colors.error(f"项目 '{args.project_name}' 不存在")
+        return
+
+    manager = RestoreManager(project)
+    if not manager.verify(version=args.version, all_versions=args.all, workers=args.workers or 0):
+        sys.exit(1)
+
+
+def cmd_prune(args):
+    """按保留策略清理旧版本命令"""
+    config = ProjectConfig()
+    project = config.get_project(args.project_name)
+
+    if not project:
+        Colors.error(f"项目 '{args.project_name}' 不存在")
+        return
+
+    try:
+        max_total = parse_size(args.max_total_size) if args.max_total_size else None
+    except ValueError:
+        Colors.error(f"无效的大小: {args.max_total_size}")
+        return
+
+    manager = PruneManager(project, {
+        'keepLast': args.keep_last,
+        'keepDaily': args.keep_daily,
+        'keepWeekly': args.keep_weekly,
+        'keepMonthly': args.keep_monthly,
+        'maxTotalBytes': max_total,
+    })
+    if not manager.prune(dry_run=args.dry_run):
+        sys.exit(1)
+
+
 def cmd_versions(args):
     """列出备份版本命令"""
     config = ProjectConfig()
@@ -836,21 +6002,145 @@ def cmd_versions(args):
         return
 
     manager = RestoreManager(project)
-    versions = manager.list_versions()
+    if args.storage:
+        versions = manager.list_storage_versions()
+        if versions is None:
+            return
+    else:
+        versions = manager.list_versions(recompute=args.recompute)
 
     if not versions:
         Colors.warning("没有可用的备份版本")
         return
 
-    Colors.header(f"{project['name']} 备份版本")
+    Colors.header(f"{project['name']} 备份版本" + (f"（{create_storage(project).describe()}）" if args.storage else ""))
     for i, v in enumerate(versions, 1):
         timestamp = datetime.datetime.fromtimestamp(v['timestamp']).strftime('%Y-%m-%d %H:%M:%S')
         print(f"  {i}. {Colors.GREEN}{v['name']}{Colors.RESET}")
         print(f"     时间: {timestamp}")
         print(f"     大小: {v['size']}")
+        if v['files'] is not None:
+            print(f"     文件: {v['files']} 个，独占 {manager._format_size(v['uniqueBytes'])}")
+        if v['success'] is False:
+            print(f"     状态: {Colors.RED}未完成{Colors.RESET}")
+        print()
+
+
+def cmd_daemon(args):
+    """调度进程命令: 运行、查看状态、立即触发备份"""
+    socket_path = Path(args.socket).expanduser() if args.socket else DAEMON_SOCKET
+
+    if args.action == 'run':
+        if not hasattr(socket, 'AF_UNIX'):
+            Colors.error("调度进程需要 Unix 套接字，当前系统不支持，请使用任务计划程序")
+            sys.exit(1)
+        metrics_file = args.metrics_file or os.environ.get('BACKMGR_METRICS_FILE')
+        daemon = BackupDaemon(tags=args.tag, jobs=args.jobs, per_host=args.per_host,
+                              jitter=args.jitter, socket_path=socket_path,
+                              metrics_file=Path(metrics_file).expanduser() if metrics_file else None,
+                              metrics_port=args.metrics_port, metrics_addr=args.metrics_addr)
+        if not daemon.run():
+            sys.exit(1)
+        return
+
+    if args.action == 'trigger':
+        if not args.project_name:
+            Colors.error("请指定要触发的项目名称")
+            sys.exit(1)
+        request = {'cmd': 'trigger', 'project': args.project_name, 'incremental': args.incremental}
+    else:
+        request = {'cmd': 'status'}
+
+    response = daemon_request(request, socket_path)
+    if response is None:
+        Colors.error(f"调度进程未运行（{socket_path}）")
+        sys.exit(1)
+    if not response.get('ok'):
+        Colors.error(response.get('error', '请求失败'))
+        sys.exit(1)
+    if args.action == 'trigger':
+        Colors.success(f"已触发 {args.project_name} 的备份")
+        return
+
+    projects = response['projects']
+    if not projects:
+        Colors.warning("没有配置 schedule 的项目")
+        return
+    Colors.header("调度状态")
+    states = {'idle': '空闲', 'queued': f'{Colors.YELLOW}排队{Colors.RESET}', 'running': f'{Colors.BLUE}运行中{Colors.RESET}'}
+    for name, state in sorted(projects.items()):
+        if 'lastSuccess' not in state:
+            last = '-'
+        elif state['lastSuccess']:
+            last = f"{Colors.GREEN}成功{Colors.RESET} {state['lastFinish']} ({state['lastDuration']}s)"
+        else:
+            last = f"{Colors.RED}失败{Colors.RESET} {state['lastFinish']} ({state['lastDuration']}s)"
+        upcoming = min(state['next'].values()) if state.get('next') else '-'
+        print(f"  {Colors.GREEN}{name}{Colors.RESET} ({state['host']})  {states.get(state['state'], state['state'])}")
+        print(f"     计划: {', '.join(state.get('schedules', []))}  下次: {upcoming}")
+        print(f"     上次: {last}")
+        print(f"     累计: {state['runs']} 次，失败 {state['failures']} 次，跳过 {state['skipped']} 次")
         print()
 
 
+def cmd_stats(args):
+    """备份运行统计命令: 最近各次运行和各阶段耗时趋势"""
+    config = ProjectConfig()
+    project = config.get_project(args.project_name)
+
+    if not project:
+        Colors.error(f"项目 '{args.project_name}' 不存在")
+        return
+
+    records = RunLog().read(project['name'], args.last)
+    if not records:
+        Colors.warning(f"没有运行记录（{LOG_DIR / RUN_LOG_NAME}）")
+        return
+
+    fmt_size = RestoreManager(project)._format_size
+
+    Colors.header(f"{project['name']} 备份统计（最近 {len(records)} 次）")
+    print(f"  时间{' ' * 17}状态       耗时     数据量        吞吐")
+    for r in records:
+        status = f"{Colors.GREEN}成功{Colors.RESET}" if r['success'] else f"{Colors.RED}失败{Colors.RESET}"
+        rate = r['bytes'] / 1024 / 1024 / r['duration'] if r['duration'] else 0
+        print(f"  {r['timestamp']:<21}{status}  {r['duration']:>8.1f}s{fmt_size(r['bytes']):>11}{rate:>8.1f}MB/s")
+    print()
+
+    trends = RunLog.phase_trends(records)
+    if not trends:
+        return
+    print(f"  阶段{' ' * 20}次数  中位耗时  最近耗时    变化    中位吞吐    最近吞吐")
+    slow = []
+    for t in trends:
+        change = (t['lastDuration'] - t['medianDuration']) / t['medianDuration'] * 100 if t['medianDuration'] else 0
+        color = Colors.YELLOW if change > 50 and t['lastDuration'] >= 1 else ''
+        if color:
+            slow.append((t['name'], change))
+        median_rate = f"{t['medianMbps']:.1f}MB/s" if t['medianMbps'] is not None else '-'
+        last_rate = f"{t['lastMbps']:.1f}MB/s" if t['lastMbps'] is not None else '-'
+        print(f"  {color}{t['name']:<24}{t['runs']:>4}{t['medianDuration']:>9.1f}s{t['lastDuration']:>9.1f}s"
+              f"{change:>+7.0f}%{median_rate:>12}{last_rate:>12}{Colors.RESET if color else ''}")
+    print()
+    for name, change in slow:
+        Colors.warning(f"{name} 最近一次比中位数慢 {change:.0f}%")
+
+
+def cmd_metrics(args):
+    """指标命令: 输出或原子写入 Prometheus 文本格式的指标"""
+    exporter = MetricsExporter()
+    if not args.output:
+        sys.stdout.write(exporter.render())
+        return
+    path = Path(args.output).expanduser()
+    try:
+        exporter.write(path)
+    except OSError as e:
+        Colors.error(f"写入指标文件失败: {e}")
+        sys.exit(1)
+    Colors.success(f"指标已写入 {path}")
+
+
 def main():
     """主函数"""
     parser = argparse.ArgumentParser(
@@ -868,11 +6158,23 @@ def main():
   # 创建增量备份
   back-mgr backup myapp --incremental
 
+  # 并行备份所有项目（同一主机同时只跑一个）
+  back-mgr backup --all --jobs 8 --per-host 1
+
   # 还原最新版本
   back-mgr restore myapp
 
+  # 只还原一个配置文件
+  back-mgr restore myapp --path config/app.yml
+
+  # 查看备份中的文件
+  back-mgr cat myapp config/app.yml
+
   # 列出备份版本
   back-mgr versions myapp
+
+  # 按各项目的 schedule 常驻调度备份
+  back-mgr daemon --jobs 4 --per-host 1
         """
     )
 
@@ -887,6 +6189,10 @@ def main():
     add_parser.add_argument('--remote-path', required=True, help='远程项目路径')
     add_parser.add_argument('--local-path', required=True, help='本地备份路径')
     add_parser.add_argument('--exclude', action='append', help='排除的文件模式')
+    add_parser.add_argument('--tag', action='append', help='项目标签/分组（可多个）')
+    add_parser.add_argument('--schedule', action='append', help='定时备份的 cron 表达式，由 daemon 执行（可多个）')
+    add_parser.add_argument('--ssh-transport', choices=['subprocess', 'paramiko'],
+                            help='SSH 传输方式: subprocess（ssh 命令，默认）或 paramiko（进程内，需安装 paramiko）')
     add_parser.add_argument('--db-type', choices=['mysql', 'postgresql'], help='数据库类型')
     add_parser.add_argument('--db-name', help='数据库名称')
     add_parser.add_argument('--db-user', help='数据库用户')
@@ -900,11 +6206,27 @@ def main():
 
     # 备份命令
     backup_parser = subparsers.add_parser('backup', help='创建备份')
-    backup_parser.add_argument('project_name', help='项目名称')
+    backup_parser.add_argument('project_name', nargs='?', help='项目名称')
+    backup_parser.add_argument('--all', action='store_true', help='备份所有项目')
+    backup_parser.add_argument('--tag', action='append', help='仅备份带有该标签的项目（可多个）')
+    backup_parser.add_argument('--jobs', type=int, default=4, help='批量备份的总并发数 [默认: 4]')
+    backup_parser.add_argument('--per-host', type=int, default=1, help='同一主机的最大并发数 [默认: 1]')
     backup_parser.add_argument('--files-only', action='store_true', help='仅备份文件')
     backup_parser.add_argument('--db-only', action='store_true', help='仅备份数据库')
     backup_parser.add_argument('--incremental', action='store_true', help='增量备份')
     backup_parser.add_argument('--exclude', action='append', help='额外排除的文件模式')
+    backup_parser.add_argument('--archive-mode', choices=['stream', 'staged', 'sharded'],
+                               help='压缩包模式: stream 流式直传（默认）, staged 远程暂存后下载, sharded 按顶层目录分片并行')
+    backup_parser.add_argument('--workers', type=int, help='单个备份内文件与数据库阶段的并发数 [默认: 4]')
+    backup_parser.add_argument('--shards', type=int,
+                               help='分片模式的分片数 [默认: 项目配置 archiveShards 或 4]')
+    backup_parser.add_argument('--streams', type=int,
+                               help='暂存模式下载压缩包的并行 SSH 连接数 [默认: 项目配置 transferStreams 或 1]')
+    backup_parser.add_argument('--no-multiplex', action='store_true', help='不复用 SSH 连接（每次调用单独握手）')
+    backup_parser.add_argument('--no-encrypt', action='store_true',
+                               help='本次备份不加密（默认取项目配置 encryptSensitive）')
+    backup_parser.add_argument('--prune', action='store_true', default=None,
+                               help='备份成功后按保留策略清理旧版本（默认取项目配置 pruneAfterBackup）')
     backup_parser.add_argument('--dry-run', action='store_true', help='模拟运行')
 
     # 还原命令
@@ -914,10 +6236,92 @@ def main():
     restore_parser.add_argument('--files-only', action='store_true', help='仅还原文件')
     restore_parser.add_argument('--db-only', action='store_true', help='仅还原数据库')
     restore_parser.add_argument('--dry-run', action='store_true', help='模拟运行')
+    restore_parser.add_argument('--no-multiplex', action='store_true', help='不复用 SSH 连接（每次调用单独握手）')
+    restore_parser.add_argument('--path', action='append',
+                                help='只还原匹配的文件或目录（相对 remotePath，支持通配符，可多次指定）')
+    restore_parser.add_argument('--delta', action='store_true',
+                                help='差异还原：只发送与远程不同的文件并删除多余文件')
+    restore_parser.add_argument('--from-storage', action='store_true',
+                                help='从对象存储（项目配置 storage）下载版本后还原，不需要本地备份')
+
+    # verify 命令
+    verify_parser = subparsers.add_parser('verify', help='按清单中的校验和检查备份完整性')
+    verify_parser.add_argument('project_name', help='项目名称')
+    verify_parser.add_argument('--version', help='指定版本（默认：最新版本）')
+    verify_parser.add_argument('--all', action='store_true', help='校验所有版本')
+    verify_parser.add_argument('--workers', type=int, help='并行校验的线程数 [默认: CPU 核心数]')
+
+    # prune 命令
+    prune_parser = subparsers.add_parser('prune', help='按保留策略清理旧版本')
+    prune_parser.add_argument('project_name', help='项目名称')
+    prune_parser.add_argument('--keep-last', type=int, help='保留最近 N 个版本')
+    prune_parser.add_argument('--keep-daily', type=int, help='保留最近 N 天每天最新的版本')
+    prune_parser.add_argument('--keep-weekly', type=int, help='保留最近 N 周每周最新的版本')
+    prune_parser.add_argument('--keep-monthly', type=int, help='保留最近 N 个月每月最新的版本')
+    prune_parser.add_argument('--max-total-size', help='所有版本的总占用上限，如 500G')
+    prune_parser.add_argument('--dry-run', action='store_true', help='只显示将删除的版本')
+
+    # extract 命令
+    extract_parser = subparsers.add_parser('extract', help='从备份中解压文件到本地')
+    extract_parser.add_argument('project_name', help='项目名称')
+    extract_parser.add_argument('paths', nargs='+', help='文件或目录（相对 remotePath，支持通配符）')
+    extract_parser.add_argument('--version', help='指定版本（默认：最新版本）')
+    extract_parser.add_argument('-o', '--output', default='.', help='输出目录 [默认: 当前目录]')
+
+    # cat 命令
+    cat_parser = subparsers.add_parser('cat', help='输出备份中单个文件的内容')
+    cat_parser.add_argument('project_name', help='项目名称')
+    cat_parser.add_argument('path', help='文件路径（相对 remotePath）')
+    cat_parser.add_argument('--version', help='指定版本（默认：最新版本）')
+
+    # 压缩格式测试命令
+    bench_parser = subparsers.add_parser('bench-codecs', help='测试远程主机上各压缩格式的速度和压缩率')
+    bench_parser.add_argument('project_name', help='项目名称')
+    bench_parser.add_argument('--sample-mb', type=int, default=64, help='样本大小 (MB) [默认: 64]')
+    bench_parser.add_argument('--threads', type=int, help='多线程压缩的线程数 [默认: 全部核心]')
+
+    # bench-transfer 命令
+    bench_transfer_parser = subparsers.add_parser('bench-transfer', help='测试不同并行连接数下的下载吞吐量')
+    bench_transfer_parser.add_argument('project_name', help='项目名称')
+    bench_transfer_parser.add_argument('--size-mb', type=int, default=256, help='测试文件大小 (MB) [默认: 256]')
+    bench_transfer_parser.add_argument('--streams', default='1,2,4,8', help='要测试的连接数，逗号分隔 [默认: 1,2,4,8]')
+
+    # bench-encrypt 命令
+    bench_encrypt_parser = subparsers.add_parser('bench-encrypt', help='测试加密/解密吞吐量并与磁盘写入速度比较')
+    bench_encrypt_parser.add_argument('project_name', help='项目名称')
+    bench_encrypt_parser.add_argument('--size-mb', type=int, default=256, help='测试数据大小 (MB) [默认: 256]')
+    bench_encrypt_parser.add_argument('--threads', help='要测试的线程数，逗号分隔 [默认: 1,2,4,全部核心]')
+
+    # 运行统计命令
+    stats_parser = subparsers.add_parser('stats', help='查看备份运行的耗时和吞吐量趋势')
+    stats_parser.add_argument('project_name', help='项目名称')
+    stats_parser.add_argument('--last', type=int, default=20, help='统计最近 N 次运行 [默认: 20]')
+
+    # 调度进程命令
+    daemon_parser = subparsers.add_parser('daemon', help='按项目的 schedule 常驻调度备份（代替 cron）')
+    daemon_parser.add_argument('action', nargs='?', choices=['run', 'status', 'trigger'], default='run',
+                               help='run: 运行调度进程；status: 查看状态；trigger: 立即备份一个项目')
+    daemon_parser.add_argument('project_name', nargs='?', help='trigger 的项目名称')
+    daemon_parser.add_argument('--tag', action='append', help='只调度带有指定标签的项目（可多个）')
+    daemon_parser.add_argument('--jobs', type=int, default=4, help='最多同时备份的项目数 [默认: 4]')
+    daemon_parser.add_argument('--per-host', type=int, default=1, help='同一主机最多同时备份的项目数 [默认: 1]')
+    daemon_parser.add_argument('--jitter', type=int, default=120, help='每次触发的最大随机延迟（秒）[默认: 120]')
+    daemon_parser.add_argument('--socket', help=f'控制套接字路径 [默认: {DAEMON_SOCKET}]')
+    daemon_parser.add_argument('--incremental', action='store_true', help='trigger 时执行增量备份')
+    daemon_parser.add_argument('--metrics-file', help='每次备份后原子更新的 Prometheus 指标文件 [默认: $BACKMGR_METRICS_FILE]')
+    daemon_parser.add_argument('--metrics-port', type=int, help='在该端口提供 HTTP /metrics')
+    daemon_parser.add_argument('--metrics-addr', default='127.0.0.1', help='/metrics 监听地址 [默认: 127.0.0.1]')
+
+    # 指标命令
+    metrics_parser = subparsers.add_parser('metrics', help='输出 Prometheus 格式的备份指标')
+    metrics_parser.add_argument('-o', '--output', help='原子写入指标文件（textfile collector），不指定时输出到终端')
 
     # 列出版本命令
     versions_parser = subparsers.add_parser('versions', help='列出备份版本')
     versions_parser.add_argument('project_name', help='项目名称')
+    versions_parser.add_argument('--recompute', action='store_true',
+                                 help='重新遍历所有版本并重建 catalog.json')
+    versions_parser.add_argument('--storage', action='store_true', help='列出对象存储（项目配置 storage）中的版本')
 
     args = parser.parse_args()
 
@@ -933,6 +6337,16 @@ def main():
         'backup': cmd_backup,
         'restore': cmd_restore,
         'versions': cmd_versions,
+        'verify': cmd_verify,
+        'prune': cmd_prune,
+        'extract': cmd_extract,
+        'cat': cmd_cat,
+        'bench-codecs': cmd_bench_codecs,
+        'bench-transfer': cmd_bench_transfer,
+        'bench-encrypt': cmd_bench_encrypt,
+        'daemon': cmd_daemon,
+        'stats': cmd_stats,
+        'metrics': cmd_metrics,
     }
 
     if args.command in commands:
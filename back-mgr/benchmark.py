@@ -0,0 +1,496 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+back-mgr 基准测试
+
+在本机用假的 ssh（直接在本地 sh -c 执行“远程”命令）和假的 mysqldump/mysql 代替真实服务器，
+生成指定形态的合成项目目录和 SQL 导出，端到端测量 create_backup、restore（完整/差异）、
+list_versions 以及备份中每个阶段的耗时，结果写成 JSON，便于跨版本比较性能回退。
+
+用法:
+  python benchmark.py
+  python benchmark.py --shapes small-files,media --modes stream,staged,sharded --codecs gzip,zstd
+  python benchmark.py --scale 1 --db-mb 256 --rate 50          # 更大的数据量，限速 50MB/s 每连接
+  python benchmark.py --baseline bench-results/bench-old.json  # 与上一次结果比较
+  python benchmark.py --transports subprocess,paramiko         # 两种 SSH 传输跑同一组场景
+  python benchmark.py --shapes '' --transfer-streams 1,2,4,8 --rtt 50  # 50ms 往返延迟下的并行下载吞吐量
+
+paramiko 传输使用本机回环地址上的 paramiko SSH 服务端（同样在本地 sh -c 执行命令）。
+"""
+
+import os
+import sys
+import io
+import json
+import random
+import shutil
+import hashlib
+import platform
+import argparse
+import tempfile
+import subprocess
+import contextlib
+import datetime
+import importlib.util
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from tests.sshd import ParamikoServer, install_ssh_shim, paramiko
+
+# 假 mysqldump / pg_dump: 输出 BENCH_DB_MB 大小的确定性 SQL
+DUMP_SHIM = '''#!{python}
+import os, random, sys
+size = int(float(os.environ.get('BENCH_DB_MB') or 16) * 1024 * 1024)
+rng = random.Random(42)
+words = ['alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot', 'golf', 'hotel', 'india', 'juliet',
+         'kilo', 'lima', 'mike', 'november', 'oscar', 'papa', 'quebec', 'romeo', 'sierra', 'tango']
+out = sys.stdout
+out.write('-- synthetic dump\\nCREATE TABLE events (id INT, user VARCHAR(32), note TEXT, amount DECIMAL(10,2));\\n')
+written, row = 0, 0
+while written < size:
+    values = []
+    for _ in range(200):
+        note = ' '.join(rng.choice(words) for _ in range(10))
+        values.append(f"({{row}},'user{{row % 5000}}','{{note}}',{{rng.randint(0, 99999) / 100}})")
+        row += 1
+    line = 'INSERT INTO events VALUES ' + ','.join(values) + ';\\n'
+    out.write(line)
+    written += len(line)
+'''
+
+# 假 mysql / psql: 读完导入数据
+LOAD_SHIM = '''#!/bin/sh
+exec cat > /dev/null
+'''
+
+WORDS = [b'the', b'backup', b'server', b'config', b'value', b'request', b'user', b'error', b'cache',
+         b'session', b'render', b'template', b'static', b'handler', b'module', b'index', b'return']
+
+# 备份模式对应的项目配置
+MODES = {
+    'stream': {'archiveMode': 'stream'},
+    'stream-noindex': {'archiveMode': 'stream', 'archiveIndex': False},
+    'stream-encrypted': {'archiveMode': 'stream', 'encryptSensitive': True},
+    'staged': {'archiveMode': 'staged'},
+    'sharded': {'archiveMode': 'sharded'},
+    'dedup': {'repoFormat': 'dedup'},
+    'dedup-encrypted': {'repoFormat': 'dedup', 'encryptSensitive': True},
+    'incremental': {'incrementalMode': 'tar'},
+    'incremental-agent': {'incrementalMode': 'tar', 'remoteAgent': True},
+    # 不复用 SSH 连接（--no-multiplex），与同名模式比较握手开销
+    'stream-nomux': {'archiveMode': 'stream', 'sshMultiplex': False},
+    'staged-nomux': {'archiveMode': 'staged', 'sshMultiplex': False},
+    'incremental-nomux': {'incrementalMode': 'tar', 'sshMultiplex': False},
+}
+
+# 与基线比较的指标
+COMPARE_METRICS = [
+    ('backup', 'duration'),
+    ('backupIncremental', 'duration'),
+    ('listVersions', 'duration'),
+    ('restore', 'duration'),
+    ('restoreDelta', 'duration'),
+]
+
+
+def text_block(rng: random.Random, size: int) -> bytes:
+    """可压缩的文本数据"""
+    parts = []
+    total = 0
+    while total < size:
+        word = rng.choice(WORDS)
+        parts.append(word)
+        total += len(word) + 1
+    return b' '.join(parts)[:size]
+
+
+def make_small_files(root: Path, scale: float, rng: random.Random):
+    """大量小文本文件（每目录 100 个，0.5~8KB）"""
+    count = max(100, int(20000 * scale))
+    for i in range(count):
+        path = root / f'src/mod{i // 100:04d}/file{i:06d}.txt'
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(text_block(rng, rng.randint(512, 8192)))
+
+
+def make_huge_files(root: Path, scale: float, rng: random.Random):
+    """少量大文件（可压缩，由重复的文本块加随机前缀组成）"""
+    size = max(4, int(256 * scale)) * 1024 * 1024
+    block = text_block(rng, 1024 * 1024 - 16)
+    (root / 'data').mkdir(parents=True, exist_ok=True)
+    for i in range(2):
+        with open(root / f'data/huge{i}.log', 'wb') as f:
+            for _ in range(size // (1024 * 1024)):
+                f.write(rng.getrandbits(128).to_bytes(16, 'big') + block)
+
+
+def make_media(root: Path, scale: float, rng: random.Random):
+    """不可压缩的媒体文件（随机数据，每个 8MB）"""
+    (root / 'media').mkdir(parents=True, exist_ok=True)
+    for i in range(max(2, int(32 * scale))):
+        (root / f'media/video{i:03d}.mp4').write_bytes(os.urandom(8 * 1024 * 1024))
+
+
+def make_mixed(root: Path, scale: float, rng: random.Random):
+    """小文件、大文件和媒体文件各占一部分"""
+    make_small_files(root, scale / 2, rng)
+    make_huge_files(root, scale / 4, rng)
+    make_media(root, scale / 4, rng)
+
+
+SHAPES = {
+    'small-files': make_small_files,
+    'huge-files': make_huge_files,
+    'media': make_media,
+    'mixed': make_mixed,
+}
+
+
+def tree_digest(root: Path) -> Dict[str, str]:
+    """目录树中每个文件的 SHA-256（用于确认还原结果）"""
+    digests = {}
+    for path in sorted(root.rglob('*')):
+        if path.is_file() and not path.is_symlink():
+            digests[path.relative_to(root).as_posix()] = hashlib.sha256(path.read_bytes()).hexdigest()
+    return digests
+
+
+def tree_size(root: Path) -> Dict[str, int]:
+    files = [p for p in root.rglob('*') if p.is_file()]
+    return {'files': len(files), 'bytes': sum(p.stat().st_size for p in files)}
+
+
+def mutate(root: Path, rng: random.Random, fraction: float = 0.01):
+    """修改约 1% 的文件，新增一个文件并删除一个文件（模拟两次备份之间的变化）"""
+    files = sorted(p for p in root.rglob('*') if p.is_file())
+    for path in rng.sample(files, max(1, int(len(files) * fraction))):
+        with open(path, 'ab') as f:
+            f.write(text_block(rng, 4096))
+    (root / f'new-{rng.randint(0, 1 << 30)}.txt').write_bytes(text_block(rng, 10000))
+    if len(files) > 1:
+        files[0].unlink()
+
+
+def next_second():
+    """版本目录按秒命名，两次备份之间等到下一秒"""
+    time.sleep(1.01 - time.time() % 1)
+
+
+class Benchmark:
+    """基准测试运行器"""
+
+    def __init__(self, args):
+        self.args = args
+        self.workdir = Path(args.workdir or tempfile.mkdtemp(prefix='back-mgr-bench-')).resolve()
+        self.bin_dir = self.workdir / 'bin'
+        self.bm = None
+        self.verbose = args.verbose
+        self.paramiko_server = None
+
+    def setup(self):
+        """写入假命令、设置环境变量并加载 back-mgr（配置目录位于工作目录内）"""
+        self.bin_dir.mkdir(parents=True, exist_ok=True)
+        install_ssh_shim(self.bin_dir)
+        shims = {'mysqldump': DUMP_SHIM, 'pg_dump': DUMP_SHIM, 'mysql': LOAD_SHIM, 'psql': LOAD_SHIM}
+        for name, content in shims.items():
+            path = self.bin_dir / name
+            path.write_text(content.replace('{python}', sys.executable, 1).replace('{{', '{').replace('}}', '}'))
+            path.chmod(0o755)
+
+        os.environ['PATH'] = f'{self.bin_dir}{os.pathsep}{os.environ["PATH"]}'
+        os.environ['HOME'] = str(self.workdir / 'home')
+        os.environ['BENCH_DB_MB'] = str(self.args.db_mb)
+        os.environ['BENCH_RATE'] = str(self.args.rate or '')
+        os.environ['BENCH_RTT'] = str(self.args.rtt or '')
+        os.environ.pop('BACKMGR_METRICS_FILE', None)
+
+        if 'paramiko' in self.transports():
+            self.paramiko_server = ParamikoServer(Path(os.environ['HOME']))
+
+        script = Path(self.args.script or Path(__file__).with_name('back-mgr.py')).resolve()
+        spec = importlib.util.spec_from_file_location('back_mgr', script)
+        self.bm = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(self.bm)
+
+    def transports(self) -> List[str]:
+        """要测试的 SSH 传输（本机没有 paramiko 时跳过 paramiko）"""
+        transports = [t for t in self.args.transports.split(',') if t]
+        if 'paramiko' in transports and paramiko is None:
+            print("跳过 paramiko: 未安装 paramiko")
+            transports.remove('paramiko')
+        return transports
+
+    @contextlib.contextmanager
+    def quiet(self):
+        """屏蔽 back-mgr 的终端输出（--verbose 时保留）"""
+        if self.verbose:
+            yield
+            return
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield
+
+    def timed(self, func, *args, **kwargs) -> Dict:
+        start = time.perf_counter()
+        with self.quiet():
+            ok = func(*args, **kwargs)
+        return {'ok': bool(ok) if not isinstance(ok, list) else True,
+                'duration': round(time.perf_counter() - start, 3)}
+
+    def run(self) -> Dict:
+        self.setup()
+        codecs = [c for c in self.args.codecs.split(',') if c]
+        available = [c for c in codecs if c == 'gzip' or shutil.which(c)]
+        for codec in set(codecs) - set(available):
+            print(f"跳过 {codec}: 本机没有该命令")
+
+        transports = self.transports()
+        results = []
+        for shape in filter(None, self.args.shapes.split(',')):
+            source = self.workdir / 'source' / shape / 'app'
+            print(f"生成 {shape} ...", flush=True)
+            SHAPES[shape](source, self.args.scale, random.Random(shape))
+            for mode in self.args.modes.split(','):
+                for codec in available:
+                    for transport in transports:
+                        print(f"  {shape} / {mode} / {codec} / {transport}", flush=True)
+                        results.append(self.run_scenario(shape, source, mode, codec, transport))
+
+        transfer = []
+        if self.args.transfer_streams:
+            streams = [int(n) for n in self.args.transfer_streams.split(',')]
+            for transport in transports:
+                print(f"  并行下载 {self.args.transfer_mb}MB / {transport}", flush=True)
+                transfer += self.run_transfer(streams, transport)
+
+        return {
+            'tool': 'back-mgr',
+            'commit': self.git_commit(),
+            'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'settings': {
+                'shapes': self.args.shapes, 'modes': self.args.modes, 'codecs': self.args.codecs,
+                'transports': ','.join(transports),
+                'scale': self.args.scale, 'dbMb': self.args.db_mb, 'rate': self.args.rate, 'rtt': self.args.rtt,
+            },
+            'results': results,
+            'transfer': transfer,
+        }
+
+    def run_scenario(self, shape: str, source: Path, mode: str, codec: str,
+                     transport: str = 'subprocess') -> Dict:
+        """一个场景: 两次备份（第二次在少量修改之后）、列出版本、完整还原、差异还原"""
+        name = f'{shape}-{mode}-{codec}-{transport}'
+        remote = self.workdir / 'remote' / name / 'app'
+        local = self.workdir / 'local' / name
+        shutil.copytree(source, remote, symlinks=True)
+        project = {
+            'name': name, 'host': 'bench', 'user': 'bench', 'port': 22,
+            'remotePath': str(remote), 'localPath': str(local), 'exclude': [],
+            'databases': [{'type': 'mysql', 'name': 'benchdb', 'user': 'root'}] if self.args.db_mb else [],
+            'archiveCodec': codec,
+            'encryptSensitive': False,
+            **MODES[mode],
+        }
+        if transport == 'paramiko':
+            project.update(host='127.0.0.1', port=self.paramiko_server.port, sshTransport='paramiko')
+        incremental = mode.startswith('incremental')
+        rng = random.Random(name)
+        result = {'shape': shape, 'mode': mode, 'codec': codec, 'transport': transport,
+                  'source': tree_size(remote)}
+
+        result['backup'] = self.backup(project, incremental)
+        mutate(remote, rng)
+        result['backupIncremental'] = self.backup(project, incremental)
+
+        restore_manager = self.bm.RestoreManager(project)
+        result['listVersions'] = self.timed(restore_manager.list_versions)
+        result['listVersions']['recomputeDuration'] = self.timed(restore_manager.list_versions, recompute=True)['duration']
+
+        expected = tree_digest(remote)
+        mutate(remote, rng)
+        result['restore'] = self.restore(project)
+        result['restore']['ok'] = result['restore']['ok'] and tree_digest(remote) == expected
+        self.cleanup_restore(remote)
+
+        mutate(remote, rng)
+        result['restoreDelta'] = self.restore(project, files_only=True, delta=True)
+        result['restoreDelta']['ok'] = result['restoreDelta']['ok'] and tree_digest(remote) == expected
+
+        if not self.args.keep:
+            shutil.rmtree(remote.parent, ignore_errors=True)
+            shutil.rmtree(local, ignore_errors=True)
+        return result
+
+    def run_transfer(self, streams: List[int], transport: str) -> List[Dict]:
+        """bench-transfer: 不同并行连接数下分段下载同一个随机文件的吞吐量"""
+        project = {'name': f'transfer-{transport}', 'host': 'bench', 'user': 'bench', 'port': 22,
+                   'remotePath': str(self.workdir), 'localPath': str(self.workdir / 'local' / 'transfer'),
+                   'databases': []}
+        if transport == 'paramiko':
+            project.update(host='127.0.0.1', port=self.paramiko_server.port, sshTransport='paramiko')
+        with self.quiet():
+            results = self.bm.BackupManager(project).benchmark_transfer(self.args.transfer_mb, streams)
+        return [{'transport': transport, 'streams': r['streams'], 'seconds': round(r['seconds'], 3),
+                 'speed': round(r['speed'], 1)} for r in results]
+
+    def backup(self, project: Dict, incremental: bool) -> Dict:
+        next_second()
+        manager = self.bm.BackupManager(project)
+        result = self.timed(manager.create_backup, incremental=incremental)
+        result['codec'] = manager.files_info.get('codec')
+        result['sshCalls'] = manager.ssh.calls
+        result['bytes'] = sum(p['bytes'] for p in manager.phases)
+        result['phases'] = [{k: p[k] for k in ('name', 'success', 'bytes', 'duration', 'mbps')}
+                            for p in manager.phases]
+        return result
+
+    def restore(self, project: Dict, **options) -> Dict:
+        manager = self.bm.RestoreManager(project)
+        result = self.timed(manager.restore, **options)
+        result['sshCalls'] = manager.ssh.calls
+        return result
+
+    @staticmethod
+    def cleanup_restore(remote: Path):
+        """删除完整还原留下的 <remotePath>.backup.<时间> 目录"""
+        for path in remote.parent.glob(f'{remote.name}.backup.*'):
+            shutil.rmtree(path, ignore_errors=True)
+
+    @staticmethod
+    def git_commit() -> Optional[str]:
+        try:
+            result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                    cwd=Path(__file__).parent)
+        except OSError:
+            return None
+        return result.stdout.strip() or None
+
+    def close(self):
+        if self.paramiko_server:
+            self.paramiko_server.close()
+        if not self.args.keep and not self.args.workdir:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+def scenario_key(r: Dict) -> tuple:
+    """场景的标识（旧结果没有 transport 字段，视为 subprocess）"""
+    return r['shape'], r['mode'], r['codec'], r.get('transport', 'subprocess')
+
+
+def scenario_label(r: Dict) -> str:
+    label = f"{r['shape']} / {r['mode']} / {r['codec']}"
+    return label if r.get('transport', 'subprocess') == 'subprocess' else f"{label} / {r['transport']}"
+
+
+def print_summary(report: Dict):
+    if report['results']:
+        print()
+        print('场景' + ' ' * 37 + '备份     增量   列版本     还原 差异还原  结果')
+    for r in report['results']:
+        ok = all(r[key]['ok'] for key in ('backup', 'backupIncremental', 'restore', 'restoreDelta'))
+        cells = ''.join(f"{r[key]['duration']:>8.2f}s" for key, _ in COMPARE_METRICS)
+        print(f"{scenario_label(r):<36}{cells}  {'OK' if ok else 'FAIL'}")
+    if report.get('transfer'):
+        print()
+        print(f"并行下载（往返 {report['settings'].get('rtt') or 0:g}ms）:")
+        print(f"  {'传输':<12} {'连接数':<6} {'耗时':>8} {'速度':>12} {'加速比':>8}")
+        base = {}
+        for r in report['transfer']:
+            base.setdefault(r['transport'], r['speed'])
+            print(f"  {r['transport']:<12} {r['streams']:<6} {r['seconds']:>7.2f}s {r['speed']:>8.1f}MB/s "
+                  f"{r['speed'] / base[r['transport']]:>7.2f}x")
+
+
+def compare(report: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """与基线比较，返回变慢超过 threshold 的指标"""
+    previous = {scenario_key(r): r for r in baseline.get('results', [])}
+    regressions = []
+    print()
+    print(f"与基线比较（{baseline.get('commit') or '?'} @ {baseline.get('timestamp')}）:")
+    for r in report['results']:
+        old = previous.get(scenario_key(r))
+        if not old:
+            continue
+        for key, field in COMPARE_METRICS:
+            before, after = old.get(key, {}).get(field), r[key][field]
+            if not before:
+                continue
+            change = (after - before) / before
+            flag = ''
+            if change > threshold and after - before > 0.05:
+                flag = '  <-- 变慢'
+                regressions.append(f"{scenario_label(r)} {key}: {before:.2f}s -> {after:.2f}s")
+            print(f"  {scenario_label(r):<36} {key:<18} {before:>8.2f}s -> {after:>8.2f}s "
+                  f"({change:+.0%}){flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='back-mgr 基准测试（本机假 ssh，合成数据）')
+    parser.add_argument('--shapes', default='small-files,huge-files,media',
+                        help=f"数据形态，逗号分隔: {', '.join(SHAPES)} [默认: small-files,huge-files,media]")
+    parser.add_argument('--modes', default='stream,staged,sharded,dedup,incremental',
+                        help=f"备份模式，逗号分隔: {', '.join(MODES)}")
+    parser.add_argument('--codecs', default='gzip,zstd', help='压缩格式，逗号分隔（本机没有的跳过）[默认: gzip,zstd]')
+    parser.add_argument('--transports', default='subprocess',
+                        help='SSH 传输，逗号分隔: subprocess, paramiko [默认: subprocess]')
+    parser.add_argument('--scale', type=float, default=0.1, help='数据量系数，1 约为每种形态 100~512MB [默认: 0.1]')
+    parser.add_argument('--db-mb', type=float, default=16, help='合成 SQL 导出的大小 (MB)，0 表示不备份数据库 [默认: 16]')
+    parser.add_argument('--rate', type=float, help='每个 SSH 连接的输出限速 (MB/s)，模拟网络带宽')
+    parser.add_argument('--rtt', type=float,
+                        help='模拟的往返延迟 (毫秒): 新连接约 5 个往返，每个往返每个连接最多发送 2MB（只作用于假 ssh）')
+    parser.add_argument('--transfer-streams', help='同时测试 bench-transfer: 并行连接数，逗号分隔，如 1,2,4,8')
+    parser.add_argument('--transfer-mb', type=int, default=64, help='bench-transfer 测试文件大小 (MB) [默认: 64]')
+    parser.add_argument('--output', help='结果 JSON 路径 [默认: bench-results/bench-<时间>.json]')
+    parser.add_argument('--baseline', help='与之比较的上一次结果 JSON')
+    parser.add_argument('--threshold', type=float, default=0.2, help='判定为变慢的比例 [默认: 0.2]')
+    parser.add_argument('--script', help='被测的 back-mgr.py [默认: 同目录]')
+    parser.add_argument('--workdir', help='工作目录（默认临时目录，结束后删除）')
+    parser.add_argument('--keep', action='store_true', help='保留生成的数据和备份')
+    parser.add_argument('-v', '--verbose', action='store_true', help='显示 back-mgr 的输出')
+    args = parser.parse_args()
+
+    for shape in filter(None, args.shapes.split(',')):
+        if shape not in SHAPES:
+            parser.error(f"未知的数据形态: {shape}")
+    for mode in args.modes.split(','):
+        if mode not in MODES:
+            parser.error(f"未知的备份模式: {mode}")
+    for transport in args.transports.split(','):
+        if transport not in ('subprocess', 'paramiko'):
+            parser.error(f"未知的 SSH 传输: {transport}")
+    if args.transfer_streams and not all(n.isdigit() and int(n) > 0 for n in args.transfer_streams.split(',')):
+        parser.error(f"无效的连接数列表: {args.transfer_streams}")
+
+    bench = Benchmark(args)
+    try:
+        report = bench.run()
+    finally:
+        bench.close()
+
+    output = Path(args.output or f"bench-results/bench-{datetime.datetime.now():%Y%m%d_%H%M%S}.json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    print_summary(report)
+    print(f"\n结果已写入 {output}")
+
+    failed = [r for r in report['results']
+              if not all(r[key]['ok'] for key in ('backup', 'backupIncremental', 'restore', 'restoreDelta'))]
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} 项变慢超过 {args.threshold:.0%}")
+            sys.exit(1)
+    if failed:
+        print(f"\n{len(failed)} 个场景的备份或还原失败")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
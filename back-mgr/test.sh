@@ -53,6 +53,9 @@ run_test "测试 backup 命令帮助" "python back-mgr.py backup --help"
 # 测试 restore 帮助
 run_test "测试 restore 命令帮助" "python back-mgr.py restore --help"
 
+# 单元测试（tests/ 目录，只依赖标准库；未安装 cryptography 时跳过加密相关用例）
+run_test "运行单元测试" "python -m unittest discover -s tests -t ."
+
 echo "=========================================="
 echo "  基础测试完成"
 echo "=========================================="
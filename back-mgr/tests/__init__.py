@@ -0,0 +1,35 @@
+"""back-mgr 测试
+
+back-mgr.py 和 back-mgr-agent.py 的文件名含连字符，不能直接 import，
+用 load_back_mgr() / load_agent() 按路径加载。
+运行: python -m unittest discover -s back-mgr/tests -t back-mgr
+"""
+
+import importlib.util
+from pathlib import Path
+
+BACK_MGR = Path(__file__).resolve().parent.parent / 'back-mgr.py'
+AGENT = BACK_MGR.with_name('back-mgr-agent.py')
+
+_module = None
+_agent = None
+
+
+def load_back_mgr():
+    """加载 back-mgr.py（只加载一次）"""
+    global _module
+    if _module is None:
+        spec = importlib.util.spec_from_file_location('back_mgr', BACK_MGR)
+        _module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(_module)
+    return _module
+
+
+def load_agent():
+    """加载远程文件索引代理 back-mgr-agent.py（只加载一次）"""
+    global _agent
+    if _agent is None:
+        spec = importlib.util.spec_from_file_location('back_mgr_agent', AGENT)
+        _agent = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(_agent)
+    return _agent
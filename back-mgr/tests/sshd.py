@@ -0,0 +1,172 @@
+"""测试用的 SSH 对端（测试和 benchmark.py 共用）
+
+SSH_SHIM 是假的 ssh 命令，直接在本机 sh -c 执行“远程”命令，供 SSHConnection 使用；
+ParamikoServer 是本机回环地址上的 paramiko SSH 服务端，供 ParamikoConnection 使用。
+两者都在本地执行命令，同一组用例可以在两种传输上运行。
+"""
+
+import contextlib
+import socket
+import subprocess
+import sys
+import threading
+from pathlib import Path
+
+try:
+    import paramiko
+except ImportError:
+    paramiko = None
+
+# 假 ssh: 跳过选项，-O（控制主连接）直接成功，其余在本机执行。
+# 设置 BENCH_RATE（MB/s）时按每个连接限速输出，用于观察并行连接的效果；
+# 设置 BENCH_RTT（毫秒）时模拟链路延迟: 新连接（ControlPath=none、未复用或建立主连接）
+# 先等待约 5 个往返（TCP 握手、密钥交换、认证、打开会话），复用主连接的通道等待 1 个往返，
+# 输出每个往返最多发送一个窗口（BENCH_WINDOW_KB，默认 2048，与 OpenSSH 通道窗口相同）
+SSH_SHIM = '''#!{python}
+import os, subprocess, sys, time
+args = sys.argv[1:]
+with_value = set('bcDEeFIiJLlmOoPpQRSWw')
+control = master = False
+options = {}
+i = 0
+while i < len(args) and args[i].startswith('-'):
+    flag = args[i][1:]
+    if flag[0] in with_value:
+        value = flag[1:] or args[i + 1]
+        control = control or flag[0] == 'O'
+        if flag[0] == 'o':
+            key, _, value = value.partition('=')
+            options[key.lower()] = value
+        i += 1 if len(flag) > 1 else 2
+    else:
+        master = master or 'N' in flag
+        i += 1
+if control:
+    sys.exit(0)
+rtt = float(os.environ.get('BENCH_RTT') or 0) / 1000
+new = options.get('controlpath', 'none') == 'none' or options.get('controlmaster', 'no') != 'no'
+time.sleep(rtt * (5 if new else 1))
+if master:
+    sys.exit(0)
+cmd = ' '.join(args[i + 1:])
+rate = float(os.environ.get('BENCH_RATE') or 0) * 1024 * 1024
+window = float(os.environ.get('BENCH_WINDOW_KB') or 2048) * 1024
+if not rate and not rtt:
+    sys.exit(subprocess.call(['sh', '-c', cmd]))
+proc = subprocess.Popen(['sh', '-c', cmd], stdout=subprocess.PIPE)
+start, sent = time.monotonic(), 0
+while True:
+    data = proc.stdout.read(65536)
+    if not data:
+        break
+    sys.stdout.buffer.write(data)
+    sys.stdout.buffer.flush()
+    sent += len(data)
+    due = max(sent / rate if rate else 0, sent // window * rtt)
+    ahead = due - (time.monotonic() - start)
+    if ahead > 0:
+        time.sleep(ahead)
+sys.exit(proc.wait())
+'''
+
+def install_ssh_shim(bin_dir: Path) -> Path:
+    """把假 ssh 写入 bin_dir（调用方负责把 bin_dir 放到 PATH 最前面）"""
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    path = bin_dir / 'ssh'
+    path.write_text(SSH_SHIM.replace('{python}', sys.executable, 1))
+    path.chmod(0o755)
+    return path
+
+
+class ParamikoServer:
+    """本机回环地址上的 paramiko SSH 服务端（sshTransport=paramiko 的测试对端）
+
+    接受任意公钥，exec 请求在本机 sh -c 执行；客户端密钥和 known_hosts 写入 home/.ssh，
+    客户端照常校验主机密钥。
+    """
+
+    def __init__(self, home: Path):
+        self.host_key = paramiko.ECDSAKey.generate()
+        ssh_dir = home / '.ssh'
+        ssh_dir.mkdir(parents=True, exist_ok=True)
+        if not (ssh_dir / 'id_ecdsa').exists():
+            paramiko.ECDSAKey.generate().write_private_key_file(str(ssh_dir / 'id_ecdsa'))
+        self.sock = socket.socket()
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(64)
+        self.port = self.sock.getsockname()[1]
+        with open(ssh_dir / 'known_hosts', 'a', encoding='utf-8') as f:
+            f.write(f'[127.0.0.1]:{self.port} {self.host_key.get_name()} {self.host_key.get_base64()}\n')
+        self.transports = []
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            transport = paramiko.Transport(conn)
+            transport.add_server_key(self.host_key)
+            transport.start_server(server=_ExecServer())
+            self.transports.append(transport)
+
+    def close(self):
+        self.sock.close()
+        for transport in self.transports:
+            transport.close()
+
+
+if paramiko:
+    class _ExecServer(paramiko.ServerInterface):
+        """接受任意公钥，exec 请求在后台线程中用 sh -c 执行"""
+
+        def get_allowed_auths(self, username):
+            return 'publickey'
+
+        def check_auth_publickey(self, username, key):
+            return paramiko.AUTH_SUCCESSFUL
+
+        def check_channel_request(self, kind, chanid):
+            return paramiko.OPEN_SUCCEEDED
+
+        def check_channel_exec_request(self, channel, command):
+            threading.Thread(target=self._run, args=(channel, command.decode('utf-8')), daemon=True).start()
+            return True
+
+        @staticmethod
+        def _run(channel, command: str):
+            proc = subprocess.Popen(['sh', '-c', command], stdin=subprocess.PIPE,
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+            def feed():
+                try:
+                    while True:
+                        data = channel.recv(65536)
+                        if not data:
+                            break
+                        proc.stdin.write(data)
+                except (OSError, EOFError):
+                    pass
+                finally:
+                    with contextlib.suppress(OSError):
+                        proc.stdin.close()
+
+            def errors():
+                for data in iter(lambda: proc.stderr.read1(65536), b''):
+                    channel.sendall_stderr(data)
+
+            threads = [threading.Thread(target=feed, daemon=True), threading.Thread(target=errors)]
+            for thread in threads:
+                thread.start()
+            try:
+                for data in iter(lambda: proc.stdout.read1(65536), b''):
+                    channel.sendall(data)
+            except (OSError, EOFError):
+                proc.kill()
+            threads[1].join()
+            returncode = proc.wait()
+            with contextlib.suppress(OSError, EOFError):
+                channel.send_exit_status(returncode)
+                channel.shutdown_write()
+                channel.close()
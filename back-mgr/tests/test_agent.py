@@ -0,0 +1,182 @@
+"""远程文件索引代理: FileIndex 刷新、write_changes 输出与 back-mgr 的解析（往返）"""
+
+import io
+import os
+import shutil
+import struct
+import hashlib
+import tempfile
+import unittest
+import zlib
+from pathlib import Path
+from unittest import mock
+
+from tests import load_agent, load_back_mgr
+
+agent = load_agent()
+bm = load_back_mgr()
+
+MTIME = 1700000000
+
+
+class FileIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        base = Path(self.tmp.name)
+        self.root = base / 'proj'
+        state_dir = base / 'state'
+        state_dir.mkdir()
+        patcher = mock.patch.object(agent, 'STATE_DIR', str(state_dir))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.exclude = ['node_modules/**']
+        self.tick = 0
+
+        self.write('a.txt', b'a')
+        self.write('sub/b.txt', b'bb')
+        self.write('sub/deep/c.txt', b'ccc')
+        self.write('node_modules/x/skip.js', b'skip')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, rel: str, data: bytes, mtime: int = MTIME):
+        path = self.root / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+        os.utime(path, (mtime, mtime))
+
+    def bump(self, rel: str = ''):
+        """显式推进目录的 mtime（文件系统时间精度不足时，同一时刻内的变化不会改变目录 mtime）"""
+        self.tick += 1
+        path = self.root / rel
+        st = path.stat()
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + self.tick * 1000000000))
+
+    def run_agent(self, since: int = 0, state_id: str = '', **options) -> dict:
+        """刷新索引（与代理的 main 相同: load、refresh、save），把输出交给 back-mgr 解析"""
+        index = agent.FileIndex(str(self.root), self.exclude)
+        index.load()
+        stats = index.refresh(**options)
+        index.save()
+        out = io.BytesIO()
+        index.write_changes(out, since, state_id, stats)
+        return bm.SSHConnection.parse_agent_output(out.getvalue())
+
+    def test_full_listing(self):
+        result = self.run_agent()
+        self.assertTrue(result['full'])
+        self.assertEqual(result['generation'], 1)
+        self.assertEqual(result['files'], {'a.txt': [1, MTIME, None], 'sub/b.txt': [2, MTIME, None],
+                                           'sub/deep/c.txt': [3, MTIME, None]})
+        self.assertEqual(result['deleted'], [])
+        self.assertEqual(result['dirs'], {'sub', 'sub/deep'})
+        self.assertTrue(result['stats']['full'])
+
+    def test_changes_since_generation(self):
+        first = self.run_agent()
+        root_mtime = self.root.stat().st_mtime_ns
+
+        # 新增、删除（所在目录 mtime 变化），以及在 mtime 未变的目录中就地修改
+        self.write('sub/new.txt', b'new', MTIME + 10)
+        self.bump('sub')
+        (self.root / 'sub/deep/c.txt').unlink()
+        self.bump('sub/deep')
+        self.write('a.txt', b'changed', MTIME + 20)
+        os.utime(self.root, ns=(root_mtime, root_mtime))
+
+        second = self.run_agent(first['generation'], first['state'])
+        self.assertFalse(second['full'])
+        self.assertEqual(second['state'], first['state'])
+        self.assertEqual(second['generation'], first['generation'] + 1)
+        self.assertEqual(second['files'], {'sub/new.txt': [3, MTIME + 10, None], 'a.txt': [7, MTIME + 20, None]})
+        self.assertEqual(second['deleted'], ['sub/deep/c.txt'])
+        self.assertEqual(second['dirs'], {'sub', 'sub/deep'})
+        self.assertEqual(second['stats']['rescanned'], 2)
+
+        # 没有变化时只输出目录
+        third = self.run_agent(second['generation'], second['state'])
+        self.assertEqual((third['files'], third['deleted']), ({}, []))
+
+    def test_quick_scan_misses_in_place_modification(self):
+        first = self.run_agent()
+        self.write('sub/b.txt', b'bbbb', MTIME + 5)
+
+        quick = self.run_agent(first['generation'], first['state'], quick=True)
+        self.assertEqual(quick['files'], {})
+        self.assertEqual(quick['stats']['checked'], 0)
+
+        full = self.run_agent(quick['generation'], quick['state'], full=True)
+        self.assertFalse(full['full'])
+        self.assertEqual(full['files'], {'sub/b.txt': [4, MTIME + 5, None]})
+
+    def test_rename_directory(self):
+        first = self.run_agent()
+        (self.root / 'sub').rename(self.root / 'moved')
+        self.bump()
+
+        result = self.run_agent(first['generation'], first['state'])
+        self.assertFalse(result['full'])
+        self.assertEqual(sorted(result['deleted']), ['sub/b.txt', 'sub/deep/c.txt'])
+        self.assertEqual(result['files'], {'moved/b.txt': [2, MTIME, None], 'moved/deep/c.txt': [3, MTIME, None]})
+        self.assertEqual(result['dirs'], {'moved', 'moved/deep'})
+
+    def test_hash(self):
+        result = self.run_agent(do_hash=True)
+        self.assertEqual(result['files']['sub/b.txt'][2], hashlib.sha256(b'bb').hexdigest())
+
+        self.write('sub/b.txt', b'bbb', MTIME + 1)
+        changed = self.run_agent(result['generation'], result['state'], do_hash=True)
+        self.assertEqual(changed['files'], {'sub/b.txt': [3, MTIME + 1, hashlib.sha256(b'bbb').hexdigest()]})
+
+    def test_full_listing_past_tombstone_floor(self):
+        first = self.run_agent()
+        with mock.patch.object(agent, 'TOMBSTONE_GENERATIONS', 2):
+            (self.root / 'a.txt').unlink()
+            self.bump()
+            for _ in range(3):
+                latest = self.run_agent(first['generation'], first['state'])
+
+        # 删除记录已被清理，只能输出完整清单（完整清单不含删除记录）
+        self.assertTrue(latest['full'])
+        self.assertEqual(sorted(latest['files']), ['sub/b.txt', 'sub/deep/c.txt'])
+        self.assertEqual(latest['deleted'], [])
+
+        ahead = self.run_agent(latest['generation'] + 5, latest['state'])
+        self.assertTrue(ahead['full'])
+
+    def test_state_id_mismatch(self):
+        first = self.run_agent()
+        other = self.run_agent(first['generation'], '00' * 16)
+        self.assertTrue(other['full'])
+        self.assertEqual(len(other['files']), 3)
+
+        # 索引被删除后重建，ID 变化，旧的代数不再有意义
+        shutil.rmtree(agent.STATE_DIR)
+        os.makedirs(agent.STATE_DIR)
+        rebuilt = self.run_agent(other['generation'], other['state'])
+        self.assertNotEqual(rebuilt['state'], other['state'])
+        self.assertTrue(rebuilt['full'])
+        self.assertEqual(rebuilt['generation'], 1)
+
+    def test_non_utf8_names(self):
+        name = os.fsdecode(b'caf\xe9.txt')
+        self.write(name, b'x')
+        result = self.run_agent()
+        self.assertEqual(result['files'][name], [1, MTIME, None])
+
+
+class ParseAgentOutputTest(unittest.TestCase):
+
+    def test_rejects_malformed_output(self):
+        header = b'BMGA\x01\x00' + bytes(16) + struct.pack('>QI', 1, 2) + b'{}'
+        for output in (b'not zlib', zlib.compress(b'XXXX' + bytes(40)),
+                       zlib.compress(header + b'?' + struct.pack('>I', 0)),
+                       zlib.compress(header + b'+' + struct.pack('>I', 1) + b'a')):
+            with self.assertRaises(ValueError):
+                bm.SSHConnection.parse_agent_output(output)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+"""成员索引: IndexedArchiveWriter 解析 tar 头、IndexedArchive 按索引取出成员"""
+
+import io
+import os
+import gzip
+import tarfile
+import hashlib
+import tempfile
+import unittest
+from pathlib import Path
+
+from tests import load_back_mgr
+
+bm = load_back_mgr()
+
+LONG_NAME = 'app/' + '/'.join(['very-long-directory-name'] * 6) + '/file.txt'
+LONG_TARGET = '../' + 'x' * 150
+
+
+def build_tar(fmt: int) -> bytes:
+    """构造包含长文件名、长链接目标、硬链接、空文件和跨块大文件的 tar 流"""
+    members = []
+
+    def add_file(name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = 1700000000
+        members.append((info, data))
+
+    def add_link(name, target, kind):
+        info = tarfile.TarInfo(name)
+        info.type = kind
+        info.linkname = target
+        info.mtime = 1700000000
+        members.append((info, None))
+
+    add_file('app/small.txt', b'hello\n')
+    add_file(LONG_NAME, b'long name\n')
+    add_file('app/empty', b'')
+    add_link('app/lnk', LONG_TARGET, tarfile.SYMTYPE)
+    add_link('app/hard', 'app/small.txt', tarfile.LNKTYPE)
+    add_file('app/文件.txt', 'unicode\n'.encode('utf-8'))
+    add_file('app/big.bin', os.urandom(bm.INDEX_BLOCK_SIZE * 2 + 12345))
+    add_file('app/after.txt', b'after\n')
+
+    out = io.BytesIO()
+    with tarfile.open(fileobj=out, mode='w', format=fmt) as tar:
+        dir_info = tarfile.TarInfo('app')
+        dir_info.type = tarfile.DIRTYPE
+        dir_info.mode = 0o755
+        tar.addfile(dir_info)
+        for info, data in members:
+            tar.addfile(info, io.BytesIO(data) if data is not None else None)
+    return out.getvalue()
+
+
+class IndexedArchiveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp.name) / 'backup.tar.gz'
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, data: bytes, piece: int = 7777) -> dict:
+        """以不对齐的小段写入，覆盖 tar 头跨越多次 write 的情况"""
+        writer = bm.IndexedArchiveWriter(self.path, workers=2)
+        for pos in range(0, len(data), piece):
+            writer.write(data[pos:pos + piece])
+        index = writer.close()
+        self.assertIsNotNone(index)
+        return index
+
+    def extract_member(self, archive, member) -> tarfile.TarFile:
+        out = io.BytesIO()
+        archive.write_members([member], out)
+        out.seek(0)
+        return tarfile.open(fileobj=out, mode='r:')
+
+    def check_format(self, fmt: int):
+        data = build_tar(fmt)
+        index = self.write(data)
+        expected = tarfile.open(fileobj=io.BytesIO(data), mode='r:')
+        expected_members = {m.name: m for m in expected.getmembers()}
+
+        names = [m[0] for m in index['members']]
+        self.assertEqual(names, [m.name for m in expected.getmembers()])
+        self.assertFalse([n for n in names if '@LongLink' in n or 'PaxHeader' in n])
+
+        # 整个文件仍是标准的 tar.gz
+        with gzip.open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+        archive = bm.IndexedArchive(self.path, index)
+        for member in index['members']:
+            name, kind, start, data_offset, size, digest, mtime = member
+            ref = expected_members[name]
+            self.assertEqual(size, ref.size, name)
+            self.assertEqual(mtime, ref.mtime, name)
+            with self.extract_member(archive, member) as tar:
+                (info,) = tar.getmembers()
+                self.assertEqual(info.name, ref.name)
+                self.assertEqual(info.type, ref.type)
+                self.assertEqual(info.linkname, ref.linkname)
+                if ref.isreg():
+                    content = tar.extractfile(info).read()
+                    self.assertEqual(content, expected.extractfile(ref).read())
+                    self.assertEqual(digest, hashlib.sha256(content).hexdigest())
+
+    def test_gnu_format(self):
+        self.check_format(tarfile.GNU_FORMAT)
+
+    def test_pax_format(self):
+        self.check_format(tarfile.PAX_FORMAT)
+
+    def test_long_link_member_starts_at_long_link_header(self):
+        data = build_tar(tarfile.GNU_FORMAT)
+        index = self.write(data)
+        link = next(m for m in index['members'] if m[0] == 'app/lnk')
+        self.assertEqual(link[1], '2')
+        # 'K' 头在成员头之前
+        header = tarfile.TarInfo.frombuf(data[link[2]:link[2] + tarfile.BLOCKSIZE], 'utf-8', 'surrogateescape')
+        self.assertEqual(header.type, tarfile.GNUTYPE_LONGLINK)
+
+    def test_single_byte_writes(self):
+        data = build_tar(tarfile.GNU_FORMAT)
+        small = data[:data.index(b'app/big.bin')]
+        # 截到大文件之前，补上结束块
+        small = small[:len(small) - len(small) % tarfile.BLOCKSIZE - tarfile.BLOCKSIZE]
+        small += tarfile.NUL * tarfile.BLOCKSIZE * 2
+        index = self.write(small, piece=1)
+        self.assertIn('app/lnk', [m[0] for m in index['members']])
+
+    def test_invalid_header(self):
+        writer = bm.IndexedArchiveWriter(self.path)
+        writer.write(b'not a tar header'.ljust(tarfile.BLOCKSIZE, b'x'))
+        self.assertIsNone(writer.close())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+"""分块去重仓库: 切块、去重、读取校验和加密块"""
+
+import io
+import os
+import random
+import tempfile
+import unittest
+from pathlib import Path
+
+from tests import load_back_mgr
+
+bm = load_back_mgr()
+
+
+def sample(size: int, seed: int = 1) -> bytes:
+    rng = random.Random(seed)
+    return bytes(rng.getrandbits(8) for _ in range(size))
+
+
+class ChunkStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name) / 'chunks'
+        self.data = sample(3 * 1024 * 1024) + bytes(2 * 1024 * 1024)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def restore(self, store, stats) -> bytes:
+        out = io.BytesIO()
+        self.assertEqual(store.write_to(stats['chunks'], out), len(self.data))
+        return out.getvalue()
+
+    def test_round_trip_and_dedup(self):
+        store = bm.ChunkStore(self.root)
+        stats = store.ingest(io.BytesIO(self.data))
+        self.assertGreater(len(stats['chunks']), 1)
+        self.assertEqual(stats['size'], len(self.data))
+        self.assertEqual(self.restore(store, stats), self.data)
+
+        again = bm.ChunkStore(self.root).ingest(io.BytesIO(self.data))
+        self.assertEqual(again['chunks'], stats['chunks'])
+        self.assertEqual(again['newChunks'], 0)
+
+    def test_boundaries_realign_after_insert(self):
+        store = bm.ChunkStore(self.root)
+        first = store.ingest(io.BytesIO(self.data))
+        # 在开头插入一个 tar 块，之后的块应重新对齐并复用
+        second = store.ingest(io.BytesIO(bytes(512) + self.data))
+        reused = {d for d, _ in first['chunks']} & {d for d, _ in second['chunks']}
+        self.assertTrue(reused)
+
+    def test_corrupt_chunk(self):
+        store = bm.ChunkStore(self.root)
+        stats = store.ingest(io.BytesIO(self.data))
+        digest, size = stats['chunks'][0]
+        path = store.chunk_path(digest)
+        path.write_bytes(bm.zlib.compress(b'x' * size))
+        with self.assertRaises(IOError):
+            store.read(digest, size)
+
+    @unittest.skipIf(bm.AESGCM is None, 'cryptography 未安装')
+    def test_encrypted_chunks(self):
+        key = os.urandom(32)
+        store = bm.ChunkStore(self.root, key)
+        stats = store.ingest(io.BytesIO(self.data))
+        plain = bm.ChunkStore(Path(self.tmp.name) / 'plain').ingest(io.BytesIO(self.data))
+        # 加密块以 HMAC 命名，不暴露明文哈希
+        self.assertFalse({d for d, _ in stats['chunks']} & {d for d, _ in plain['chunks']})
+        for digest, _ in stats['chunks']:
+            self.assertTrue(store.chunk_path(digest).read_bytes().startswith(bm.CHUNK_ENCRYPTION_MAGIC))
+        self.assertEqual(self.restore(bm.ChunkStore(self.root, key), stats), self.data)
+
+        digest, size = stats['chunks'][0]
+        with self.assertRaises(IOError):
+            bm.ChunkStore(self.root).read(digest, size)
+        with self.assertRaises(IOError):
+            bm.ChunkStore(self.root, os.urandom(32)).read(digest, size)
+
+        path = store.chunk_path(digest)
+        data = bytearray(path.read_bytes())
+        data[-1] ^= 1
+        path.write_bytes(bytes(data))
+        with self.assertRaises(IOError):
+            store.read(digest, size)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,196 @@
+"""调度进程: CronSchedule 解析与 next_after、控制套接字协议、停止时取消排队中的备份"""
+
+import asyncio
+import contextlib
+import datetime
+import io
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+from tests import load_back_mgr
+
+bm = load_back_mgr()
+
+# 2026-10-17 是星期六
+NOW = datetime.datetime(2026, 10, 17, 10, 5, 30)
+
+
+def at(*args) -> datetime.datetime:
+    return datetime.datetime(*args)
+
+
+class CronScheduleTest(unittest.TestCase):
+
+    def next(self, expr: str, t: datetime.datetime = NOW) -> datetime.datetime:
+        return bm.CronSchedule(expr).next_after(t)
+
+    def test_lists_ranges_and_steps(self):
+        self.assertEqual(bm.CronSchedule('0,30 * * * *').minutes, {0, 30})
+        self.assertEqual(bm.CronSchedule('*/15 * * * *').minutes, {0, 15, 30, 45})
+        self.assertEqual(bm.CronSchedule('5/20 * * * *').minutes, {5, 25, 45})
+        self.assertEqual(bm.CronSchedule('10-20/5,59 1-3 * * *').minutes, {10, 15, 20, 59})
+        self.assertEqual(bm.CronSchedule('10-20/5,59 1-3 * * *').hours, {1, 2, 3})
+        self.assertEqual(self.next('0,30 * * * *'), at(2026, 10, 17, 10, 30))
+        self.assertEqual(self.next('0,30 * * * *', at(2026, 10, 17, 10, 30)), at(2026, 10, 17, 11, 0))
+        self.assertEqual(self.next('*/20 9-17/4 * * *'), at(2026, 10, 17, 13, 0))
+
+    def test_names_and_aliases(self):
+        schedule = bm.CronSchedule('0 9 * JAN-mar,Dec mon-fri')
+        self.assertEqual(schedule.months, {1, 2, 3, 12})
+        self.assertEqual(schedule.weekdays, {1, 2, 3, 4, 5})
+        # 周日可写作 0、7 或 sun
+        self.assertEqual(bm.CronSchedule('0 0 * * 7').weekdays, {0})
+        self.assertEqual(bm.CronSchedule('0 0 * * sun,sat').weekdays, {0, 6})
+        self.assertEqual(self.next('0 9 * jan-mar,dec mon-fri'), at(2026, 12, 1, 9, 0))
+        self.assertEqual(self.next('@daily'), at(2026, 10, 18, 0, 0))
+        self.assertEqual(self.next('@weekly'), at(2026, 10, 18, 0, 0))
+        self.assertEqual(self.next('@yearly'), at(2027, 1, 1, 0, 0))
+        self.assertEqual(self.next(' @Hourly '), at(2026, 10, 17, 11, 0))
+
+    def test_day_of_month_or_day_of_week(self):
+        # 日和周都有限制时取并集: 10-19 是周一，早于 11-01
+        self.assertEqual(self.next('0 0 1 * mon'), at(2026, 10, 19, 0, 0))
+        self.assertEqual(self.next('0 0 1 * mon', at(2026, 10, 26, 0, 0)), at(2026, 11, 1, 0, 0))
+        # 只有一个有限制时按它匹配
+        self.assertEqual(self.next('0 0 1 * *'), at(2026, 11, 1, 0, 0))
+        self.assertEqual(self.next('0 0 * * mon'), at(2026, 10, 19, 0, 0))
+        self.assertEqual(self.next('0 0 1-31 * mon'), at(2026, 10, 18, 0, 0))
+
+    def test_next_after(self):
+        # 不含 t 所在的分钟
+        self.assertEqual(self.next('* * * * *'), at(2026, 10, 17, 10, 6))
+        self.assertEqual(self.next('5 10 * * *'), at(2026, 10, 18, 10, 5))
+        # 跨月、跨年和闰日
+        self.assertEqual(self.next('0 0 31 * *', at(2026, 10, 31, 0, 0)), at(2026, 12, 31, 0, 0))
+        self.assertEqual(self.next('0 0 29 2 *', at(2026, 3, 1)), at(2028, 2, 29, 0, 0))
+        self.assertEqual(self.next('59 23 31 12 *', at(2026, 12, 31, 23, 59)), at(2027, 12, 31, 23, 59))
+
+    def test_invalid(self):
+        for expr in ('* * * *', '* * * * * *', '60 * * * *', '* 24 * * *', '0 0 0 * *', '0 0 * 13 *',
+                     '0 0 * * 8', '5-1 * * * *', 'x * * * *', '0 0 * foo *', '*/x * * * *'):
+            with self.assertRaises(ValueError, msg=expr):
+                bm.CronSchedule(expr)
+        with self.assertRaises(ValueError):
+            self.next('0 0 31 2 *')
+
+
+class DaemonProtocolTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.socket_path = Path(self.tmp.name) / 'daemon.sock'
+        self.daemon = bm.BackupDaemon(jobs=4, per_host=1, jitter=0, socket_path=self.socket_path)
+        self.daemon.slots = asyncio.Semaphore(self.daemon.jobs)
+        self.daemon.host_slots = {}
+        for name in ('app', 'web', 'other'):
+            host = 'h2' if name == 'other' else 'h1'
+            self.daemon.projects[name] = {'name': name, 'host': host}
+            self.daemon.state[name] = {'host': host, 'state': 'idle', 'runs': 0, 'failures': 0, 'skipped': 0}
+
+        # 备份在线程池中执行，gate 放行前一直阻塞
+        self.gate = threading.Event()
+        self.addCleanup(self.gate.set)
+        self.calls = []
+        self.daemon._backup = self.backup
+        self.daemon._write_metrics = lambda: None
+
+        output = contextlib.redirect_stdout(io.StringIO())
+        output.__enter__()
+        self.addCleanup(output.__exit__, None, None, None)
+        self.server = await asyncio.start_unix_server(self.daemon._handle_client, path=str(self.socket_path))
+
+    async def asyncTearDown(self):
+        self.gate.set()
+        self.server.close()
+        await self.server.wait_closed()
+        await asyncio.gather(*self.daemon.running.values(), return_exceptions=True)
+
+    def backup(self, project, options) -> bool:
+        self.calls.append((project['name'], options))
+        self.gate.wait(10)
+        return project['name'] != 'other'
+
+    async def request(self, request):
+        return await asyncio.get_running_loop().run_in_executor(
+            None, bm.daemon_request, request, self.socket_path)
+
+    async def raw(self, line: bytes) -> dict:
+        reader, writer = await asyncio.open_unix_connection(str(self.socket_path))
+        writer.write(line)
+        writer.write_eof()
+        await writer.drain()
+        response = bm.json.loads(await reader.readline())
+        writer.close()
+        return response
+
+    async def wait_state(self, name: str, state: str):
+        for _ in range(500):
+            if self.daemon.state[name]['state'] == state:
+                return
+            await asyncio.sleep(0.01)
+        self.fail(f"{name} 没有进入 {state} 状态")
+
+    async def test_status_and_errors(self):
+        response = await self.request({'cmd': 'status'})
+        self.assertTrue(response['ok'])
+        self.assertEqual(sorted(response['projects']), ['app', 'other', 'web'])
+        self.assertEqual(response['projects']['app']['state'], 'idle')
+
+        for request, error in (({'cmd': 'nope'}, '未知命令'), ({'cmd': 'trigger', 'project': 'missing'}, '不在调度中')):
+            response = await self.request(request)
+            self.assertFalse(response['ok'])
+            self.assertIn(error, response['error'])
+        for line in (b'not json\n', b'[1, 2]\n'):
+            response = await self.raw(line)
+            self.assertFalse(response['ok'])
+            self.assertIn('无效请求', response['error'])
+        # 没有请求行就关闭写端时视为 {}
+        self.assertIn('未知命令', (await self.raw(b''))['error'])
+        self.assertIsNone(bm.daemon_request({'cmd': 'status'}, Path(self.tmp.name) / 'missing.sock'))
+
+    async def test_trigger(self):
+        response = await self.request({'cmd': 'trigger', 'project': 'app', 'incremental': True, 'prune': 'daily'})
+        self.assertEqual(response, {'ok': True})
+        await self.wait_state('app', 'running')
+        self.assertEqual(self.calls, [('app', {'incremental': True, 'files_only': False, 'db_only': False,
+                                               'prune': 'daily'})])
+
+        # 同一项目的备份未结束时拒绝并计为跳过
+        response = await self.request({'cmd': 'trigger', 'project': 'app'})
+        self.assertFalse(response['ok'])
+        self.assertEqual(self.daemon.state['app']['skipped'], 1)
+        self.assertEqual((await self.request({'cmd': 'status'}))['projects']['app']['state'], 'running')
+
+        self.assertTrue((await self.request({'cmd': 'trigger', 'project': 'other'}))['ok'])
+        self.gate.set()
+        await asyncio.gather(*self.daemon.running.values())
+        self.assertEqual(self.daemon.running, {})
+        state = (await self.request({'cmd': 'status'}))['projects']
+        self.assertEqual((state['app']['state'], state['app']['runs'], state['app']['lastSuccess']), ('idle', 1, True))
+        self.assertEqual((state['other']['runs'], state['other']['failures']), (1, 1))
+
+    async def test_drain_cancels_queued(self):
+        # app 和 web 在同一主机上（每主机并发 1）: app 执行中，web 排队
+        for name in ('app', 'web'):
+            self.assertTrue((await self.request({'cmd': 'trigger', 'project': name}))['ok'])
+        await self.wait_state('app', 'running')
+        await self.wait_state('web', 'queued')
+
+        drain = asyncio.ensure_future(self.daemon._drain())
+        await asyncio.sleep(0.05)
+        # 执行中的备份不会被取消，等待它结束
+        self.assertFalse(drain.done())
+        self.gate.set()
+        await asyncio.wait_for(drain, 10)
+
+        self.assertEqual([name for name, _ in self.calls], ['app'])
+        self.assertEqual(self.daemon.running, {})
+        self.assertEqual((self.daemon.state['web']['state'], self.daemon.state['web']['runs']), ('idle', 0))
+        self.assertEqual(self.daemon.state['app']['runs'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+"""差异还原计划: RestoreManager._plan_delta（不经 SSH，直接比较备份与远程的清单）"""
+
+import unittest
+
+from tests import load_back_mgr
+
+bm = load_back_mgr()
+
+MTIME = 1700000000
+
+
+class PlanDeltaTest(unittest.TestCase):
+
+    def setUp(self):
+        # 备份中的文件 {相对路径: [大小, mtime, 哈希]}
+        self.listing = {
+            'same.txt': [4, MTIME, 'h-same'],
+            'missing.txt': [5, MTIME, 'h-missing'],
+            'resized.txt': [6, MTIME, 'h-resized'],
+            'touched.txt': [7, MTIME, 'h-touched'],
+            'edited.txt': [8, MTIME, 'h-edited'],
+            'unhashed.txt': [9, MTIME, None],
+            'link': [None, MTIME, None],
+            'sub/deep/file': [1, MTIME, 'h-deep'],
+        }
+        self.backup_dirs = {'empty'}
+        # 远程现状
+        self.current = {
+            'same.txt': [4, MTIME, None],
+            'resized.txt': [60, MTIME, None],
+            'touched.txt': [7, MTIME + 60, None],
+            'edited.txt': [8, MTIME + 60, None],
+            'unhashed.txt': [9, MTIME + 60, None],
+            'link': [3, MTIME + 60, None],
+            'sub/deep/file': [1, MTIME, None],
+            'extra.txt': [1, MTIME, None],
+            'old/nested/x': [1, MTIME, None],
+            'cache/build.tmp': [1, MTIME, None],
+            'node_modules/pkg/index.js': [1, MTIME, None],
+        }
+        self.remote_dirs = {'sub', 'sub/deep', 'old', 'old/nested', 'cache', 'node_modules', 'node_modules/pkg'}
+        self.exclude = ['node_modules/**', '*.tmp']
+        self.hashed = []
+
+    def hash_remote(self, paths):
+        self.hashed.append(sorted(paths))
+        return {'touched.txt': 'h-touched', 'edited.txt': 'h-other'}
+
+    def plan(self, patterns=None, hash_remote=None, hash_local=None):
+        return bm.RestoreManager._plan_delta(self.listing, self.backup_dirs, self.current, self.remote_dirs,
+                                             self.exclude, patterns, hash_remote or self.hash_remote, hash_local)
+
+    def test_files(self):
+        plan = self.plan()
+        self.assertEqual(plan['changed'], ['edited.txt', 'link', 'missing.txt', 'resized.txt', 'unhashed.txt'])
+        # 只有 mtime 不同、内容相同的文件改回 mtime
+        self.assertEqual(plan['touched'], {'touched.txt': MTIME})
+        # 只为备份侧哈希已知的文件计算远程哈希
+        self.assertEqual(self.hashed, [['edited.txt', 'touched.txt']])
+        self.assertEqual((plan['hashed'], plan['unchanged']), (2, 3))
+
+    def test_extra_and_missing_directories(self):
+        plan = self.plan()
+        self.assertEqual(plan['extra'], ['extra.txt', 'old/nested/x'])
+        self.assertEqual(plan['extraDirs'], ['old/nested', 'old', 'cache'])
+        self.assertEqual(plan['missingDirs'], ['empty'])
+        self.assertEqual((plan['early'], plan['blockingDirs']), ([], []))
+
+    def test_excluded_paths_never_deleted(self):
+        plan = self.plan()
+        deleted = plan['extra'] + plan['early'] + plan['extraDirs'] + plan['blockingDirs']
+        for rel in deleted:
+            self.assertFalse(bm.is_excluded(rel, self.exclude), rel)
+        self.assertNotIn('cache/build.tmp', deleted)
+        self.assertFalse([rel for rel in deleted if rel.startswith('node_modules')])
+
+    def test_file_and_directory_swaps(self):
+        # 备份中 a 是文件、远程是目录；备份中 b 是目录、远程是文件
+        self.listing.update({'a': [1, MTIME, 'h-a'], 'b/inner': [1, MTIME, 'h-b']})
+        self.current.update({'a/child': [1, MTIME, None], 'a/sub/grandchild': [1, MTIME, None], 'b': [2, MTIME, None]})
+        self.remote_dirs |= {'a', 'a/sub'}
+        plan = self.plan()
+        self.assertIn('a', plan['changed'])
+        self.assertIn('b/inner', plan['changed'])
+        # 解压之前先删除: 远程的文件 b，以及目录 a 及其内容（子目录在前）
+        self.assertEqual(plan['early'], ['a/child', 'a/sub/grandchild', 'b'])
+        self.assertEqual(plan['blockingDirs'], ['a/sub', 'a'])
+        self.assertNotIn('a', plan['extraDirs'])
+        self.assertNotIn('b', plan['extra'])
+
+    def test_patterns(self):
+        plan = self.plan(patterns=['sub/**', 'old/**', 'resized.txt'])
+        self.assertEqual(plan['changed'], ['resized.txt'])
+        self.assertEqual(plan['extra'], ['old/nested/x'])
+        self.assertEqual(plan['extraDirs'], ['old/nested'])
+        self.assertEqual(plan['missingDirs'], [])
+        self.assertEqual(self.hashed, [])
+
+    def test_hash_local_and_remote_failure(self):
+        self.listing['touched.txt'][2] = None
+        plan = self.plan(hash_local=lambda rel: f'h-{rel.split(".")[0]}')
+        self.assertEqual(plan['touched'], {'touched.txt': MTIME})
+        # 备份侧哈希由 hash_local 补上后才与远程比较
+        self.assertEqual(self.hashed, [['edited.txt', 'touched.txt', 'unhashed.txt']])
+        self.assertIn('unhashed.txt', plan['changed'])
+        self.assertIsNone(self.plan(hash_remote=lambda paths: None))
+
+    def test_identical(self):
+        self.current = {rel: [size if size is not None else 1, mtime, None]
+                        for rel, (size, mtime, _) in self.listing.items()}
+        self.remote_dirs = {'sub', 'sub/deep', 'empty'}
+        plan = self.plan()
+        self.assertEqual((plan['changed'], plan['extra'], plan['extraDirs'], plan['missingDirs'], plan['touched']),
+                         ([], [], [], [], {}))
+        self.assertEqual(plan['unchanged'], len(self.listing))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+"""Prometheus 指标: MetricsExporter 增量读取运行日志、轮转/截断后重新汇总、输出格式与标签转义"""
+
+import os
+import re
+import tempfile
+import unittest
+from pathlib import Path
+
+from tests import load_back_mgr
+
+bm = load_back_mgr()
+
+SAMPLE = re.compile(r'([a-z_]+)\{((?:[a-z_]+="(?:[^"\\\n]|\\[\\"n])*",?)*)\} (\S+)')
+LABEL = re.compile(r'([a-z_]+)="((?:[^"\\\n]|\\[\\"n])*)"')
+
+
+def record(project: str, success: bool = True, time: float = 1700000000.0, phases=None) -> dict:
+    return {
+        'project': project, 'time': time, 'success': success, 'duration': 2.5, 'bytes': 100,
+        'phases': phases if phases is not None else [
+            {'name': 'files:stream', 'success': success, 'duration': 2.0, 'bytes': 100, 'rawBytes': 400},
+            {'name': 'manifest', 'success': True, 'duration': 0.1, 'bytes': 0},
+        ],
+    }
+
+
+def parse(text: str) -> dict:
+    """按 Prometheus 文本格式解析，返回 {(指标, ((标签, 值), ...)): 数值}；格式不正确时抛出 AssertionError"""
+    samples, declared = {}, {}
+    assert text.endswith('\n')
+    for line in text.splitlines():
+        if line.startswith('# HELP '):
+            declared.setdefault(line.split()[2], set()).add('help')
+        elif line.startswith('# TYPE '):
+            _, _, name, kind = line.split()
+            assert kind in ('gauge', 'counter')
+            declared.setdefault(name, set()).add('type')
+        else:
+            match = SAMPLE.fullmatch(line)
+            assert match, line
+            name, labels, value = match.groups()
+            assert declared.get(name) == {'help', 'type'}, name
+            key = (name, tuple(LABEL.findall(labels)))
+            assert key not in samples, key
+            samples[key] = float(value)
+    return samples
+
+
+class MetricsExporterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp.name) / 'runs.jsonl'
+        self.log = bm.RunLog(self.path)
+        self.exporter = bm.MetricsExporter(self.log)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def runs(self, project: str = 'app') -> tuple:
+        summary = self.exporter.projects[project]
+        return summary['runs'], summary['failures']
+
+    def test_refresh_reads_only_appended_lines(self):
+        self.log.append(record('app'))
+        self.log.append(record('app', success=False))
+        self.exporter.refresh()
+        self.assertEqual(self.runs(), (2, 1))
+        self.assertEqual(self.exporter.projects['app']['phaseFailures'], {'files:stream': 1, 'manifest': 0})
+
+        # 已读过的行被原地改写（长度不变）不影响汇总: 只读取之后追加的行
+        data = self.path.read_bytes()
+        self.path.write_bytes(data.replace(b'"success": false', b'"success": 12345'))
+        self.log.append(record('app', time=1700000100.0))
+        self.exporter.refresh()
+        self.assertEqual(self.runs(), (3, 1))
+        self.assertEqual(self.exporter._position[1], self.path.stat().st_size)
+
+    def test_partial_last_line(self):
+        self.log.append(record('app'))
+        line = bm.json.dumps(record('app', success=False)) + '\n'
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(line[:30])
+        self.exporter.refresh()
+        self.assertEqual(self.runs(), (1, 0))
+
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(line[30:])
+        self.exporter.refresh()
+        self.assertEqual(self.runs(), (2, 1))
+
+    def test_rotation_and_truncation(self):
+        self.log.append(record('app'))
+        self.log.append(record('old'))
+        self.exporter.refresh()
+        self.assertEqual(sorted(self.exporter.projects), ['app', 'old'])
+
+        # 轮转: 日志被改名，新文件从头开始
+        os.rename(self.path, self.path.with_name('runs.jsonl.1'))
+        self.log.append(record('app', success=False))
+        self.exporter.refresh()
+        self.assertEqual(sorted(self.exporter.projects), ['app'])
+        self.assertEqual(self.runs(), (1, 1))
+
+        # 截断（copytruncate）后重新汇总
+        self.path.write_text('')
+        self.log.append(record('new'))
+        self.exporter.refresh()
+        self.assertEqual(sorted(self.exporter.projects), ['new'])
+
+        self.path.unlink()
+        self.exporter.refresh()
+        self.assertEqual(self.exporter.projects, {})
+
+    def test_render(self):
+        odd = 'we"ird\\name\nx'
+        self.log.append(record('app', success=False, time=1700000000.0))
+        self.log.append(record('app', time=1700000100.0))
+        self.log.append(record(odd, phases=[]))
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write('not json\n')
+        text = self.exporter.render({'app': {'state': 'queued', 'skipped': 2}})
+        samples = parse(text)
+
+        app = (('project', 'app'),)
+        self.assertEqual(samples[('backmgr_runs_total', app)], 2)
+        self.assertEqual(samples[('backmgr_failures_total', app)], 1)
+        self.assertEqual(samples[('backmgr_last_run_success', app)], 1)
+        self.assertEqual(samples[('backmgr_last_success_timestamp_seconds', app)], 1700000100.0)
+        self.assertEqual(samples[('backmgr_last_run_compression_ratio', app)], 4.0)
+        self.assertEqual(samples[('backmgr_phase_failures_total', (('project', 'app'), ('phase', 'files:stream')))], 1)
+        self.assertEqual(samples[('backmgr_daemon_running', app)], 1)
+        self.assertEqual(samples[('backmgr_daemon_skipped_total', app)], 2)
+
+        escaped = (('project', 'we\\"ird\\\\name\\nx'),)
+        self.assertEqual(samples[('backmgr_runs_total', escaped)], 1)
+        self.assertIn('project="we\\"ird\\\\name\\nx"', text)
+
+        # 写入文件的内容与 render 一致
+        out = Path(self.tmp.name) / 'metrics' / 'backmgr.prom'
+        self.exporter.write(out)
+        self.assertEqual(parse(out.read_text(encoding='utf-8')), parse(self.exporter.render()))
+        self.assertEqual([p.name for p in out.parent.iterdir()], ['backmgr.prom'])
+
+    def test_empty_log(self):
+        self.assertEqual(self.exporter.render(), '\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
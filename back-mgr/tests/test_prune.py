@@ -0,0 +1,127 @@
+"""保留策略: PruneManager 选择保留版本、增量链依赖、总占用上限和按 inode 计算的释放空间"""
+
+import contextlib
+import gzip
+import io
+import json
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from tests import load_back_mgr
+
+bm = load_back_mgr()
+
+
+class PruneTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.local = Path(self.tmp.name)
+        self.base = self.local / 'backups'
+        self.base.mkdir()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def version(self, name: str, success: bool = True, complete: bool = True, parent: str = None,
+                files: dict = None) -> Path:
+        """创建版本目录: files 为 {相对路径: 内容或 (链接到的版本, 相对路径)}"""
+        path = self.base / name
+        (path / 'files').mkdir(parents=True)
+        if complete:
+            (path / 'manifest.json').write_text(json.dumps({'success': success}))
+        if parent is not None:
+            with gzip.open(path / 'files' / bm.FILE_INDEX_NAME, 'wt', encoding='utf-8') as f:
+                json.dump({'parent': parent or None, 'files': {}}, f)
+        for rel, data in (files or {}).items():
+            target = path / 'files' / rel
+            if isinstance(data, tuple):
+                os.link(self.base / data[0] / 'files' / data[1], target)
+            else:
+                target.write_bytes(data)
+        return path
+
+    def manager(self, **policy) -> 'bm.PruneManager':
+        return bm.PruneManager({'name': 'p', 'localPath': str(self.local)}, policy)
+
+    def select(self, **policy):
+        manager = self.manager(**policy)
+        versions = manager._load_versions()
+        keep, reasons = manager._select(versions, manager._scan_inodes(versions))
+        return keep, reasons
+
+    def test_periods_are_a_union(self):
+        for name in ('2026-10-17_100000', '2026-10-17_080000', '2026-10-16_120000',
+                     '2026-10-10_120000', '2026-09-20_120000', '2026-08-01_120000'):
+            self.version(name)
+        keep, reasons = self.select(keepDaily=2, keepWeekly=2, keepMonthly=3)
+        self.assertEqual(keep, {'2026-10-17_100000', '2026-10-16_120000', '2026-10-10_120000',
+                                '2026-09-20_120000', '2026-08-01_120000'})
+        self.assertEqual(reasons['2026-10-17_100000'], ['每日', '每周', '每月'])
+        self.assertEqual(reasons['2026-10-10_120000'], ['每周'])
+
+        keep, _ = self.select(keepLast=2, keepMonthly=1)
+        self.assertEqual(keep, {'2026-10-17_100000', '2026-10-17_080000'})
+
+    def test_incremental_parents_kept(self):
+        self.version('2026-10-01_120000', parent='')
+        self.version('2026-10-02_120000', parent='2026-10-01_120000')
+        self.version('2026-10-03_120000', parent='2026-10-02_120000')
+        self.version('2026-09-01_120000')
+        keep, reasons = self.select(keepLast=1)
+        self.assertEqual(keep, {'2026-10-01_120000', '2026-10-02_120000', '2026-10-03_120000'})
+        self.assertEqual(reasons['2026-10-01_120000'], ['被 2026-10-02_120000 依赖'])
+
+    def test_newest_success_always_kept(self):
+        self.version('2026-10-03_120000', success=False)
+        self.version('2026-10-02_120000', files={'a': b'x' * 100})
+        self.version('2026-10-01_120000', files={'a': b'x' * 100})
+        keep, reasons = self.select(keepMonthly=1, maxTotalBytes=1)
+        self.assertEqual(keep, {'2026-10-02_120000'})
+        self.assertEqual(reasons['2026-10-03_120000'], [])
+
+        # 只有 maxTotalBytes 时，最新的成功版本也会保留
+        keep, reasons = self.select(maxTotalBytes=1)
+        self.assertEqual(keep, {'2026-10-02_120000'})
+        self.assertEqual(reasons['2026-10-02_120000'], ['最新'])
+
+    def test_incomplete_versions_skipped(self):
+        self.version('2026-10-03_120000', complete=False)
+        self.version('2026-10-02_120000')
+        self.version('2026-10-01_120000')
+        keep, _ = self.select(keepLast=1, maxTotalBytes=1)
+        self.assertEqual(keep, {'2026-10-03_120000', '2026-10-02_120000'})
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertTrue(self.manager(keepLast=1).prune())
+        self.assertEqual(sorted(p.name for p in self.base.iterdir()), ['2026-10-02_120000', '2026-10-03_120000'])
+
+    def test_hard_links_counted_once(self):
+        self.version('2026-10-01_120000', files={'shared': b's' * 1000, 'old': b'o' * 500})
+        self.version('2026-10-02_120000', files={'shared': ('2026-10-01_120000', 'shared'), 'new': b'n' * 300})
+        manager = self.manager()
+        versions = manager._load_versions()
+        inodes = manager._scan_inodes(versions)
+        by_name = {v['name']: v for v in versions}
+        manifest = (self.base / '2026-10-01_120000' / 'manifest.json').stat().st_size
+
+        # 共享的 inode 只有在所有硬链接都被删除时才释放
+        self.assertEqual(manager._freed_bytes([by_name['2026-10-01_120000']], inodes), 500 + manifest)
+        self.assertEqual(manager._freed_bytes(versions, inodes), 1800 + 2 * manifest)
+
+        # 共享文件只计一次: 上限为两个版本的实际占用时都保留，1400 时去掉最旧的版本
+        keep, _ = self.select(keepLast=2, maxTotalBytes=1800 + 2 * manifest)
+        self.assertEqual(len(keep), 2)
+        keep, _ = self.select(keepLast=2, maxTotalBytes=1400)
+        self.assertEqual(keep, {'2026-10-02_120000'})
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.manager(keepLast=2, maxTotalBytes=1400).prune()
+        self.assertEqual((self.base / '2026-10-02_120000' / 'files' / 'shared').read_bytes(), b's' * 1000)
+        self.assertFalse((self.base / '2026-10-01_120000').exists())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,196 @@
+"""对象存储: S3Storage（对本机的 S3 替身）、LocalStorage 和按范围读取的 StoredObject"""
+
+import os
+import re
+import tempfile
+import threading
+import unittest
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from xml.sax.saxutils import escape
+
+from tests import load_back_mgr
+
+bm = load_back_mgr()
+
+
+class S3Stub:
+    """本机回环地址上的最小 S3 替身: 对象读写、Range、分段上传、ListObjectsV2（不校验签名）"""
+
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _parse(self):
+                url = urllib.parse.urlsplit(self.path)
+                query = dict(urllib.parse.parse_qsl(url.query, keep_blank_values=True))
+                parts = urllib.parse.unquote(url.path).lstrip('/').split('/', 1)
+                stub.requests.append((self.command, self.path, self.headers.get('Range')))
+                return (parts[1] if len(parts) > 1 else ''), query
+
+            def _send(self, status, body=b'', headers=None):
+                self.send_response(status)
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _body(self):
+                return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+            def do_PUT(self):
+                key, query = self._parse()
+                data = self._body()
+                if 'uploadId' in query:
+                    stub.uploads[query['uploadId']][int(query['partNumber'])] = data
+                    return self._send(200, headers={'ETag': f'"{query["partNumber"]}"'})
+                stub.objects[key] = data
+                self._send(200)
+
+            def do_POST(self):
+                key, query = self._parse()
+                self._body()
+                if 'uploads' in query:
+                    upload_id = str(len(stub.uploads) + 1)
+                    stub.uploads[upload_id] = {}
+                    return self._send(200, f'<InitiateMultipartUploadResult><UploadId>{upload_id}'
+                                           f'</UploadId></InitiateMultipartUploadResult>'.encode())
+                parts = stub.uploads.pop(query['uploadId'])
+                stub.objects[key] = b''.join(parts[n] for n in sorted(parts))
+                self._send(200, b'<CompleteMultipartUploadResult/>')
+
+            def do_DELETE(self):
+                key, query = self._parse()
+                if 'uploadId' in query:
+                    stub.uploads.pop(query['uploadId'], None)
+                else:
+                    stub.objects.pop(key, None)
+                self._send(204)
+
+            def do_GET(self):
+                key, query = self._parse()
+                if query.get('list-type') == '2':
+                    return self._send(200, self._list(query.get('prefix', ''), query.get('delimiter')))
+                if key not in stub.objects:
+                    return self._send(404, b'<Error><Code>NoSuchKey</Code><Message>missing</Message></Error>')
+                data = stub.objects[key]
+                match = re.fullmatch(r'bytes=(\d+)-(\d+)', self.headers.get('Range') or '')
+                if not match:
+                    return self._send(200, data)
+                start, end = int(match.group(1)), int(match.group(2))
+                self._send(206, data[start:end + 1])
+
+            def _list(self, prefix, delimiter):
+                keys = sorted(k for k in stub.objects if k.startswith(prefix))
+                contents, prefixes = [], set()
+                for key in keys:
+                    rest = key[len(prefix):]
+                    if delimiter and delimiter in rest:
+                        prefixes.add(prefix + rest.split(delimiter, 1)[0] + delimiter)
+                    else:
+                        contents.append(f'<Contents><Key>{escape(key)}</Key>'
+                                        f'<Size>{len(stub.objects[key])}</Size></Contents>')
+                common = ''.join(f'<CommonPrefixes><Prefix>{escape(p)}</Prefix></CommonPrefixes>'
+                                 for p in sorted(prefixes))
+                return f'<ListBucketResult>{"".join(contents)}{common}</ListBucketResult>'.encode()
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.endpoint = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class S3StorageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stub = S3Stub()
+        self.storage = bm.S3Storage({'endpoint': self.stub.endpoint, 'bucket': 'backups', 'prefix': 'app',
+                                     'accessKey': 'test', 'secretKey': 'test', 'partSizeMB': 5, 'threads': 3})
+        self.tmp = tempfile.TemporaryDirectory()
+        self.data = os.urandom(11 * 1024 * 1024 + 123)
+
+    def tearDown(self):
+        self.storage.pool.shutdown()
+        self.stub.close()
+        self.tmp.cleanup()
+
+    def test_multipart_round_trip(self):
+        src = Path(self.tmp.name) / 'src'
+        src.write_bytes(self.data)
+        self.assertEqual(self.storage.put_file('backups/v1/files/backup_1.tar.gz', src), len(self.data))
+        self.assertEqual(self.stub.objects['app/backups/v1/files/backup_1.tar.gz'], self.data)
+        self.assertFalse(self.stub.uploads)
+
+        dst = Path(self.tmp.name) / 'dst'
+        self.assertEqual(self.storage.get_file('backups/v1/files/backup_1.tar.gz', dst, len(self.data)),
+                         len(self.data))
+        self.assertEqual(dst.read_bytes(), self.data)
+
+    def test_list_read_delete(self):
+        self.storage.open_writer('backups/v1/manifest.json').close()
+        with self.storage.open_writer('backups/v2/files/a') as f:
+            f.write(b'abc')
+        self.assertEqual(self.storage.list_dirs('backups/'), ['v1', 'v2'])
+        self.assertEqual(self.storage.list('backups/v2/'), {'backups/v2/files/a': 3})
+        self.assertEqual(self.storage.read_bytes('backups/v2/files/a'), b'abc')
+        self.assertIsNone(self.storage.read_bytes('backups/v3/manifest.json'))
+        self.assertEqual(self.storage.read_range('backups/v2/files/a', 1, 2), b'bc')
+        self.storage.delete('backups/v2/files/a')
+        self.assertEqual(self.storage.list('backups/v2/'), {})
+
+    def test_stored_object_reader(self):
+        self.stub.objects['app/obj'] = self.data
+        obj = bm.StoredObject(self.storage, 'obj', len(self.data), Path('/cache/backups/v1/files/obj'))
+        with obj.open() as reader:
+            pieces = iter(lambda: reader.read(bm.STREAM_CHUNK_SIZE), b'')
+            self.assertEqual(b''.join(pieces), self.data)
+        self.assertEqual(obj.pread(10, len(self.data) - 4), self.data[-4:])
+        self.assertEqual(obj.pread(10, len(self.data)), b'')
+        # 只用范围请求读取，每个范围不超过一个分段
+        ranges = [r for method, _, r in self.stub.requests if method == 'GET']
+        self.assertTrue(ranges and all(ranges))
+
+    @unittest.skipIf(bm.AESGCM is None, 'cryptography 未安装')
+    def test_decrypting_stored_object(self):
+        key = os.urandom(32)
+        path = Path(self.tmp.name) / 'backup_1.tar.gz'
+        with bm.EncryptingWriter(open(path, 'wb'), key) as writer:
+            writer.write(self.data)
+        self.storage.put_file('enc', path)
+        obj = bm.StoredObject(self.storage, 'enc', path.stat().st_size, path)
+        self.assertTrue(bm.is_encrypted(obj))
+        with bm.DecryptingReader(obj, key) as reader:
+            self.assertEqual(reader.read(), self.data)
+
+        self.stub.objects['app/enc'] = self.stub.objects['app/enc'][:-1]
+        obj = bm.StoredObject(self.storage, 'enc', path.stat().st_size - 1, path)
+        with self.assertRaises(IOError), bm.DecryptingReader(obj, key) as reader:
+            reader.read()
+
+
+class LocalStorageTest(unittest.TestCase):
+
+    def test_read_range(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            storage = bm.LocalStorage({'path': tmp})
+            with storage.open_writer('backups/v1/files/backup_1.tar') as f:
+                f.write(b'0123456789')
+            self.assertEqual(storage.list('backups/'), {'backups/v1/files/backup_1.tar': 10})
+            self.assertEqual(storage.read_range('backups/v1/files/backup_1.tar', 3, 4), b'3456')
+            with self.assertRaises(IOError):
+                storage.read_range('backups/v1/files/backup_1.tar', 8, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,183 @@
+"""SSH 传输: SSHConnection（ssh 命令，经假 ssh）与 ParamikoConnection（回环 paramiko 服务端）跑同一组用例
+
+覆盖 run/popen 的 stdin/stdout/stderr、退出码、大数据流、超时，以及 wait/poll/kill 的行为。
+"""
+
+import getpass
+import hashlib
+import os
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from tests import load_back_mgr
+from tests.sshd import ParamikoServer, install_ssh_shim, paramiko
+
+bm = load_back_mgr()
+
+LARGE = 24 * 1024 * 1024
+
+
+class TransportCases:
+    """两种传输共用的用例；子类提供 connect()"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.dir = Path(self.tmp.name)
+        self.ssh = self.connect()
+        self.ssh.open()
+        self.addCleanup(self.ssh.close)
+
+    def test_run_captures_output_and_exit_code(self):
+        result = self.ssh.run('echo out; echo err >&2; exit 3')
+        self.assertEqual((result.returncode, result.stdout, result.stderr), (3, 'out\n', 'err\n'))
+
+        result = self.ssh.run("printf '\\377\\000'", text=False)
+        self.assertEqual((result.returncode, result.stdout), (0, b'\xff\x00'))
+
+    def test_run_with_files(self):
+        source = self.dir / 'in'
+        source.write_bytes(b'hello\n' * 1000)
+        target = self.dir / 'out'
+        with open(source, 'rb') as stdin, open(target, 'wb') as stdout:
+            result = self.ssh.run('tr a-z A-Z', stdin=stdin, stdout=stdout)
+        self.assertEqual((result.returncode, result.stdout), (0, None))
+        self.assertEqual(target.read_bytes(), b'HELLO\n' * 1000)
+
+    def test_run_timeout(self):
+        start = time.monotonic()
+        with self.assertRaises(subprocess.TimeoutExpired):
+            self.ssh.run('sleep 3', timeout=0.5)
+        self.assertLess(time.monotonic() - start, 2.5)
+
+    def test_popen_large_streams(self):
+        data = os.urandom(LARGE)
+        proc = self.ssh.popen('cat; echo done >&2', stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                              stderr=subprocess.PIPE)
+
+        def feed():
+            proc.stdin.write(data)
+            proc.stdin.close()
+
+        writer = threading.Thread(target=feed)
+        writer.start()
+        digest, size = hashlib.sha256(), 0
+        for piece in iter(lambda: proc.stdout.read(1 << 20), b''):
+            digest.update(piece)
+            size += len(piece)
+        writer.join()
+        self.assertEqual(proc.stderr.read(), b'done\n')
+        self.assertEqual(proc.wait(), 0)
+        self.assertEqual((size, digest.hexdigest()), (LARGE, hashlib.sha256(data).hexdigest()))
+        proc.stdout.close()
+        proc.stderr.close()
+
+    def test_popen_output_to_file_and_devnull(self):
+        target = self.dir / 'zeros'
+        with open(target, 'wb') as f:
+            proc = self.ssh.popen(f'head -c {LARGE} /dev/zero', stdin=subprocess.DEVNULL, stdout=f)
+            self.assertEqual(proc.wait(), 0)
+        self.assertEqual(target.stat().st_size, LARGE)
+
+        proc = self.ssh.popen('cat; exit 7', stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL)
+        self.assertEqual(proc.wait(), 7)
+        self.assertEqual(proc.returncode, 7)
+
+    def test_reader_closes_early(self):
+        # 本地读取方提前关闭管道: 远程命令结束（SIGPIPE 或通道关闭），不会一直阻塞
+        proc = self.ssh.popen('yes', stdin=subprocess.DEVNULL, stdout=subprocess.PIPE)
+        self.assertEqual(len(proc.stdout.read(65536)), 65536)
+        proc.stdout.close()
+        self.assertNotEqual(proc.wait(timeout=10), 0)
+
+    def test_wait_poll_and_kill(self):
+        proc = self.ssh.popen('sleep 5', stdin=subprocess.DEVNULL)
+        self.assertIsNone(proc.poll())
+        with self.assertRaises(subprocess.TimeoutExpired):
+            proc.wait(timeout=0.2)
+        proc.kill()
+        self.assertNotEqual(proc.wait(timeout=5), 0)
+        self.assertEqual(proc.poll(), proc.returncode)
+
+        proc = self.ssh.popen('exit 4', stdin=subprocess.DEVNULL)
+        for _ in range(500):
+            if proc.poll() is not None:
+                break
+            time.sleep(0.01)
+        self.assertEqual(proc.returncode, 4)
+
+    def test_dedicated_and_calls(self):
+        calls = self.ssh.calls
+        proc = self.ssh.popen('echo dedicated', stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, dedicated=True)
+        self.assertEqual(proc.stdout.read(), b'dedicated\n')
+        proc.stdout.close()
+        self.assertEqual(proc.wait(), 0)
+        self.assertTrue(self.ssh.has_command('sh'))
+        self.assertFalse(self.ssh.has_command('no-such-command-here'))
+        self.assertEqual((self.ssh.calls - calls, self.ssh.dedicated), (3, 1))
+
+    def test_list_and_hash_files(self):
+        root = self.dir / 'my tree'
+        (root / 'sub').mkdir(parents=True)
+        (root / 'sub' / 'a b.txt').write_bytes(b'abc')
+        (root / 'skip.tmp').write_bytes(b'x')
+        files = self.ssh.list_files(str(root), ['*.tmp'])
+        self.assertEqual(sorted(files), ['sub/a b.txt'])
+        self.assertEqual(files['sub/a b.txt'][0], 3)
+        self.assertEqual(self.ssh.list_dirs(str(root), []), {'sub'})
+        self.assertEqual(self.ssh.hash_files(str(root), ['sub/a b.txt']),
+                         {'sub/a b.txt': hashlib.sha256(b'abc').hexdigest()})
+
+
+class SubprocessTransportTest(TransportCases, unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.bin = tempfile.TemporaryDirectory()
+        install_ssh_shim(Path(cls.bin.name))
+        cls.env = mock.patch.dict(os.environ, {'PATH': f'{cls.bin.name}{os.pathsep}{os.environ["PATH"]}',
+                                               'BENCH_RATE': '', 'BENCH_RTT': ''})
+        cls.env.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.env.stop()
+        cls.bin.cleanup()
+
+    def connect(self):
+        return bm.SSHConnection({'host': 'loopback', 'user': 'test'})
+
+
+@unittest.skipIf(paramiko is None, '未安装 paramiko')
+class ParamikoTransportTest(TransportCases, unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.home = tempfile.TemporaryDirectory()
+        cls.env = mock.patch.dict(os.environ, {'HOME': cls.home.name})
+        cls.env.start()
+        cls.server = ParamikoServer(Path(cls.home.name))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.close()
+        cls.env.stop()
+        cls.home.cleanup()
+
+    def connect(self):
+        return bm.ParamikoConnection({'host': '127.0.0.1', 'port': self.server.port, 'user': getpass.getuser()})
+
+    def setUp(self):
+        super().setUp()
+        # 连接失败时会静默回退为 ssh 命令，这里必须是 paramiko 通道
+        self.assertIsNotNone(self.ssh.client)
+
+
+if __name__ == '__main__':
+    unittest.main()